@@ -0,0 +1 @@
+"""处理器和数据库的基准测试，用假的 bot 和合成的 Update 驱动真实的处理器，运行方式见 __main__.py"""
\ No newline at end of file
@@ -0,0 +1,150 @@
+"""运行基准测试：
+
+    python -m benchmarks --users 10000 --groups 10 --messages 50000 --participants 5000
+    python -m benchmarks --scenarios messages,daily --compare benchmarks/results/<上次的结果>.json
+
+结果保存为 JSON，--compare 与之前的结果比较，吞吐量下降或 p99 延迟上升超过阈值时以非零状态退出
+"""
+import argparse
+import gc
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+os.environ.setdefault('SUPER_ADMIN', '0')
+
+from .scenarios import SCENARIOS, BenchmarkEnv
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+def run_scenario(scenario, params, trace_memory=False):
+    """在新的环境中运行一个场景，返回每个操作的耗时、总耗时和内存峰值"""
+    env = BenchmarkEnv(params['users'], params['groups'], params['seed'])
+    try:
+        gc.collect()
+        if trace_memory:
+            tracemalloc.start()
+
+        latencies = []
+        for op in scenario.prepare(env, params):
+            start = time.perf_counter()
+            op()
+            latencies.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        scenario.finish(env)
+        finish = time.perf_counter() - start
+
+        peak = 0
+        if trace_memory:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        return latencies, sum(latencies) + finish, peak
+    finally:
+        env.close()
+
+def measure(name, params, trace_memory=True):
+    scenario = SCENARIOS[name]
+    latencies, seconds, _ = run_scenario(scenario, params)
+    # 内存单独跑一遍，避免 tracemalloc 的开销影响耗时
+    peak = run_scenario(scenario, params, trace_memory=True)[2] if trace_memory else 0
+    return {
+        'ops': len(latencies),
+        'seconds': round(seconds, 4),
+        'ops_per_sec': round(len(latencies) / seconds, 1) if seconds else 0.0,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'peak_mb': round(peak / 1024 / 1024, 2)
+    }
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, baseline, threshold):
+    """与之前的结果比较，返回退化的场景列表"""
+    regressions = []
+    for name, current in results.items():
+        previous = baseline['results'].get(name)
+        if not previous:
+            continue
+        throughput = current['ops_per_sec'] / previous['ops_per_sec'] - 1 if previous['ops_per_sec'] else 0
+        p99 = current['p99_ms'] / previous['p99_ms'] - 1 if previous['p99_ms'] else 0
+        regressed = throughput < -threshold or p99 > threshold
+        print(f"{name:<14} throughput {throughput:+7.1%}  p99 {p99:+7.1%}{'  REGRESSION' if regressed else ''}")
+        if regressed:
+            regressions.append(name)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='处理器和数据库的基准测试')
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--groups', type=int, default=10)
+    parser.add_argument('--messages', type=int, default=50000)
+    parser.add_argument('--participants', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='逗号分隔，可选：' + ','.join(SCENARIOS))
+    parser.add_argument('--no-memory', action='store_true', help='不测量内存峰值')
+    parser.add_argument('--output', help='结果文件，默认保存到 benchmarks/results/')
+    parser.add_argument('--compare', help='与之前的结果文件比较')
+    parser.add_argument('--threshold', type=float, default=0.1, help='判断退化的相对变化阈值')
+    args = parser.parse_args()
+
+    # 处理器按消息打印的日志不计入测量
+    logging.basicConfig(level=logging.WARNING)
+
+    params = {
+        'users': args.users, 'groups': args.groups, 'messages': args.messages,
+        'participants': args.participants, 'seed': args.seed
+    }
+    names = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    for name in names:
+        if name not in SCENARIOS:
+            parser.error(f"Unknown scenario: {name}")
+
+    results = {}
+    print(f"{'scenario':<14} {'ops':>8} {'ops/s':>12} {'p50 ms':>10} {'p99 ms':>10} {'peak MB':>9}")
+    for name in names:
+        result = measure(name, params, not args.no_memory)
+        results[name] = result
+        print(
+            f"{name:<14} {result['ops']:>8} {result['ops_per_sec']:>12.1f} "
+            f"{result['p50_ms']:>10.3f} {result['p99_ms']:>10.3f} {result['peak_mb']:>9.2f}"
+        )
+
+    output = args.output or os.path.join(RESULTS_DIR, f'{datetime.now().strftime("%Y%m%d_%H%M%S")}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump({
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'commit': git_commit(),
+            'python': sys.version.split()[0],
+            'params': params,
+            'results': results
+        }, f, indent=2)
+    print(f"Results saved to {output}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline['params'] != params:
+            print(f"Warning: baseline params differ: {baseline['params']}")
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
\ No newline at end of file
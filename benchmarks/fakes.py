@@ -0,0 +1,91 @@
+from telegram import Update
+from datetime import datetime
+from types import SimpleNamespace
+import itertools
+import random
+
+class FakeBot:
+    """代替 telegram.Bot：记录发出的消息，不发网络请求"""
+
+    defaults = None
+    id = 1
+    username = 'fake_bot'
+    request = SimpleNamespace(con_pool_size=1024)
+
+    def __init__(self, admins=()):
+        self.admins = set(admins)
+        self.sent = 0
+        self.calls = 0
+        self._message_ids = itertools.count(1)
+
+    def send_message(self, chat_id, text, *args, **kwargs):
+        self.sent += 1
+        return None
+
+    def edit_message_text(self, *args, **kwargs):
+        self.calls += 1
+        return True
+
+    def answer_callback_query(self, *args, **kwargs):
+        self.calls += 1
+        return True
+
+    def get_chat(self, chat_id, *args, **kwargs):
+        self.calls += 1
+        return SimpleNamespace(id=chat_id, username=f'group{abs(chat_id)}')
+
+    def get_chat_administrators(self, chat_id, *args, **kwargs):
+        return [FakeMember(user_id, 'administrator') for user_id in self.admins]
+
+    def get_chat_member(self, chat_id, user_id, *args, **kwargs):
+        return FakeMember(user_id, 'administrator' if user_id in self.admins else 'member')
+
+    def next_message_id(self):
+        return next(self._message_ids)
+
+class FakeMember:
+    def __init__(self, user_id, status):
+        self.user = FakeUser(user_id)
+        self.status = status
+
+class FakeUser:
+    def __init__(self, user_id):
+        self.id = user_id
+
+class FakeContext:
+    """代替 CallbackContext，只提供处理器用到的 bot 和 args"""
+
+    def __init__(self, bot, args=None):
+        self.bot = bot
+        self.args = args or []
+
+class UpdateFactory:
+    """构造与 Telegram 推送格式一致的 Update 对象"""
+
+    def __init__(self, bot, seed=0):
+        self.bot = bot
+        self.random = random.Random(seed)
+        self._update_ids = itertools.count(1)
+
+    def payload(self, chat_id, user_id, text, username=None):
+        """返回一条文字消息更新的 JSON 数据"""
+        user = {'id': user_id, 'is_bot': False, 'first_name': str(user_id), 'username': username or f'user{user_id}'}
+        chat = {'id': chat_id, 'type': 'supergroup' if chat_id < 0 else 'private', 'title': str(chat_id)}
+        message = {
+            'message_id': self.bot.next_message_id(),
+            'date': int(datetime.now().timestamp()),
+            'chat': chat,
+            'from': user,
+            'text': text
+        }
+        if text.startswith('/'):
+            command = text.split()[0]
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(command)}]
+        return {'update_id': next(self._update_ids), 'message': message}
+
+    def text(self, chat_id, user_id, text, username=None):
+        return Update.de_json(self.payload(chat_id, user_id, text, username), self.bot)
+
+    def random_text(self, min_length=1, max_length=60):
+        length = self.random.randint(min_length, max_length)
+        return ''.join(self.random.choice('积分抽奖机器人群组消息测试abcdefg ') for _ in range(length)).strip() or '好'
\ No newline at end of file
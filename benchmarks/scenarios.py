@@ -0,0 +1,144 @@
+from datetime import datetime, timedelta
+import os
+import shutil
+import tempfile
+from bot.database import Database
+from bot.handlers.message import MessageHandlers
+from bot.handlers.points import PointsHandlers
+from bot.handlers.lottery import LotteryHandlers
+from bot.sender import MessageSender
+from .fakes import FakeBot, FakeContext, UpdateFactory
+
+class BenchmarkEnv:
+    """一次测量使用的环境：临时目录中的数据库、假的 bot 和真实的处理器"""
+
+    def __init__(self, users, groups, seed=0):
+        self.users = users
+        self.groups = [-1000000000000 - i for i in range(groups)]
+        self.dir = tempfile.mkdtemp(prefix='points-bench-')
+        self.db = Database(os.path.join(self.dir, 'bench.db'))
+        self.bot = FakeBot()
+        self.factory = UpdateFactory(self.bot, seed)
+        self.random = self.factory.random
+
+        # 发送队列不启动，只测量入队和汇总
+        self.sender = MessageSender(self.bot)
+        self.message_handlers = MessageHandlers(self.db, self.sender)
+        self.points_handlers = PointsHandlers(self.db, self.sender)
+        self.lottery_handlers = LotteryHandlers(self.db, self.sender)
+
+        for group_id in self.groups:
+            self.db.allow_group(group_id)
+        self.db.apply_points_batch([(user_id, f'user{user_id}', 100, None, None) for user_id in range(1, users + 1)])
+
+    def random_user(self):
+        return self.random.randint(1, self.users)
+
+    def random_group(self):
+        return self.random.choice(self.groups)
+
+    def add_participants(self, lottery_id, count):
+        with self.db.transaction() as cursor:
+            cursor.executemany(
+                'INSERT OR IGNORE INTO lottery_participants (lottery_id, user_id, username) VALUES (?, ?, ?)',
+                [(lottery_id, user_id, f'user{user_id}') for user_id in range(1, count + 1)]
+            )
+
+    def close(self):
+        self.db.close()
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+class Scenario:
+    """一个测量场景：prepare 返回逐个计时的操作，finish 中的收尾工作计入总耗时"""
+
+    name = None
+
+    def prepare(self, env, params):
+        raise NotImplementedError
+
+    def finish(self, env):
+        pass
+
+class MessagesScenario(Scenario):
+    """群内普通消息的积分计算"""
+
+    name = 'messages'
+
+    def prepare(self, env, params):
+        context = FakeContext(env.bot)
+        for _ in range(params['messages']):
+            update = env.factory.text(env.random_group(), env.random_user(), env.factory.random_text())
+            yield lambda update=update: env.message_handlers.handle_message(update, context)
+
+    def finish(self, env):
+        env.db.points_buffer.flush()
+
+class KeywordJoinScenario(Scenario):
+    """发送口令参与抽奖"""
+
+    name = 'keyword_join'
+
+    def prepare(self, env, params):
+        group_id = env.groups[0]
+        env.db.create_lottery(group_id, 1, 0, '参与抽奖', datetime.now() + timedelta(hours=1), 0, 1, 'bench')
+        context = FakeContext(env.bot)
+        for user_id in range(1, min(params['participants'], env.users) + 1):
+            update = env.factory.text(group_id, user_id, '参与抽奖')
+            yield lambda update=update: env.message_handlers.handle_message(update, context)
+
+class JoinLotteryScenario(Scenario):
+    """/joinlottery 命令参与积分抽奖"""
+
+    name = 'joinlottery'
+
+    def prepare(self, env, params):
+        group_id = env.groups[0]
+        lottery_id = env.db.create_lottery(group_id, 1, 1, None, datetime.now() + timedelta(hours=1), 0, 1, 'bench')
+        context = FakeContext(env.bot, [str(lottery_id)])
+        for user_id in range(1, min(params['participants'], env.users) + 1):
+            update = env.factory.text(group_id, user_id, f'/joinlottery {lottery_id}')
+            yield lambda update=update: env.lottery_handlers.join_lottery(update, context)
+
+class DailyScenario(Scenario):
+    """/daily 每日签到"""
+
+    name = 'daily'
+
+    def prepare(self, env, params):
+        context = FakeContext(env.bot)
+        for user_id in range(1, env.users + 1):
+            update = env.factory.text(env.random_group(), user_id, '/daily')
+            yield lambda update=update: env.points_handlers.daily_checkin(update, context)
+
+class ExportScenario(Scenario):
+    """export_data 导出全部备份表"""
+
+    name = 'export_data'
+
+    def prepare(self, env, params):
+        lottery_id = env.db.create_lottery(env.groups[0], 1, 0, None, datetime.now() + timedelta(hours=1), 0, 1, 'bench')
+        env.add_participants(lottery_id, min(params['participants'], env.users))
+        yield env.db.export_data
+
+class ImportScenario(Scenario):
+    """import_data 导入到空数据库"""
+
+    name = 'import_data'
+
+    def prepare(self, env, params):
+        lottery_id = env.db.create_lottery(env.groups[0], 1, 0, None, datetime.now() + timedelta(hours=1), 0, 1, 'bench')
+        env.add_participants(lottery_id, min(params['participants'], env.users))
+        data = env.db.export_data()
+        target = Database(os.path.join(env.dir, 'import.db'))
+        try:
+            yield lambda: target.import_data(data)
+        finally:
+            target.close()
+
+SCENARIOS = {
+    scenario.name: scenario
+    for scenario in (
+        MessagesScenario(), KeywordJoinScenario(), JoinLotteryScenario(), DailyScenario(),
+        ExportScenario(), ImportScenario()
+    )
+}
\ No newline at end of file
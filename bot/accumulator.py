@@ -0,0 +1,127 @@
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+class PointsAccumulator:
+    """积分写缓冲：在内存中合并每个用户在各群组的积分增量和最后发言时间，按时间间隔或数量阈值批量写入账本"""
+
+    def __init__(self, db, flush_interval=5, flush_size=500):
+        self.db = db
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending = {}  # user_id -> [username, {group_id: 积分增量}, 最后发言时间]
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+        # 统计信息
+        self.flush_count = 0
+        self.flushed_users = 0
+        self.last_flush_latency = 0.0
+        self.max_flush_latency = 0.0
+
+    def add(self, user_id, username, points, message_time=None, group_id=None):
+        """记录一次积分变化，message_time 为空时不更新最后发言时间"""
+        with self._lock:
+            entry = self._pending.get(user_id)
+            if entry is None:
+                self._pending[user_id] = [username, {group_id: points}, message_time]
+            else:
+                entry[0] = username or entry[0]
+                entry[1][group_id] = entry[1].get(group_id, 0) + points
+                if message_time:
+                    entry[2] = message_time
+            pending = len(self._pending)
+
+        if pending >= self.flush_size:
+            self._wakeup.set()
+
+    def has_pending(self, user_id):
+        return user_id in self._pending
+
+    def pending_count(self):
+        return len(self._pending)
+
+    def pending_points(self):
+        with self._lock:
+            return sum(sum(entry[1].values()) for entry in self._pending.values())
+
+    def flush(self):
+        """将缓冲区中的数据在一个事务内写入数据库"""
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return 0
+                batch, self._pending = self._pending, {}
+
+            start = time.perf_counter()
+            try:
+                self.db.apply_points_batch([
+                    (user_id, username, delta, message_time, group_id)
+                    for user_id, (username, deltas, message_time) in batch.items()
+                    for group_id, delta in deltas.items()
+                ])
+            except Exception:
+                # 写入失败时把数据合并回缓冲区，等待下次刷新
+                with self._lock:
+                    for user_id, (username, deltas, message_time) in batch.items():
+                        entry = self._pending.get(user_id)
+                        if entry is None:
+                            self._pending[user_id] = [username, deltas, message_time]
+                        else:
+                            entry[0] = entry[0] or username
+                            for group_id, delta in deltas.items():
+                                entry[1][group_id] = entry[1].get(group_id, 0) + delta
+                            if message_time and (not entry[2] or message_time > entry[2]):
+                                entry[2] = message_time
+                raise
+
+            latency = time.perf_counter() - start
+            self.flush_count += 1
+            self.flushed_users += len(batch)
+            self.last_flush_latency = latency
+            self.max_flush_latency = max(self.max_flush_latency, latency)
+            return len(batch)
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+
+        def flush_task():
+            while not self._stopped.is_set():
+                self._wakeup.wait(self.flush_interval)
+                self._wakeup.clear()
+                try:
+                    self.flush()
+                except Exception as e:
+                    logger.error(f"Points flush failed: {str(e)}")
+
+        self._stopped.clear()
+        self._thread = threading.Thread(target=flush_task, name='points-flush')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """停止刷新线程并写入剩余数据"""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+        logger.info(f"Points accumulator stopped: {self.stats()}")
+
+    def stats(self):
+        return {
+            'pending_users': self.pending_count(),
+            'pending_points': self.pending_points(),
+            'flush_count': self.flush_count,
+            'flushed_users': self.flushed_users,
+            'last_flush_latency_ms': round(self.last_flush_latency * 1000, 2),
+            'max_flush_latency_ms': round(self.max_flush_latency * 1000, 2)
+        }
\ No newline at end of file
@@ -0,0 +1,90 @@
+from telegram import Update, ChatMember
+from telegram.ext import CallbackContext
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+ADMIN_STATUSES = (ChatMember.CREATOR, ChatMember.ADMINISTRATOR)
+
+class AdminCache:
+    """群组管理员缓存：每个群组用一次 get_chat_administrators 取得全部管理员，
+    过期后重新获取，期间根据成员变动更新，权限判断只是一次内存查找"""
+
+    def __init__(self, ttl=600):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._chat_locks = {}
+        self._admins = {}  # chat_id -> (管理员 user_id 集合, 获取时间)
+
+        # 统计信息
+        self.hits = 0
+        self.fetches = 0
+
+    def is_admin(self, bot, chat_id, user_id):
+        return user_id in self.get_admins(bot, chat_id)
+
+    def get_admins(self, bot, chat_id):
+        entry = self._admins.get(chat_id)
+        if entry and time.monotonic() - entry[1] < self.ttl:
+            self.hits += 1
+            return entry[0]
+
+        # 同一群组同时只发一次请求，其他线程等待结果
+        with self._lock:
+            chat_lock = self._chat_locks.setdefault(chat_id, threading.Lock())
+        with chat_lock:
+            entry = self._admins.get(chat_id)
+            if entry and time.monotonic() - entry[1] < self.ttl:
+                self.hits += 1
+                return entry[0]
+
+            try:
+                admins = {member.user.id for member in bot.get_chat_administrators(chat_id)}
+            except Exception as e:
+                if entry is None:
+                    raise
+                # 获取失败时继续使用过期的缓存
+                logger.warning(f"Failed to refresh admins of chat {chat_id}, using cached list: {str(e)}")
+                return entry[0]
+
+            self.fetches += 1
+            self._admins[chat_id] = (admins, time.monotonic())
+            return admins
+
+    def update_member(self, chat_id, user_id, status):
+        """根据成员的新状态更新缓存，未缓存的群组在下次查询时再获取"""
+        entry = self._admins.get(chat_id)
+        if entry is None:
+            return
+        admins = set(entry[0])
+        if status in ADMIN_STATUSES:
+            admins.add(user_id)
+        else:
+            admins.discard(user_id)
+        self._admins[chat_id] = (admins, entry[1])
+
+    def invalidate(self, chat_id):
+        self._admins.pop(chat_id, None)
+
+    def handle_chat_member(self, update: Update, context: CallbackContext):
+        """处理 chat_member / my_chat_member 更新"""
+        member_update = update.chat_member or update.my_chat_member
+        if member_update is None:
+            return
+
+        chat_id = member_update.chat.id
+        new_member = member_update.new_chat_member
+        if update.my_chat_member and new_member.status in (ChatMember.LEFT, ChatMember.KICKED):
+            # 机器人离开群组后不再需要该群组的缓存
+            self.invalidate(chat_id)
+            return
+        self.update_member(chat_id, new_member.user.id, new_member.status)
+
+    def stats(self):
+        return {
+            'cached_chats': len(self._admins),
+            'hits': self.hits,
+            'fetches': self.fetches
+        }
\ No newline at end of file
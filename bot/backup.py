@@ -1,93 +1,611 @@
-from webdav3.client import Client
+from concurrent.futures import ThreadPoolExecutor
+from bisect import bisect_right
+import gzip
+import hashlib
+import io
 import json
 import os
+import sqlite3
+import tempfile
+import threading
+import time
 from datetime import datetime
 import logging
+from config import (
+    BACKUP_FULL_EVERY, BACKUP_KEEP, BACKUP_CHUNK_ROWS, BACKUP_SPOOL_SIZE,
+    BACKUP_SNAPSHOT_FILE, BACKUP_SNAPSHOT_PAGES, BACKUP_SNAPSHOT_SLEEP,
+    BACKUP_RETRIES, BACKUP_RETRY_DELAY
+)
+from .backup_targets import SharedReader, with_retry
+from .database import BACKUP_TABLES
+from .metrics import registry
 
-class WebDAVBackup:
-    def __init__(self, config, database):
-        self.client = Client(config)
+MANIFEST_SUFFIX = '.manifest.json'
+CHUNK_DIR = 'backups/chunks'
+
+# 备份的监控指标
+BACKUP_SECONDS = registry.histogram(
+    'points_backup_seconds', '一次备份的耗时', buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+)
+BACKUP_RESULTS = registry.counter('points_backup_total', '备份次数，按结果区分', 'result')
+BACKUP_UPLOADED_BYTES = registry.counter('points_backup_uploaded_bytes_total', '上传到各存储的字节数')
+BACKUP_SNAPSHOT_BYTES = registry.gauge('points_backup_snapshot_bytes', '最近一次备份的数据库快照大小')
+BACKUP_CHUNKS = registry.gauge('points_backup_chunks', '最近一次备份清单引用的分块数')
+BACKUP_LAST_SUCCESS = registry.gauge('points_backup_last_success_timestamp_seconds', '最近一次成功备份的时间')
+
+class BackupManager:
+    """备份到一个或多个存储：并行上传、失败重试，恢复时按顺序使用第一个可用的存储
+
+    每个备份由一个清单和若干分块组成。全量备份时按 rowid 顺序每 BACKUP_CHUNK_ROWS 行切一个分块，
+    分块名记录起点 rowid，分块覆盖从起点到下一个分块起点之间的 rowid（第一个分块向下不限）；
+    增量备份只重新生成有变更的分块，超过两倍大小的分块再按行数拆分。
+    分块以压缩内容的 SHA-256 命名，内容没变的分块在各个备份之间共享，存储上已有的分块不会重复上传
+    """
+
+    def __init__(self, targets, database):
+        self.targets = targets
         self.database = database
         self.logger = logging.getLogger(__name__)
-        
+        self.executor = ThreadPoolExecutor(max_workers=max(len(targets), 1) * 2)
+        self.cleanup_executor = ThreadPoolExecutor(max_workers=1)
+
+        # 备份上传与分块清理互斥，避免清理掉正在被新清单引用的分块
+        self._gc_lock = threading.Lock()
+        self._manifest_cache = {}  # (存储名, 清单文件名) -> 引用的分块哈希
+
         # 确保备份目录存在
+        for target in self.targets:
+            try:
+                target.ensure_dir('backups')
+                target.ensure_dir(CHUNK_DIR)
+            except Exception as e:
+                self.logger.error(f"Failed to create backup directory on {target.name}: {str(e)}")
+
+    def backup(self, full=False):
+        """备份数据：只重新生成有变化的分块，只上传存储上还没有的分块，没有变化时跳过"""
+        start = time.perf_counter()
         try:
-            if not self.client.check('backups'):
-                self.client.mkdir('backups')
-        except Exception as e:
-            self.logger.error(f"Failed to create backup directory: {str(e)}")
-        
-    def backup(self):
-        try:
-            # 导出数据
-            data = self.database.export_data()
-            
-            # 创建备份文件名
-            filename = f'backup_{datetime.now().strftime("%Y%m%d_%H%M%S")}.json'
-            local_path = f'temp_{filename}'
-            
-            # 保存到本地临时文件
-            with open(local_path, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
-            
-            # 上传到WebDAV
-            self.client.upload_sync(remote_path=f'backups/{filename}', local_path=local_path)
-            
-            # 删除本地临时文件
-            os.remove(local_path)
-            
-            # 清理旧备份（保留最近10个）
-            self._cleanup_old_backups()
-            
-            self.logger.info(f"Backup completed: {filename}")
+            if not self.targets:
+                raise ValueError("No backup targets configured")
+
+            generation = int(self.database.get_meta('backup_generation', 0)) + 1
+            chunks = json.loads(self.database.get_meta('backup_chunk_ranges', '{}'))
+            backups_since_full = int(self.database.get_meta('backups_since_full', BACKUP_FULL_EVERY))
+            full = full or not chunks or backups_since_full >= BACKUP_FULL_EVERY
+
+            # 先写入积分缓冲，再取一份时间点一致的快照，之后的导出只读快照
+            self.database.points_buffer.flush()
+            self.database.snapshot(BACKUP_SNAPSHOT_FILE, BACKUP_SNAPSHOT_PAGES, BACKUP_SNAPSHOT_SLEEP)
+            BACKUP_SNAPSHOT_BYTES.set(os.path.getsize(BACKUP_SNAPSHOT_FILE))
+            snapshot = sqlite3.connect(BACKUP_SNAPSHOT_FILE)
+            try:
+                # 快照之后产生的变更序号更大，留给下一次备份
+                max_seq = self.database.get_change_seq(snapshot)
+                if not full and max_seq is None:
+                    self.logger.info("No changes since last backup, skipped")
+                    BACKUP_RESULTS.inc(label='skipped')
+                    return True
+
+                with self._gc_lock:
+                    uploaded = self._upload_chunks(snapshot, chunks, max_seq, full)
+
+                    manifest = json.dumps({
+                        'type': 'manifest',
+                        'generation': generation,
+                        'created_at': datetime.now().isoformat(),
+                        'chunks': chunks
+                    }, sort_keys=True).encode('utf-8')
+                    checksum = hashlib.sha256(manifest).hexdigest()
+
+                    # 创建清单文件名，按文件名排序即为时间顺序
+                    filename = f'backup_{datetime.now().strftime("%Y%m%d_%H%M%S")}_{generation:06d}{MANIFEST_SUFFIX}'
+                    self._upload_all(io.BytesIO(manifest), f'backups/{filename}')
+            finally:
+                snapshot.close()
+                os.remove(BACKUP_SNAPSHOT_FILE)
+
+            # 更新远端的最新备份信息，启动时只需读取这一个文件
+            latest = json.dumps({'generation': generation, 'checksum': checksum, 'file': filename})
+            self._upload_all(io.BytesIO(latest.encode('utf-8')), 'backups/latest.json')
+
+            # 清理已备份的变更记录，记下各分块的哈希供下次备份复用
+            self.database.mark_backed_up(
+                max_seq, generation, checksum, chunks, 0 if full else backups_since_full + 1
+            )
+
+            # 在后台清理旧备份，不阻塞本次备份
+            for target in self.targets:
+                self.cleanup_executor.submit(self._cleanup_old_backups, target)
+
+            self.logger.info(
+                f"Backup completed: {filename} ({len(chunks)} chunks, {uploaded} uploaded, "
+                f"{'full' if full else 'incremental'})"
+            )
+            BACKUP_RESULTS.inc(label='ok')
+            BACKUP_CHUNKS.set(len(chunks))
+            BACKUP_LAST_SUCCESS.set(time.time())
             return True
         except Exception as e:
             self.logger.error(f"Backup failed: {str(e)}")
+            BACKUP_RESULTS.inc(label='failed')
             return False
-            
-    def restore(self):
-        try:
-            # 获取最新的备份文件
-            files = [f for f in self.client.list('backups/') if f.endswith('.json')]
-            
-            if not files:
-                self.logger.warning("No backup files found")
+        finally:
+            BACKUP_SECONDS.observe(time.perf_counter() - start)
+
+    def _upload_chunks(self, snapshot, chunks, max_seq, full):
+        """重新生成需要更新的分块并更新 chunks（分块名 -> 哈希），返回实际上传的分块数"""
+        if full:
+            chunks.clear()
+            ranges = [
+                chunk
+                for table in BACKUP_TABLES
+                for chunk in self._chunk_ranges(
+                    table, self.database.get_chunk_starts(table, BACKUP_CHUNK_ROWS, conn=snapshot)
+                )
+            ]
+        else:
+            ranges = self._changed_ranges(snapshot, chunks, max_seq)
+
+        # 每个存储只列一次已有的分块
+        existing = {
+            target.name: {f.split('.')[0] for f in target.list(f'{CHUNK_DIR}/')}
+            for target in self.targets
+        }
+
+        uploaded = 0
+        for table, start, low, high in ranges:
+            data = self._build_chunk(self.database.export_chunk_records(table, low, high, snapshot))
+            key = f'{table}:{start}'
+            if data is None:
+                # 分块内的行已全部删除，它的范围并入前一个分块
+                chunks.pop(key, None)
+                continue
+
+            digest = hashlib.sha256(data).hexdigest()
+            chunks[key] = digest
+            missing = [target for target in self.targets if digest not in existing[target.name]]
+            if missing:
+                self._upload_all(io.BytesIO(data), f'{CHUNK_DIR}/{digest}.ndjson.gz', missing)
+                for target in missing:
+                    existing[target.name].add(digest)
+                uploaded += 1
+        return uploaded
+
+    @staticmethod
+    def _chunk_ranges(table, starts, low=None, high=None):
+        """把 [low, high) 按分块起点划分为 (表名, 起点, 下界, 上界) 列表，第一段的下界为 low"""
+        return [
+            (table, start, low if i == 0 else start, starts[i + 1] if i + 1 < len(starts) else high)
+            for i, start in enumerate(starts)
+        ]
+
+    def _changed_ranges(self, snapshot, chunks, max_seq):
+        """返回有变更的行所在的分块；分块超过两倍大小时按行数拆分，还没有分块的表整表重新划分"""
+        starts = {}
+        for key in chunks:
+            table, start = key.rsplit(':', 1)
+            starts.setdefault(table, []).append(int(start))
+        for table_starts in starts.values():
+            table_starts.sort()
+
+        changed = {}
+        for table, row_id in self.database.get_changed_rows(max_seq, snapshot):
+            if table not in starts:
+                changed[table] = None
+            elif changed.get(table, ()) is not None:
+                # 比第一个起点还小的 rowid 属于第一个分块
+                changed.setdefault(table, set()).add(max(bisect_right(starts[table], row_id) - 1, 0))
+
+        ranges = []
+        for table, positions in changed.items():
+            if positions is None:
+                ranges += self._chunk_ranges(
+                    table, self.database.get_chunk_starts(table, BACKUP_CHUNK_ROWS, conn=snapshot)
+                )
+                continue
+
+            table_starts = starts[table]
+            for position in sorted(positions):
+                start = table_starts[position]
+                low = None if position == 0 else start
+                high = table_starts[position + 1] if position + 1 < len(table_starts) else None
+                if self.database.count_rows(table, low, high, snapshot) > 2 * BACKUP_CHUNK_ROWS:
+                    split = self.database.get_chunk_starts(table, BACKUP_CHUNK_ROWS, low, high, snapshot)
+                    # 第一段沿用原来的分块名
+                    split[0] = start
+                    ranges += self._chunk_ranges(table, split, low, high)
+                else:
+                    ranges.append((table, start, low, high))
+        return ranges
+
+    @staticmethod
+    def _build_chunk(records):
+        """把一个分块的记录写成 gzip 压缩的 NDJSON，相同内容总是得到相同的字节；没有记录时返回 None"""
+        buffer = io.BytesIO()
+        count = 0
+        with gzip.GzipFile(filename='', fileobj=buffer, mode='wb', mtime=0) as compressed:
+            for record in records:
+                compressed.write((json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8'))
+                count += 1
+        return buffer.getvalue() if count else None
+
+    def _upload_all(self, buffer, path, targets=None):
+        """把同一份文件并行上传到所有（或指定的）存储，任一存储重试后仍失败则抛出异常"""
+        targets = targets or self.targets
+        lock = threading.Lock()
+
+        def upload(target):
+            reader = SharedReader(buffer, lock)
+
+            def attempt():
+                reader.seek(0)
+                target.upload(reader, path)
+
+            with_retry(attempt, BACKUP_RETRIES, BACKUP_RETRY_DELAY, f"Upload {path} to {target.name}")
+
+        futures = [self.executor.submit(upload, target) for target in targets]
+        errors = []
+        for target, future in zip(targets, futures):
+            try:
+                future.result()
+            except Exception as e:
+                errors.append(f"{target.name}: {str(e)}")
+        BACKUP_UPLOADED_BYTES.inc(buffer.getbuffer().nbytes * (len(targets) - len(errors)))
+        if errors:
+            raise IOError("Upload failed on " + "; ".join(errors))
+
+    def restore_if_needed(self):
+        """比较本地和远端的备份代数，本地已是最新时跳过恢复；某个存储不可用或恢复失败时换下一个"""
+        local_generation = int(self.database.get_meta('backup_generation', 0))
+        local_checksum = self.database.get_meta('backup_checksum', '')
+
+        for target in self.targets:
+            try:
+                latest = self.fetch_latest(target)
+            except Exception as e:
+                self.logger.error(f"Failed to fetch backup info from {target.name}: {str(e)}")
+                continue
+
+            if latest is None:
+                # 远端只有旧格式备份时，本地从未恢复或备份过、且还没有恢复过其中最新的文件才需要恢复
+                if local_generation > 0 or self._legacy_restored(target):
+                    self.logger.info(f"No backup info found on {target.name}, using local data")
+                    return False
+            elif local_generation > latest['generation'] or (
+                local_generation == latest['generation'] and local_checksum == latest['checksum']
+            ):
+                self.logger.info(f"Local data is current (generation {local_generation}), restore skipped")
                 return False
-                
-            # 按文件名排序（包含时间戳）
-            latest_backup = sorted(files)[-1]
-            local_path = 'restore_temp.json'
-            
-            # 下载最新的备份文件
-            self.client.download_sync(
-                remote_path=f'backups/{latest_backup}',
-                local_path=local_path
+            else:
+                self.logger.info(
+                    f"Remote backup is newer (generation {latest['generation']} > {local_generation}), restoring"
+                )
+
+            if self.restore(latest, target):
+                return True
+
+        return False
+
+    def _legacy_restored(self, target):
+        """本地是否已从存储上最新的旧格式备份恢复过"""
+        restored = self.database.get_meta('legacy_restored_file')
+        if restored is None:
+            return False
+        files = [f for f in self._list_backups(target) if not f.endswith(MANIFEST_SUFFIX)]
+        return bool(files) and files[-1] == restored
+
+    def fetch_latest(self, target):
+        """读取存储上的最新备份信息，不存在时返回 None"""
+        if not target.exists('backups/latest.json'):
+            return None
+        buffer = io.BytesIO()
+        target.download('backups/latest.json', buffer)
+        return json.loads(buffer.getvalue().decode('utf-8'))
+
+    def restore(self, latest=None, target=None):
+        """从最新的备份清单恢复数据；存储上只有旧格式备份时，从最近的全量备份及其后的增量备份恢复"""
+        target = target or self.targets[0]
+        try:
+            files = self._list_backups(target)
+            manifests = [f for f in files if f.endswith(MANIFEST_SUFFIX)]
+            if latest and latest['file'] in manifests:
+                filename = latest['file']
+            elif manifests and not (latest and latest['file'] in files):
+                filename = manifests[-1]
+            else:
+                return self._restore_legacy(files, latest, target)
+
+            buffer = io.BytesIO()
+            with_retry(
+                lambda: self._download(target, f'backups/{filename}', buffer),
+                BACKUP_RETRIES, BACKUP_RETRY_DELAY, f"Download {filename} from {target.name}"
             )
-            
-            # 读取并恢复数据
-            with open(local_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                
-            self.database.import_data(data)
-            
-            # 删除临时文件
-            os.remove(local_path)
-            
-            self.logger.info(f"Restore completed from: {latest_backup}")
+            data = buffer.getvalue()
+            checksum = hashlib.sha256(data).hexdigest()
+            if latest and filename == latest['file'] and checksum != latest['checksum']:
+                raise ValueError(f"Checksum mismatch for {filename}")
+            manifest = json.loads(data.decode('utf-8'))
+
+            # 按表和分块顺序导入，所有分块在同一个事务内写入
+            keys = sorted(manifest['chunks'], key=lambda key: (
+                BACKUP_TABLES.index(key.split(':')[0]), int(key.split(':')[1])
+            ))
+            # 先下载并校验全部分块，导入时不再访问网络，写锁只在本地导入期间持有
+            with tempfile.SpooledTemporaryFile(max_size=BACKUP_SPOOL_SIZE) as spool:
+                for key in keys:
+                    spool.write(self._download_chunk(target, manifest['chunks'][key]))
+                spool.seek(0)
+                self.database.import_records(self._read_chunks(spool))
+
+            # 恢复产生的变更已在远端备份中，无需再次备份；本地可能还有备份中没有的行，下次备份重新读取全部表
+            self.database.mark_backed_up(self.database.get_change_seq(), manifest['generation'], checksum)
+
+            self.logger.info(f"Restore completed from {target.name}: {filename} ({len(keys)} chunks)")
             return True
         except Exception as e:
             self.logger.error(f"Restore failed: {str(e)}")
             return False
-            
-    def _cleanup_old_backups(self, keep_count=10):
-        try:
-            files = [f for f in self.client.list('backups/') if f.endswith('.json')]
-            if len(files) > keep_count:
-                # 按时间排序
-                files.sort()
-                # 删除旧文件
-                for file in files[:-keep_count]:
-                    self.client.clean(f'backups/{file}')
-                    self.logger.info(f"Deleted old backup: {file}")
-        except Exception as e:
-            self.logger.error(f"Cleanup failed: {str(e)}")
\ No newline at end of file
+
+    def _download_chunk(self, target, digest):
+        """下载一个分块并校验哈希，返回压缩的内容"""
+        buffer = io.BytesIO()
+        with_retry(
+            lambda: self._download(target, f'{CHUNK_DIR}/{digest}.ndjson.gz', buffer),
+            BACKUP_RETRIES, BACKUP_RETRY_DELAY, f"Download chunk {digest} from {target.name}"
+        )
+        data = buffer.getvalue()
+        if hashlib.sha256(data).hexdigest() != digest:
+            raise ValueError(f"Checksum mismatch for chunk {digest}")
+        return data
+
+    @staticmethod
+    def _read_chunks(buffer):
+        """逐条读取首尾相接的多个 gzip 分块中的记录"""
+        with io.TextIOWrapper(gzip.GzipFile(fileobj=buffer, mode='rb'), encoding='utf-8') as reader:
+            for line in reader:
+                yield json.loads(line)
+
+    def _restore_legacy(self, files, latest, target):
+        """从旧格式的全量备份及其后的增量备份恢复"""
+        files = [f for f in files if not f.endswith(MANIFEST_SUFFIX)]
+        if latest and latest['file'] in files:
+            # 只恢复到最新备份信息记录的文件为止
+            files = files[:files.index(latest['file']) + 1]
+
+        # 找到最近的全量备份（更早的 JSON 备份文件也视为全量备份）
+        bases = [i for i, f in enumerate(files) if not self._is_delta(f)]
+        if not bases:
+            self.logger.warning("No backup files found")
+            return False
+        chain = files[bases[-1]:]
+
+        for filename in chain:
+            with tempfile.SpooledTemporaryFile(max_size=BACKUP_SPOOL_SIZE) as buffer:
+                with_retry(
+                    lambda: self._download(target, f'backups/{filename}', buffer),
+                    BACKUP_RETRIES, BACKUP_RETRY_DELAY, f"Download {filename} from {target.name}"
+                )
+                checksum = self._checksum(buffer)
+                if latest and filename == latest['file'] and checksum != latest['checksum']:
+                    raise ValueError(f"Checksum mismatch for {filename}")
+                self.database.import_records(self._read_records(buffer, filename))
+
+        generation = latest['generation'] if latest else 0
+        self.database.mark_backed_up(
+            self.database.get_change_seq(), generation, latest['checksum'] if latest else ''
+        )
+        # 没有备份信息时代数仍为 0，记下恢复到的文件，重启时不再重复导入同一份旧备份
+        self.database.set_meta('legacy_restored_file', chain[-1])
+
+        self.logger.info(f"Restore completed from {target.name}: {chain[0]} + {len(chain) - 1} deltas")
+        return True
+
+    @staticmethod
+    def _download(target, path, buffer):
+        buffer.seek(0)
+        buffer.truncate()
+        target.download(path, buffer)
+
+    @staticmethod
+    def _checksum(buffer):
+        """计算文件内容的 SHA-256，完成后回到文件开头"""
+        buffer.seek(0)
+        digest = hashlib.sha256()
+        for chunk in iter(lambda: buffer.read(1024 * 1024), b''):
+            digest.update(chunk)
+        buffer.seek(0)
+        return digest.hexdigest()
+
+    @staticmethod
+    def _read_records(buffer, filename):
+        """逐行读取旧格式备份的记录，兼容 gzip NDJSON 和更早的 JSON 格式"""
+        if filename.endswith('.json'):
+            data = json.load(io.TextIOWrapper(buffer, encoding='utf-8'))
+            if 'type' in data:
+                tables = data['tables']
+                deleted = data.get('deleted', {})
+            else:
+                tables, deleted = data, {}
+            for table, rows in tables.items():
+                for row in rows:
+                    yield {'table': table, 'row': row}
+            for table, row_ids in deleted.items():
+                for row_id in row_ids:
+                    yield {'table': table, 'delete': row_id}
+            return
+
+        with io.TextIOWrapper(gzip.GzipFile(fileobj=buffer, mode='rb'), encoding='utf-8') as reader:
+            next(reader)  # 备份信息
+            for line in reader:
+                yield json.loads(line)
+
+    def _list_backups(self, target):
+        return sorted(
+            f for f in target.list('backups/')
+            if f.endswith('.json') and f != 'latest.json' or f.endswith('.ndjson.gz')
+        )
+
+    @staticmethod
+    def _is_delta(filename):
+        return '_delta.' in filename
+
+    def _manifest_chunks(self, target, filename):
+        """返回清单引用的分块哈希，清单不会被修改，读过一次后缓存"""
+        key = (target.name, filename)
+        if key not in self._manifest_cache:
+            buffer = io.BytesIO()
+            target.download(f'backups/{filename}', buffer)
+            manifest = json.loads(buffer.getvalue().decode('utf-8'))
+            self._manifest_cache[key] = set(manifest['chunks'].values())
+        return self._manifest_cache[key]
+
+    def _cleanup_old_backups(self, target, keep=BACKUP_KEEP):
+        """保留最近 keep 个备份清单，删除更早的清单和不再被任何清单引用的分块"""
+        with self._gc_lock:
+            try:
+                files = self._list_backups(target)
+                manifests = [f for f in files if f.endswith(MANIFEST_SUFFIX)]
+                expired = manifests[:-keep]
+                if len(manifests) >= keep:
+                    # 新格式的备份足够多后，旧格式的备份文件也一并清理
+                    expired += [f for f in files if not f.endswith(MANIFEST_SUFFIX)]
+
+                referenced = set()
+                for filename in manifests[-keep:]:
+                    referenced |= self._manifest_chunks(target, filename)
+                orphans = [
+                    f for f in target.list(f'{CHUNK_DIR}/')
+                    if f.endswith('.ndjson.gz') and f.split('.')[0] not in referenced
+                ]
+
+                target.delete([f'backups/{file}' for file in expired] + [f'{CHUNK_DIR}/{file}' for file in orphans])
+                for filename in expired:
+                    self._manifest_cache.pop((target.name, filename), None)
+                if expired or orphans:
+                    self.logger.info(
+                        f"Deleted {len(expired)} old backups and {len(orphans)} unreferenced chunks from {target.name}"
+                    )
+            except Exception as e:
+                self.logger.error(f"Cleanup on {target.name} failed: {str(e)}")
+
+class BackupScheduler:
+    """根据数据库写入量调度备份：写入密集时提前备份，空闲时跳过，停止时做最后一次备份"""
+
+    def __init__(self, backup, database, interval, min_interval, burst_writes, check_interval=30):
+        self.backup = backup
+        self.database = database
+        self.interval = interval
+        self.min_interval = min_interval
+        self.burst_writes = burst_writes
+        self.check_interval = check_interval
+        self.logger = logging.getLogger(__name__)
+
+        self._trigger = threading.Event()
+        self._requested = False  # 被触发但距离上次备份太近，留到之后的检查
+        self._stopped = threading.Event()
+        self._run_lock = threading.Lock()
+        self._thread = None
+
+        # 上次启动时未备份的变更也算作待备份
+        self._last_writes = self.database.write_count
+        self._pending = self.database.get_change_seq() is not None
+        self._last_attempt = time.monotonic()
+
+        # 统计信息
+        self.last_run = None
+        self.last_duration = 0.0
+        self.last_result = None
+        self.runs = 0
+        self.failures = 0
+        self.skipped = 0
+
+    def pending_writes(self):
+        return self.database.write_count - self._last_writes
+
+    def trigger(self):
+        """请求尽快备份，多次请求合并为一次"""
+        self._trigger.set()
+
+    def start(self):
+        if not self.backup.targets:
+            # 没有备份存储时不启动调度，避免每次检查都记录备份失败
+            self.logger.warning("No backup targets configured, backups are disabled")
+            return
+
+        def backup_task():
+            while not self._stopped.is_set():
+                self._trigger.wait(self.check_interval)
+                triggered = self._trigger.is_set()
+                self._trigger.clear()
+                if self._stopped.is_set():
+                    break
+
+                try:
+                    self.check(triggered)
+                except Exception as e:
+                    self.logger.error(f"Backup scheduling failed: {str(e)}")
+
+        self._thread = threading.Thread(target=backup_task, name='backup-scheduler')
+        self._thread.daemon = True
+        self._thread.start()
+        self.logger.info("Backup scheduler started")
+
+    def check(self, triggered=False):
+        """判断是否需要备份：有写入且超过备份间隔、写入量达到阈值或被主动触发时执行"""
+        writes = self.pending_writes()
+        dirty = writes > 0 or self._pending
+        elapsed = time.monotonic() - self._last_attempt
+        triggered = triggered or self._requested
+
+        if not dirty:
+            self.skipped += 1
+            return False
+        if elapsed < self.min_interval:
+            # 距离上次备份太近，留到之后的检查；不重新设置事件，避免检查线程空转
+            self._requested = triggered
+            return False
+        self._requested = False
+        if triggered or writes >= self.burst_writes or elapsed >= self.interval:
+            return self.run()
+        return False
+
+    def run(self):
+        with self._run_lock:
+            writes = self.database.write_count
+            start = time.monotonic()
+            result = self.backup.backup()
+
+            # 备份本身会写入数据库，是否还有待备份的变更以 change_log 为准
+            self._last_writes = self.database.write_count if result else writes
+            self._pending = not result or self.database.get_change_seq() is not None
+            self._last_attempt = time.monotonic()
+            self.last_run = datetime.now()
+            self.last_duration = self._last_attempt - start
+            self.last_result = result
+            self.runs += 1
+            if not result:
+                self.failures += 1
+            return result
+
+    def stop(self):
+        """停止调度，有未备份的写入时做最后一次备份"""
+        self._stopped.set()
+        self._trigger.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        if self.backup.targets and (self.pending_writes() > 0 or self._pending):
+            self.logger.info("Running final backup before shutdown")
+            self.run()
+
+    def stats(self):
+        # 全部为数值，同时作为监控指标输出
+        return {
+            'last_run_timestamp': round(self.last_run.timestamp()) if self.last_run else 0,
+            'last_duration_s': round(self.last_duration, 3),
+            'last_result': 1 if self.last_result else 0,
+            'runs': self.runs,
+            'failures': self.failures,
+            'skipped': self.skipped,
+            'pending_writes': self.pending_writes()
+        }
\ No newline at end of file
@@ -0,0 +1,150 @@
+from abc import ABC, abstractmethod
+from webdav3.client import Client
+from concurrent.futures import ThreadPoolExecutor
+import os
+import shutil
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+def with_retry(func, attempts=3, delay=1.0, description='operation'):
+    """失败时按指数退避重试，最后一次仍失败时抛出异常"""
+    for attempt in range(1, attempts + 1):
+        try:
+            return func()
+        except Exception as e:
+            if attempt == attempts:
+                raise
+            wait = delay * 2 ** (attempt - 1)
+            logger.warning(f"{description} failed ({str(e)}), retrying in {wait:.1f}s")
+            time.sleep(wait)
+
+class SharedReader:
+    """在同一个可 seek 的文件上提供独立读取位置，供多个存储并行上传同一份备份"""
+
+    def __init__(self, buffer, lock):
+        self.buffer = buffer
+        self.lock = lock
+        self.position = 0
+
+    def read(self, size=-1):
+        with self.lock:
+            self.buffer.seek(self.position)
+            data = self.buffer.read(size)
+            self.position += len(data)
+            return data
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        with self.lock:
+            if whence == os.SEEK_SET:
+                self.position = offset
+            elif whence == os.SEEK_CUR:
+                self.position += offset
+            else:
+                self.buffer.seek(0, os.SEEK_END)
+                self.position = self.buffer.tell() + offset
+            return self.position
+
+    def tell(self):
+        return self.position
+
+class BackupTarget(ABC):
+    """备份存储接口，路径均为相对存储根目录的路径，如 backups/latest.json"""
+
+    name = 'target'
+
+    @abstractmethod
+    def upload(self, buffer, path):
+        pass
+
+    @abstractmethod
+    def download(self, path, buffer):
+        pass
+
+    @abstractmethod
+    def exists(self, path):
+        pass
+
+    @abstractmethod
+    def list(self, directory):
+        """返回目录下的文件名（不含目录）"""
+
+    @abstractmethod
+    def delete(self, paths):
+        """批量删除文件"""
+
+    @abstractmethod
+    def ensure_dir(self, directory):
+        pass
+
+class WebDAVTarget(BackupTarget):
+    name = 'webdav'
+
+    def __init__(self, config, delete_workers=4):
+        self.client = Client(config)
+        self.delete_workers = delete_workers
+
+    def upload(self, buffer, path):
+        self.client.upload_to(buffer, path)
+
+    def download(self, path, buffer):
+        self.client.download_from(buffer, path)
+
+    def exists(self, path):
+        return self.client.check(path)
+
+    def list(self, directory):
+        return [f for f in self.client.list(directory) if not f.endswith('/')]
+
+    def delete(self, paths):
+        # 逐个 DELETE 请求并行发出，慢服务器上也不会串行等待
+        if not paths:
+            return
+        with ThreadPoolExecutor(max_workers=self.delete_workers) as executor:
+            for future in [executor.submit(self.client.clean, path) for path in paths]:
+                future.result()
+
+    def ensure_dir(self, directory):
+        if not self.client.check(directory):
+            self.client.mkdir(directory)
+
+class LocalTarget(BackupTarget):
+    """本地目录存储，可作为额外的备份副本，也可在测试中代替 WebDAV"""
+
+    name = 'local'
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, path):
+        return os.path.join(self.root, path)
+
+    def upload(self, buffer, path):
+        # 先写临时文件再替换，避免读到写了一半的备份
+        target = self._path(path)
+        temp = f'{target}.part'
+        with open(temp, 'wb') as f:
+            shutil.copyfileobj(buffer, f)
+        os.replace(temp, target)
+
+    def download(self, path, buffer):
+        with open(self._path(path), 'rb') as f:
+            shutil.copyfileobj(f, buffer)
+
+    def exists(self, path):
+        return os.path.exists(self._path(path))
+
+    def list(self, directory):
+        return [
+            f for f in os.listdir(self._path(directory))
+            if os.path.isfile(os.path.join(self._path(directory), f)) and not f.endswith('.part')
+        ]
+
+    def delete(self, paths):
+        for path in paths:
+            os.remove(self._path(path))
+
+    def ensure_dir(self, directory):
+        os.makedirs(self._path(directory), exist_ok=True)
\ No newline at end of file
@@ -1,81 +1,183 @@
-from telegram.ext import Updater, CommandHandler, MessageHandler, Filters, CallbackQueryHandler
-from .handlers.admin import AdminHandlers
+from telegram import Bot, Update
+from telegram.ext import (
+    Updater, Dispatcher, JobQueue, CommandHandler, MessageHandler, Filters, CallbackQueryHandler,
+    CallbackContext, ChatMemberHandler, TypeHandler
+)
+from telegram.utils.request import Request
+from .handlers.admin import AdminHandlers, admin_cache
 from .handlers.points import PointsHandlers
 from .handlers.lottery import LotteryHandlers
 from .handlers.message import MessageHandlers
 from .database import Database
-from .backup import WebDAVBackup
+from .backup import BackupManager, BackupScheduler
+from .backup_targets import WebDAVTarget, LocalTarget
+from .lottery_draw import LotteryDrawScheduler
+from .sender import MessageSender
+from .ingest import MessageBatcher
+from .ledger import LedgerCompactor
+from .recorder import UpdateRecorder
+from .metrics import registry, instrument_dispatcher, MetricsServer
+from queue import Queue
 import threading
-import time
 import logging
+from config import (
+    RESTORE_IN_BACKGROUND, BACKUP_INTERVAL, BACKUP_MIN_INTERVAL,
+    BACKUP_BURST_WRITES, BACKUP_CHECK_INTERVAL, BACKUP_LOCAL_DIR,
+    SEND_GLOBAL_RATE, SEND_GROUP_INTERVAL, SEND_PRIVATE_INTERVAL, SEND_DIGEST_WINDOW, SEND_WORKERS,
+    INGEST_BATCH, INGEST_BATCH_SIZE, INGEST_BATCH_DELAY,
+    BOT_MODE, TELEGRAM_API_URL, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_MAX_CONNECTIONS,
+    UPDATE_WORKERS, UPDATE_QUEUE_SIZE, POLL_INTERVAL, POLL_TIMEOUT, POLL_READ_LATENCY, UPDATE_LOG,
+    METRICS_LISTEN, METRICS_PORT, DRAW_RETRY_DELAY,
+    LEDGER_COMPACT_INTERVAL, LEDGER_COMPACT_BATCH, LEDGER_ARCHIVE_DAYS, LEDGER_ARCHIVE_DIR
+)
 
 logger = logging.getLogger(__name__)
 
 class PointsBot:
-    def __init__(self, token, webdav_config, db_file):
-        self.updater = Updater(token=token, use_context=True)
+    def __init__(self, token, webdav_config, db_file, bot=None, backup_targets=None):
+        """bot 和 backup_targets 为空时按配置创建，重放等测试场景可以传入假的 bot 和空的备份存储列表"""
+        self.updater = self.create_updater(token, bot)
         self.dp = self.updater.dispatcher
         
         # 初始化数据库
         self.db = Database(db_file)
         
         # 初始化备份
-        self.backup = WebDAVBackup(webdav_config, self.db)
+        if backup_targets is None:
+            backup_targets = []
+            if webdav_config.get('webdav_hostname'):
+                backup_targets.append(WebDAVTarget(webdav_config))
+            if BACKUP_LOCAL_DIR:
+                backup_targets.append(LocalTarget(BACKUP_LOCAL_DIR))
+        self.backup = BackupManager(backup_targets, self.db)
+        self.backup_scheduler = BackupScheduler(
+            self.backup, self.db, BACKUP_INTERVAL, BACKUP_MIN_INTERVAL,
+            BACKUP_BURST_WRITES, BACKUP_CHECK_INTERVAL
+        )
+        
+        # 初始化积分账本合并
+        self.ledger_compactor = LedgerCompactor(
+            self.db, LEDGER_COMPACT_INTERVAL, LEDGER_COMPACT_BATCH, LEDGER_ARCHIVE_DAYS, LEDGER_ARCHIVE_DIR
+        )
+        
+        # 初始化发送队列
+        self.sender = MessageSender(
+            self.updater.bot, SEND_GLOBAL_RATE, SEND_GROUP_INTERVAL, SEND_PRIVATE_INTERVAL,
+            SEND_DIGEST_WINDOW, workers=SEND_WORKERS
+        )
+        self.sender.start()
+        
+        # 初始化开奖调度
+        self.draw_scheduler = LotteryDrawScheduler(self.db, self.updater.job_queue, self.sender, DRAW_RETRY_DELAY)
         
         # 初始化处理器
-        self.admin_handlers = AdminHandlers(self.db)
-        self.points_handlers = PointsHandlers(self.db)
-        self.lottery_handlers = LotteryHandlers(self.db)
-        self.message_handlers = MessageHandlers(self.db)
+        self.admin_handlers = AdminHandlers(self.db, self.sender, on_change=self.backup_scheduler.trigger)
+        self.points_handlers = PointsHandlers(self.db, self.sender)
+        self.lottery_handlers = LotteryHandlers(self.db, self.sender, self.draw_scheduler)
+        self.message_handlers = MessageHandlers(self.db, self.sender)
+        
+        # 批量处理模式下群消息先进入队列，再按批写入
+        self.message_batcher = None
+        if INGEST_BATCH:
+            self.message_batcher = MessageBatcher(
+                self.db, self.message_handlers, self.sender, INGEST_BATCH_SIZE, INGEST_BATCH_DELAY
+            )
+            self.message_batcher.start()
+        
+        # 记录收到的更新，用于重放
+        self.recorder = UpdateRecorder(UPDATE_LOG) if UPDATE_LOG else None
         
         self.setup_handlers()
-        self.start_backup_thread()
+        self.setup_metrics()
         
         logger.info("Bot initialized successfully")
 
+    @staticmethod
+    def create_updater(token, bot=None):
+        """按配置创建 Updater：处理线程数、更新队列，以及足够所有线程同时使用的连接池"""
+        request = Request(con_pool_size=UPDATE_WORKERS + SEND_WORKERS + 4)
+        bot = bot or Bot(token, base_url=TELEGRAM_API_URL, request=request)
+        job_queue = JobQueue()
+        # 长轮询在队列满时暂停拉取；webhook 在 tornado 的 IOLoop 线程上放入队列，
+        # 队列满会卡住整个 webhook 服务，此时不设上限，由 WEBHOOK_MAX_CONNECTIONS 限制推送并发
+        queue_size = 0 if BOT_MODE == 'webhook' else UPDATE_QUEUE_SIZE
+        dispatcher = Dispatcher(
+            bot, Queue(maxsize=queue_size), workers=UPDATE_WORKERS, job_queue=job_queue, use_context=True
+        )
+        job_queue.set_dispatcher(dispatcher)
+        return Updater(workers=None, dispatcher=dispatcher)
+
     def setup_handlers(self):
+        # 命令和私聊会阻塞在 Bot API 请求上，交给处理线程池并发执行；
+        # 群消息处理很快且不发请求，在分发线程内按顺序处理
+        
+        # 在其他处理器之前按收到的顺序记录更新
+        if self.recorder:
+            self.dp.add_handler(TypeHandler(Update, self.recorder.record), group=-1)
+        
         # 管理员命令
-        self.dp.add_handler(CommandHandler("addgroup", self.admin_handlers.add_allowed_group))
-        self.dp.add_handler(CommandHandler("removegroup", self.admin_handlers.remove_allowed_group))
-        self.dp.add_handler(CommandHandler("addpoints", self.admin_handlers.add_points))
-        self.dp.add_handler(CommandHandler("deductpoints", self.admin_handlers.deduct_points))
-        self.dp.add_handler(CommandHandler("setsetting", self.admin_handlers.set_group_settings))
-        self.dp.add_handler(CommandHandler("settings", self.admin_handlers.get_group_settings))
+        self.dp.add_handler(CommandHandler("addgroup", self.admin_handlers.add_allowed_group, run_async=True))
+        self.dp.add_handler(CommandHandler("removegroup", self.admin_handlers.remove_allowed_group, run_async=True))
+        self.dp.add_handler(CommandHandler("addpoints", self.admin_handlers.add_points, run_async=True))
+        self.dp.add_handler(CommandHandler("deductpoints", self.admin_handlers.deduct_points, run_async=True))
+        self.dp.add_handler(CommandHandler("setsetting", self.admin_handlers.set_group_settings, run_async=True))
+        self.dp.add_handler(CommandHandler("settings", self.admin_handlers.get_group_settings, run_async=True))
+        
+        # 管理员变动时更新管理员缓存
+        self.dp.add_handler(ChatMemberHandler(admin_cache.handle_chat_member, ChatMemberHandler.ANY_CHAT_MEMBER))
         
         # 积分相关命令
-        self.dp.add_handler(CommandHandler("points", self.points_handlers.check_points))
-        self.dp.add_handler(CommandHandler("daily", self.points_handlers.daily_checkin))
-        self.dp.add_handler(CommandHandler("invite", self.points_handlers.generate_invite))
+        self.dp.add_handler(CommandHandler("points", self.points_handlers.check_points, run_async=True))
+        self.dp.add_handler(CommandHandler("daily", self.points_handlers.daily_checkin, run_async=True))
+        self.dp.add_handler(CommandHandler("invite", self.points_handlers.generate_invite, run_async=True))
+        self.dp.add_handler(CommandHandler("top", self.points_handlers.show_top, run_async=True))
+        self.dp.add_handler(CommandHandler("rank", self.points_handlers.show_rank, run_async=True))
         
         # 抽奖命令
-        self.dp.add_handler(CommandHandler("setlottery", self.lottery_handlers.start_lottery_setup))
-        self.dp.add_handler(CommandHandler("joinlottery", self.lottery_handlers.join_lottery))
-        self.dp.add_handler(CallbackQueryHandler(self.lottery_handlers.handle_callback_query))
+        self.dp.add_handler(CommandHandler("setlottery", self.lottery_handlers.start_lottery_setup, run_async=True))
+        self.dp.add_handler(CommandHandler("joinlottery", self.lottery_handlers.join_lottery, run_async=True))
+        self.dp.add_handler(CallbackQueryHandler(self.lottery_handlers.handle_callback_query, run_async=True))
         
         # Start命令处理
-        start_handler = CommandHandler("start", self.handle_start)
+        start_handler = CommandHandler("start", self.handle_start, run_async=True)
         self.dp.add_handler(start_handler)
         
         # 消息处理
+        handle_message = self.message_batcher.enqueue if self.message_batcher else self.message_handlers.handle_message
         self.dp.add_handler(MessageHandler(
             Filters.text & ~Filters.command & ~Filters.private,
-            self.message_handlers.handle_message
+            handle_message
         ))
         
         # 媒体消息处理
         self.dp.add_handler(MessageHandler(
             (Filters.photo | Filters.video | Filters.document | Filters.sticker) & ~Filters.private,
-            self.message_handlers.handle_message
+            handle_message
         ))
         
         # 私聊消息处理
         self.dp.add_handler(MessageHandler(
             Filters.private & Filters.text & ~Filters.command,
-            self.handle_private_message
+            self.handle_private_message,
+            run_async=True
         ))
         
         logger.info("Handlers setup completed")
 
+    def setup_metrics(self):
+        """为全部处理器记录耗时，并把各个队列和缓存的统计信息作为监控指标输出"""
+        instrument_dispatcher(self.dp)
+        registry.gauge('points_update_queue_size', '等待分发的更新数', callback=self.dp.update_queue.qsize)
+        registry.gauge('points_sender', '发送队列统计', 'stat', self.sender.stats)
+        registry.gauge('points_accumulator', '积分写缓冲统计', 'stat', self.db.points_buffer.stats)
+        registry.gauge('points_admin_cache', '管理员缓存统计', 'stat', admin_cache.stats)
+        registry.gauge('points_ledger', '积分账本合并统计', 'stat', self.ledger_compactor.stats)
+        registry.gauge('points_leaderboard', '群组积分排行缓存统计', 'stat', self.db.leaderboard.stats)
+        registry.gauge('points_backup_scheduler', '备份调度统计', 'stat', self.backup_scheduler.stats)
+        if self.message_batcher:
+            registry.gauge('points_ingest', '群消息批量处理统计', 'stat', self.message_batcher.stats)
+        self.metrics_server = MetricsServer(registry, METRICS_LISTEN, METRICS_PORT) if METRICS_PORT else None
+
     def handle_start(self, update: Update, context: CallbackContext):
         """处理 /start 命令"""
         # 处理抽奖设置的deep link
@@ -93,6 +195,8 @@ class PointsBot:
             "/points - 查看积分\n"
             "/daily - 每日签到\n"
             "/invite - 生成邀请链接\n"
+            "/top - 本群积分排行\n"
+            "/rank - 我的本群排名\n"
             "/joinlottery - 参与抽奖\n\n"
             "🔸 管理员命令：\n"
             "/setlottery - 创建抽奖\n"
@@ -109,31 +213,80 @@ class PointsBot:
             return
 
     def start_backup_thread(self):
-        """启动备份线程"""
-        def backup_task():
-            while True:
-                try:
-                    self.backup.backup()
-                    logger.info("Backup completed successfully")
-                except Exception as e:
-                    logger.error(f"Backup failed: {str(e)}")
-                time.sleep(3600)  # 每小时备份一次
-                
-        thread = threading.Thread(target=backup_task)
-        thread.daemon = True
-        thread.start()
-        logger.info("Backup thread started")
+        """启动备份调度"""
+        self.backup_scheduler.start()
 
-    def run(self):
-        """运行机器人"""
-        # 恢复数据
+    def restore_data(self):
         try:
-            self.backup.restore()
-            logger.info("Data restored successfully")
+            if self.backup.restore_if_needed():
+                logger.info("Data restored successfully")
+                self.draw_scheduler.schedule()
         except Exception as e:
             logger.error(f"Data restore failed: {str(e)}")
+
+    def run(self):
+        """运行机器人"""
+        # 没有公网地址时 PTB 会向 Telegram 注册本地监听地址，机器人收不到任何更新
+        if BOT_MODE == 'webhook' and not WEBHOOK_URL:
+            raise ValueError("WEBHOOK_URL must be set when BOT_MODE is webhook")
+        
+        # 恢复数据：本地已是最新备份时跳过
+        if RESTORE_IN_BACKGROUND:
+            thread = threading.Thread(target=self.restore_data)
+            thread.daemon = True
+            thread.start()
+        else:
+            self.restore_data()
+        
+        # 启动备份调度和积分账本合并
+        self.start_backup_thread()
+        self.ledger_compactor.start()
+        
+        # 启动监控指标接口
+        if self.metrics_server:
+            self.metrics_server.start()
+        
+        # 安排开奖，重启前已过期的抽奖会立即开奖
+        self.draw_scheduler.schedule()
+        
+        # 启动机器人，chat_member 更新需要显式订阅
+        if BOT_MODE == 'webhook':
+            self.updater.start_webhook(
+                listen=WEBHOOK_LISTEN,
+                port=WEBHOOK_PORT,
+                url_path=WEBHOOK_PATH,
+                webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}",
+                allowed_updates=Update.ALL_TYPES,
+                max_connections=WEBHOOK_MAX_CONNECTIONS
+            )
+            logger.info(f"Bot started webhook on {WEBHOOK_LISTEN}:{WEBHOOK_PORT}/{WEBHOOK_PATH}")
+        else:
+            self.updater.start_polling(
+                poll_interval=POLL_INTERVAL,
+                timeout=POLL_TIMEOUT,
+                read_latency=POLL_READ_LATENCY,
+                allowed_updates=Update.ALL_TYPES
+            )
+            logger.info("Bot started polling")
+        self.updater.idle()
+
+        if self.recorder:
+            self.recorder.close()
+        
+        # 停止后处理完剩余的群消息，再发送完队列中的消息
+        if self.message_batcher:
+            self.message_batcher.stop()
+        self.sender.stop()
+        
+        # 写入积分缓冲并合并账本
+        self.db.points_buffer.flush()
+        self.ledger_compactor.stop()
+
+        # 做最后一次备份并写入积分缓冲
+        self.backup_scheduler.stop()
+        logger.info(f"Backup scheduler stopped: {self.backup_scheduler.stats()}")
+        self.db.close()
         
-        # 启动机器人
-        self.updater.start_polling()
-        logger.info("Bot started polling")
-        self.updater.idle()
\ No newline at end of file
+        if self.metrics_server:
+            self.metrics_server.stop()
+        logger.info("Database closed")
\ No newline at end of file
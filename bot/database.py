@@ -1,19 +1,327 @@
 import sqlite3
 import json
+import threading
+import time
+import random
+from collections import namedtuple
+from contextlib import contextmanager
 from datetime import datetime
 import logging
-from config import ALLOWED_GROUPS
+from config import (
+    ALLOWED_GROUPS, POINTS_FLUSH_INTERVAL, POINTS_FLUSH_SIZE, SQLITE_PROFILE, DB_SLOW_QUERY_MS, LEADERBOARD_SIZE
+)
+from .accumulator import PointsAccumulator
+from .leaderboard import Leaderboard
+from .metrics import registry, instrumented
 
+logger = logging.getLogger(__name__)
+
+# 加入抽奖的结果
+JOIN_OK = 'ok'
+JOIN_ALREADY_JOINED = 'already_joined'
+JOIN_INSUFFICIENT_POINTS = 'insufficient_points'
+JOIN_NOT_ACTIVE = 'not_active'
+
+# 需要备份的数据表
+BACKUP_TABLES = ['users', 'group_settings', 'lotteries', 'lottery_participants', 'invite_history', 'points_ledger',
+                 'group_points']
+
+# 积分账本中的变动原因
+LEDGER_MESSAGE = 'message'
+LEDGER_DAILY = 'daily'
+LEDGER_INVITE = 'invite'
+LEDGER_LOTTERY = 'lottery'
+LEDGER_ADMIN = 'admin'
+
+# 用户余额：users.points 是已合并到 ledger_seq 为止的积分，再加上账本中之后的变动
+BALANCE_SQL = '''users.points + COALESCE((
+    SELECT SUM(delta) FROM points_ledger WHERE user_id = users.user_id AND id > users.ledger_seq
+), 0)'''
+
+# 群组余额只统计在群组中获得（或被管理员扣除）的积分：抽奖消耗不计入群组排行，
+# 账本之前的积分没有群组信息，也不计入任何群组
+GROUP_LEDGER_SQL = f"reason != '{LEDGER_LOTTERY}'"
+
+# 群组余额的未合并部分：账本中尚未合并到 group_points 的变动，按用户汇总；
+# group_points.ledger_seq 记录每行已合并到的序号，未合并的记录都在 meta.ledger_compacted_id 之后，
+# 只需按主键范围扫描账本末尾
+GROUP_TAIL_SQL = f'''tail (user_id, delta) AS (
+    SELECT l.user_id, SUM(l.delta) FROM points_ledger l
+    LEFT JOIN group_points g ON g.group_id = l.group_id AND g.user_id = l.user_id
+    WHERE l.id > COALESCE((SELECT CAST(value AS INTEGER) FROM meta WHERE key = 'ledger_compacted_id'), 0)
+    AND l.group_id = :group AND l.id > COALESCE(g.ledger_seq, 0) AND l.{GROUP_LEDGER_SQL}
+    GROUP BY l.user_id
+)'''
+
+class _InsufficientPoints(Exception):
+    """积分不足，在 transaction() 内抛出以回滚已写入的参与记录"""
+
+# 群组设置（不可变），字段顺序与 group_settings 表一致
+GroupSettings = namedtuple('GroupSettings', [
+    'group_id', 'min_words', 'points_per_word', 'points_per_media',
+    'daily_points', 'invite_points', 'is_allowed'
+])
+
+def _migration_participants_unique(cursor):
+    """每个用户在同一抽奖中只能参与一次，建立唯一索引前先清理重复记录"""
+    cursor.execute('''
+        DELETE FROM lottery_participants WHERE rowid NOT IN (
+            SELECT MIN(rowid) FROM lottery_participants GROUP BY lottery_id, user_id
+        )
+    ''')
+    cursor.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_participants_lottery_user
+        ON lottery_participants (lottery_id, user_id)
+    ''')
+    cursor.execute('DROP INDEX IF EXISTS idx_participants_lottery')
+
+def _migration_hot_path_indexes(cursor):
+    """抽奖按群组/状态/结束时间查询，邀请记录按邀请人和被邀请人查询"""
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_lotteries_group_status ON lotteries (group_id, status)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_lotteries_status_end ON lotteries (status, end_time)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_invite_inviter ON invite_history (inviter_id)')
+    # 每个用户只能被邀请一次，保留最早的记录
+    cursor.execute('''
+        DELETE FROM invite_history WHERE rowid NOT IN (
+            SELECT MIN(rowid) FROM invite_history GROUP BY invited_id
+        )
+    ''')
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_invite_invited ON invite_history (invited_id)')
+
+def _create_change_triggers(cursor, table):
+    """表中的行插入、修改或删除时记录到 change_log"""
+    for event, row in (('INSERT', 'NEW'), ('UPDATE', 'NEW'), ('DELETE', 'OLD')):
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS track_{table}_{event.lower()}
+            AFTER {event} ON {table}
+            BEGIN
+                INSERT OR REPLACE INTO change_log (table_name, row_id) VALUES ('{table}', {row}.rowid);
+            END''')
+
+def _migration_change_tracking(cursor):
+    """记录每张备份表中变化过的行，供增量备份使用；同一行只保留最新的序号"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS change_log (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            table_name TEXT NOT NULL,
+            row_id INTEGER NOT NULL,
+            UNIQUE (table_name, row_id)
+        )''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )''')
+    # 之后的迁移新增的表由各自的迁移建立触发器
+    for table in ('users', 'group_settings', 'lotteries', 'lottery_participants', 'invite_history'):
+        _create_change_triggers(cursor, table)
+
+def _migration_points_ledger(cursor):
+    """积分变动只追加到账本，由后台合并到 users.points；users.ledger_seq 记录已合并到的账本序号"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS points_ledger (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            group_id INTEGER,
+            delta REAL NOT NULL,
+            reason TEXT NOT NULL,
+            source TEXT,
+            created_at DATETIME
+        )''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_ledger_user ON points_ledger (user_id, id)')
+    cursor.execute('ALTER TABLE users ADD COLUMN ledger_seq INTEGER NOT NULL DEFAULT 0')
+    _create_change_triggers(cursor, 'points_ledger')
+
+def _migration_group_points(cursor):
+    """按群组记录积分余额供排行榜使用，与 users.points 一起在合并账本时更新
+
+    只能从账本中已合并的记录回填，账本之前的积分没有群组信息，不计入任何群组
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS group_points (
+            group_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            points REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (group_id, user_id)
+        )''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_group_points_rank ON group_points (group_id, points DESC, user_id)')
+    cursor.execute('''
+        INSERT INTO group_points (group_id, user_id, points)
+        SELECT l.group_id, l.user_id, SUM(l.delta) FROM points_ledger l JOIN users u ON u.user_id = l.user_id
+        WHERE l.group_id IS NOT NULL AND l.id <= u.ledger_seq
+        GROUP BY l.group_id, l.user_id
+    ''')
+    _create_change_triggers(cursor, 'group_points')
+
+def _migration_invite_counters(cursor):
+    """邀请人数和邀请获得的积分记录在邀请人的用户行上，与邀请记录在同一事务中更新"""
+    cursor.execute('ALTER TABLE users ADD COLUMN invite_count INTEGER NOT NULL DEFAULT 0')
+    cursor.execute('ALTER TABLE users ADD COLUMN invite_points REAL NOT NULL DEFAULT 0')
+    Database._rebuild_invite_counters(cursor)
+
+def _migration_group_points_seq(cursor):
+    """group_points 的每行记录自己已合并到的账本序号，不再借用 users.ledger_seq
+
+    从备份恢复的用户记录会改变 users.ledger_seq，而本地的 group_points 行不一定被覆盖，
+    各自记录序号后重新合并账本不会重复计算；此前两者同步更新，按用户的序号回填
+    """
+    cursor.execute('ALTER TABLE group_points ADD COLUMN ledger_seq INTEGER')
+    Database._fill_group_points_seq(cursor)
+
+def _migration_group_points_without_lottery(cursor):
+    """抽奖消耗不再计入群组余额，从 group_points 中减去已合并的抽奖消耗
+
+    已归档删除的账本记录无法再找到，其中的抽奖消耗保留在群组余额中
+    """
+    cursor.execute(f'''
+        WITH spent (group_id, user_id, delta) AS (
+            SELECT l.group_id, l.user_id, SUM(l.delta) FROM points_ledger l
+            JOIN group_points g ON g.group_id = l.group_id AND g.user_id = l.user_id
+            WHERE l.reason = '{LEDGER_LOTTERY}' AND l.id <= g.ledger_seq
+            GROUP BY l.group_id, l.user_id
+        )
+        UPDATE group_points SET points = points - (
+            SELECT delta FROM spent WHERE group_id = group_points.group_id AND user_id = group_points.user_id
+        )
+        WHERE (group_id, user_id) IN (SELECT group_id, user_id FROM spent)
+    ''')
+
+# 数据库迁移：(版本号, 说明, 迁移函数)，按版本号顺序执行，当前版本记录在 PRAGMA user_version
+MIGRATIONS = [
+    (1, 'unique lottery participants', _migration_participants_unique),
+    (2, 'hot path indexes', _migration_hot_path_indexes),
+    (3, 'change tracking for incremental backups', _migration_change_tracking),
+    (4, 'append-only points ledger', _migration_points_ledger),
+    (5, 'per-group points for leaderboards', _migration_group_points),
+    (6, 'invite counters on users', _migration_invite_counters),
+    (7, 'compaction sequence on group points', _migration_group_points_seq),
+    (8, 'exclude lottery spending from group points', _migration_group_points_without_lottery),
+]
+
+# 写事务的监控指标
+COMMITS = registry.counter('points_db_commits_total', '已提交的写事务数')
+ROLLBACKS = registry.counter('points_db_rollbacks_total', '回滚的写事务数')
+COMMIT_SECONDS = registry.histogram('points_db_commit_seconds', '提交写事务的耗时')
+LOCK_WAIT_SECONDS = registry.histogram('points_db_lock_wait_seconds', '等待写锁的耗时')
+
+# 只读内存缓存的方法在每条消息上都会调用，不计入，避免监控本身成为开销
+@instrumented(DB_SLOW_QUERY_MS / 1000, exclude=(
+    'transaction', 'reader', 'close', 'is_group_allowed', 'get_group_settings', 'find_keyword_lottery'
+))
 class Database:
-    def __init__(self, db_file):
+    def __init__(self, db_file, profile=None):
         self.db_file = db_file
-        self.conn = sqlite3.connect(db_file, check_same_thread=False)
+        self.profile = dict(SQLITE_PROFILE, **(profile or {}))
+
+        # 写连接：所有写操作持有 self.lock 串行执行
+        self.conn = self._connect()
+        self.lock = threading.RLock()
+        self.write_count = 0  # 已提交事务修改的行数，供备份调度判断数据是否有变化
+
+        # 读连接：每个线程一个，WAL 模式下读不会被写阻塞
+        self._local = threading.local()
+        self._readers = []
+        self._readers_lock = threading.Lock()
+
+        # 群组白名单和群组设置缓存
+        self.allowed_groups = set(ALLOWED_GROUPS)
+        self._settings_cache = {}
+        self._settings_lock = threading.Lock()
+        self._settings_generation = 0  # 每次写入缓存时递增，读取期间缓存有变化时不回填读到的旧数据
+
+        # 口令抽奖索引：group_id -> {口令: (lottery_id, end_time)}
+        self._keyword_index = {}
+
         self.create_tables()
+        self.migrate()
         self.init_allowed_groups()
+        self.load_group_settings()
+        self.load_keyword_index()
+
+        # 群组积分排行缓存，写入积分后记录变动的用户
+        self.leaderboard = Leaderboard(self, LEADERBOARD_SIZE)
+
+        # 积分写缓冲
+        self.points_buffer = PointsAccumulator(self, POINTS_FLUSH_INTERVAL, POINTS_FLUSH_SIZE)
+        self.points_buffer.start()
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.db_file,
+            check_same_thread=False,
+            timeout=self.profile['busy_timeout'] / 1000
+        )
+        for pragma in ('journal_mode', 'synchronous', 'cache_size', 'mmap_size'):
+            value = self.profile.get(pragma)
+            if value is not None:
+                conn.execute(f'PRAGMA {pragma} = {value}')
+        return conn
+
+    def reader(self):
+        """返回当前线程的只读连接；内存数据库无法跨连接共享，直接使用写连接"""
+        if self.db_file == ':memory:':
+            return self.conn
+
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._connect()
+            conn.execute('PRAGMA query_only = 1')
+            self._local.conn = conn
+            with self._readers_lock:
+                self._readers.append(conn)
+        return conn
+
+    def _query(self, query, params=()):
+        """在只读连接上执行查询并取回全部结果"""
+        cursor = self.reader().execute(query, params)
+        try:
+            return cursor.fetchall()
+        finally:
+            cursor.close()
+
+    def _query_one(self, query, params=()):
+        # 及时关闭游标，避免未结束的语句让连接一直停留在旧快照上
+        cursor = self.reader().execute(query, params)
+        try:
+            return cursor.fetchone()
+        finally:
+            cursor.close()
+
+    @contextmanager
+    def transaction(self):
+        """在同一个事务中执行多条语句，退出时统一提交"""
+        start = time.perf_counter()
+        with self.lock:
+            LOCK_WAIT_SECONDS.observe(time.perf_counter() - start)
+            cursor = self.conn.cursor()
+            changes = self.conn.total_changes
+            try:
+                yield cursor
+                start = time.perf_counter()
+                self.conn.commit()
+                COMMIT_SECONDS.observe(time.perf_counter() - start)
+                COMMITS.inc()
+                self.write_count += self.conn.total_changes - changes
+            except Exception:
+                self.conn.rollback()
+                ROLLBACKS.inc()
+                raise
+
+    def close(self):
+        """写入缓冲中的积分并关闭数据库连接"""
+        self.points_buffer.stop()
+        with self._readers_lock:
+            for conn in self._readers:
+                conn.close()
+            self._readers = []
+        with self.lock:
+            self.conn.close()
 
     def create_tables(self):
-        cursor = self.conn.cursor()
-        
+        with self.transaction() as cursor:
+            self._create_tables(cursor)
+
+    def _create_tables(self, cursor):
         # 用户表
         cursor.execute('''
         CREATE TABLE IF NOT EXISTS users (
@@ -80,151 +388,870 @@ class Database:
             FOREIGN KEY (invited_id) REFERENCES users(user_id)
         )''')
 
-        self.conn.commit()
+    def get_schema_version(self):
+        return self.conn.execute('PRAGMA user_version').fetchone()[0]
+
+    def migrate(self):
+        """执行尚未应用的迁移，每个迁移在独立事务中完成并更新 user_version"""
+        with self.lock:
+            version = self.get_schema_version()
+            for target, description, migration in MIGRATIONS:
+                if target <= version:
+                    continue
+                with self.transaction() as cursor:
+                    cursor.execute('BEGIN')
+                    migration(cursor)
+                    cursor.execute(f'PRAGMA user_version = {target}')
+                version = target
+                logger.info(f"Applied migration {target}: {description}")
 
     def init_allowed_groups(self):
-        cursor = self.conn.cursor()
-        for group_id in ALLOWED_GROUPS:
-            cursor.execute('''
-                INSERT OR REPLACE INTO group_settings 
-                (group_id, is_allowed) 
-                VALUES (?, 1)
-            ''', (group_id,))
-        self.conn.commit()
+        """把配置中的白名单群组标记为允许，已有的群组保留自定义设置"""
+        groups = [(group_id,) for group_id in ALLOWED_GROUPS]
+        with self.transaction() as cursor:
+            cursor.executemany('INSERT OR IGNORE INTO group_settings (group_id) VALUES (?)', groups)
+            cursor.executemany('UPDATE group_settings SET is_allowed = 1 WHERE group_id = ? AND NOT is_allowed', groups)
 
     def get_user(self, user_id):
-        cursor = self.conn.cursor()
-        cursor.execute('SELECT * FROM users WHERE user_id = ?', (user_id,))
-        return cursor.fetchone()
+        """返回用户记录，积分字段为包含账本中未合并变动的余额"""
+        # 先写入该用户缓冲中的积分，保证读到最新数据
+        if self.points_buffer.has_pending(user_id):
+            self.points_buffer.flush()
+        return self._query_one(f'''
+            SELECT user_id, username, {BALANCE_SQL}, last_checkin, invite_code, invited_by, joined_date, last_message_time,
+                   invite_count, invite_points
+            FROM users WHERE user_id = ?
+        ''', (user_id,))
+
+    def get_balance(self, user_id):
+        """返回用户当前的积分余额，用户不存在时返回 None"""
+        if self.points_buffer.has_pending(user_id):
+            self.points_buffer.flush()
+        row = self._query_one(f'SELECT {BALANCE_SQL} FROM users WHERE user_id = ?', (user_id,))
+        return row[0] if row else None
+
+    def get_ledger(self, user_id, limit=20):
+        """返回用户最近的积分变动 (id, group_id, delta, reason, source, created_at)，新的在前"""
+        return self._query(
+            'SELECT id, group_id, delta, reason, source, created_at FROM points_ledger '
+            'WHERE user_id = ? ORDER BY id DESC LIMIT ?',
+            (user_id, limit)
+        )
+
+    def get_group_top(self, group_id, limit):
+        """按群组余额从高到低返回前 limit 名 (user_id, username, 余额)
+
+        从 idx_group_points_rank 索引读取已合并的排行，再加上账本末尾有未合并变动的用户：
+        这些用户之外的排名不受影响，多读取与它们数量相同的行即可得到准确的前 limit 名
+        """
+        return self._query(f'''
+            WITH {GROUP_TAIL_SQL},
+            candidates (user_id) AS (
+                SELECT user_id FROM (
+                    SELECT user_id FROM group_points WHERE group_id = :group
+                    ORDER BY points DESC, user_id LIMIT :limit + (SELECT COUNT(*) FROM tail)
+                )
+                UNION SELECT user_id FROM tail
+            )
+            SELECT c.user_id, u.username, COALESCE(g.points, 0) + COALESCE(t.delta, 0) AS balance
+            FROM candidates c
+            JOIN users u ON u.user_id = c.user_id
+            LEFT JOIN group_points g ON g.group_id = :group AND g.user_id = c.user_id
+            LEFT JOIN tail t ON t.user_id = c.user_id
+            ORDER BY balance DESC, c.user_id LIMIT :limit
+        ''', {'group': group_id, 'limit': limit})
+
+    def get_group_balances(self, group_id, user_ids):
+        """返回指定用户在群组中的 (user_id, username, 余额)，不存在的用户不返回"""
+        user_ids = list(user_ids)
+        if not user_ids:
+            return []
+        placeholders = ','.join(['?' for _ in user_ids])
+        return self._query(f'''
+            SELECT u.user_id, u.username, COALESCE(g.points, 0) + COALESCE((
+                SELECT SUM(delta) FROM points_ledger
+                WHERE user_id = u.user_id AND id > COALESCE(g.ledger_seq, 0) AND group_id = ? AND {GROUP_LEDGER_SQL}
+            ), 0)
+            FROM users u LEFT JOIN group_points g ON g.group_id = ? AND g.user_id = u.user_id
+            WHERE u.user_id IN ({placeholders})
+        ''', [group_id, group_id] + user_ids)
+
+    def get_group_rank(self, group_id, user_id):
+        """返回用户在群组中的 (名次, 余额)，在群组中没有积分记录时返回 None
+
+        名次由索引上余额更高的行数加上账本末尾余额更高的用户数得出，不需要排序整个群组
+        """
+        row = self._query_one(f'''
+            WITH {GROUP_TAIL_SQL},
+            me (balance) AS (
+                SELECT COALESCE((SELECT points FROM group_points WHERE group_id = :group AND user_id = :user), 0)
+                     + COALESCE((SELECT delta FROM tail WHERE user_id = :user), 0)
+                WHERE EXISTS (SELECT 1 FROM group_points WHERE group_id = :group AND user_id = :user)
+                   OR EXISTS (SELECT 1 FROM tail WHERE user_id = :user)
+            )
+            SELECT 1 + (
+                SELECT COUNT(*) FROM group_points
+                WHERE group_id = :group AND points > me.balance AND user_id NOT IN (SELECT user_id FROM tail)
+            ) + (
+                SELECT COUNT(*) FROM tail t LEFT JOIN group_points g ON g.group_id = :group AND g.user_id = t.user_id
+                WHERE COALESCE(g.points, 0) + t.delta > me.balance
+            ) + (
+                SELECT COUNT(*) FROM group_points
+                WHERE group_id = :group AND points = me.balance AND user_id < :user
+                AND user_id NOT IN (SELECT user_id FROM tail)
+            ) + (
+                SELECT COUNT(*) FROM tail t LEFT JOIN group_points g ON g.group_id = :group AND g.user_id = t.user_id
+                WHERE COALESCE(g.points, 0) + t.delta = me.balance AND t.user_id < :user
+            ), me.balance
+            FROM me
+        ''', {'group': group_id, 'user': user_id})
+        return tuple(row) if row else None
+
+    @staticmethod
+    def _append_ledger(cursor, entries):
+        """追加积分变动：entries 为 (user_id, group_id, 积分增量, 原因, 来源, 时间) 列表"""
+        cursor.executemany(
+            'INSERT INTO points_ledger (user_id, group_id, delta, reason, source, created_at) VALUES (?, ?, ?, ?, ?, ?)',
+            entries
+        )
 
     def add_user(self, user_id, username):
-        if not self.get_user(user_id):
-            cursor = self.conn.cursor()
+        with self.transaction() as cursor:
             cursor.execute(
-                'INSERT INTO users (user_id, username, joined_date) VALUES (?, ?, ?)',
+                'INSERT OR IGNORE INTO users (user_id, username, joined_date) VALUES (?, ?, ?)',
                 (user_id, username, datetime.now())
             )
-            self.conn.commit()
 
-    def update_points(self, user_id, points_delta):
-        cursor = self.conn.cursor()
-        cursor.execute(
-            'UPDATE users SET points = points + ? WHERE user_id = ?',
-            (points_delta, user_id)
+    def update_points(self, user_id, points_delta, reason=LEDGER_ADMIN, source=None, group_id=None):
+        """记录一次积分变动，用户不存在时返回 False"""
+        # 只在缓冲中有消息积分的新用户还没有用户记录，先写入
+        if self.points_buffer.has_pending(user_id):
+            self.points_buffer.flush()
+        with self.transaction() as cursor:
+            cursor.execute('''
+                INSERT INTO points_ledger (user_id, group_id, delta, reason, source, created_at)
+                SELECT ?, ?, ?, ?, ?, ? WHERE EXISTS (SELECT 1 FROM users WHERE user_id = ?)
+            ''', (user_id, group_id, points_delta, reason, source, datetime.now(), user_id))
+            updated = cursor.rowcount > 0
+        if updated:
+            self.leaderboard.touch([(group_id, user_id)])
+        return updated
+
+    def checkin(self, user_id, points, group_id=None):
+        """每日签到：今天未签到时加分并记录签到日期，返回是否签到成功"""
+        today = datetime.now().date().isoformat()
+        with self.transaction() as cursor:
+            cursor.execute('''
+                UPDATE users SET last_checkin = ?
+                WHERE user_id = ? AND (last_checkin IS NULL OR last_checkin != ?)
+            ''', (today, user_id, today))
+            if cursor.rowcount == 0:
+                return False
+            self._append_ledger(cursor, [(user_id, group_id, points, LEDGER_DAILY, None, datetime.now())])
+        self.leaderboard.touch([(group_id, user_id)])
+        return True
+
+    def set_invite_code(self, user_id, invite_code):
+        with self.transaction() as cursor:
+            cursor.execute(
+                'UPDATE users SET invite_code = ? WHERE user_id = ?',
+                (invite_code, user_id)
+            )
+
+    def get_user_by_invite_code(self, invite_code):
+        return self._query_one('SELECT * FROM users WHERE invite_code = ?', (invite_code,))
+
+    def get_invite_stats(self, user_id):
+        """返回 (邀请人数, 邀请获得积分)"""
+        return self._query_one('SELECT invite_count, invite_points FROM users WHERE user_id = ?', (user_id,))
+
+    def rebuild_invite_counters(self):
+        """按邀请记录重新计算所有用户的邀请计数，返回修正的用户数"""
+        with self.transaction() as cursor:
+            return self._rebuild_invite_counters(cursor)
+
+    @staticmethod
+    def _rebuild_invite_counters(cursor):
+        # 只更新计数不一致的用户，避免每次重建都让全部用户进入增量备份
+        cursor.execute('''
+            WITH stats (inviter_id, invite_count, invite_points) AS (
+                SELECT inviter_id, COUNT(*), COALESCE(SUM(points_awarded), 0) FROM invite_history GROUP BY inviter_id
+            )
+            SELECT u.user_id, COALESCE(s.invite_count, 0), COALESCE(s.invite_points, 0)
+            FROM users u LEFT JOIN stats s ON s.inviter_id = u.user_id
+            WHERE u.invite_count != COALESCE(s.invite_count, 0) OR u.invite_points != COALESCE(s.invite_points, 0)
+        ''')
+        rows = cursor.fetchall()
+        cursor.executemany(
+            'UPDATE users SET invite_count = ?, invite_points = ? WHERE user_id = ?',
+            [(count, points, user_id) for user_id, count, points in rows]
+        )
+        return len(rows)
+
+    def get_invite_tree(self, user_id, max_depth=5):
+        """返回用户直接和间接邀请的用户 (层级, 邀请人ID, 被邀请人ID, 用户名, 邀请时间, 奖励积分, 下级邀请人数)
+
+        递归查询沿 idx_invite_inviter 逐层展开；每个用户只能被邀请一次，邀请关系只可能在回到起点时成环
+        """
+        return self._query('''
+            WITH RECURSIVE tree (depth, inviter_id, invited_id, invite_time, points_awarded) AS (
+                SELECT 1, inviter_id, invited_id, invite_time, points_awarded
+                FROM invite_history WHERE inviter_id = :root
+                UNION ALL
+                SELECT t.depth + 1, h.inviter_id, h.invited_id, h.invite_time, h.points_awarded
+                FROM tree t JOIN invite_history h ON h.inviter_id = t.invited_id
+                WHERE t.depth < :depth AND h.invited_id != :root
+            )
+            SELECT t.depth, t.inviter_id, t.invited_id, u.username, t.invite_time, t.points_awarded,
+                   COALESCE(u.invite_count, 0)
+            FROM tree t LEFT JOIN users u ON u.user_id = t.invited_id
+            ORDER BY t.depth, t.inviter_id, t.invite_time
+        ''', {'root': user_id, 'depth': max_depth})
+
+    def record_invite(self, inviter_id, invited_id, group_id, points):
+        """记录邀请并奖励邀请人，被邀请人已被邀请过时返回 False"""
+        with self.transaction() as cursor:
+            cursor.execute(
+                'INSERT OR IGNORE INTO invite_history (inviter_id, invited_id, group_id, points_awarded) VALUES (?, ?, ?, ?)',
+                (inviter_id, invited_id, group_id, points)
+            )
+            if cursor.rowcount == 0:
+                return False
+            cursor.execute(
+                'UPDATE users SET invite_count = invite_count + 1, invite_points = invite_points + ? WHERE user_id = ?',
+                (points, inviter_id)
+            )
+            self._append_ledger(cursor, [(inviter_id, group_id, points, LEDGER_INVITE, str(invited_id), datetime.now())])
+        self.leaderboard.touch([(group_id, inviter_id)])
+        return True
+
+    def apply_points_batch(self, entries):
+        """批量写入积分缓冲：entries 为 (user_id, username, 积分增量, 最后发言时间, group_id) 列表"""
+        with self.transaction() as cursor:
+            self._apply_points(cursor, entries)
+        self.leaderboard.touch(self._point_changes(entries))
+
+    def apply_message_batch(self, entries, joins):
+        """在一个事务内写入一批群消息：entries 同 apply_points_batch，
+        joins 为免费抽奖的 (lottery_id, user_id, username) 列表，按顺序返回每个参与的 JOIN_* 状态码"""
+        with self.transaction() as cursor:
+            self._apply_points(cursor, entries)
+            results = [self._add_participant(cursor, *join) for join in joins]
+        self.leaderboard.touch(self._point_changes(entries))
+        return results
+
+    @staticmethod
+    def _point_changes(entries):
+        return [(group_id, user_id) for user_id, _, delta, _, group_id in entries if delta]
+
+    @classmethod
+    def _apply_points(cls, cursor, entries):
+        """创建新用户并把积分追加到账本，不修改已有的用户行；最后发言时间在合并账本时更新"""
+        now = datetime.now()
+        cursor.executemany(
+            'INSERT OR IGNORE INTO users (user_id, username, joined_date) VALUES (?, ?, ?)',
+            [(user_id, username, now) for user_id, username, _, _, _ in entries]
         )
-        self.conn.commit()
+        cls._append_ledger(cursor, [
+            (user_id, group_id, delta, LEDGER_MESSAGE, None, message_time or now)
+            for user_id, _, delta, message_time, group_id in entries if delta
+        ])
+
+    def compact_ledger(self, batch_size=50000):
+        """把账本中最多 batch_size 条尚未合并的变动合并到 users.points，返回合并的条数
+
+        users 和 group_points 的每行各自记录已合并到的序号 ledger_seq，
+        重复合并或从备份恢复后重新合并都不会重复计算
+        """
+        start_id = int(self.get_meta('ledger_compacted_id', 0))
+        with self.transaction() as cursor:
+            cursor.execute(
+                'SELECT MAX(id), COUNT(*) FROM (SELECT id FROM points_ledger WHERE id > ? ORDER BY id LIMIT ?)',
+                (start_id, batch_size)
+            )
+            end_id, count = cursor.fetchone()
+            if not count:
+                return 0
+
+            # 先按群组累加到 group_points，再更新 users；各自以本行的 ledger_seq 判断哪些记录尚未合并。
+            # 不用 UPSERT：外层语句的冲突处理会覆盖 change_log 触发器中的 INSERT OR REPLACE
+            pending = f'''pending (group_id, user_id, delta) AS (
+                SELECT l.group_id, l.user_id, SUM(l.delta) FROM points_ledger l
+                LEFT JOIN group_points g ON g.group_id = l.group_id AND g.user_id = l.user_id
+                WHERE l.id > :start AND l.id <= :end AND l.group_id IS NOT NULL AND l.id > COALESCE(g.ledger_seq, 0)
+                AND l.{GROUP_LEDGER_SQL}
+                GROUP BY l.group_id, l.user_id
+            )'''
+            params = {'start': start_id, 'end': end_id}
+            cursor.execute(f'''
+                WITH {pending}
+                UPDATE group_points SET points = points + (
+                    SELECT delta FROM pending WHERE group_id = group_points.group_id AND user_id = group_points.user_id
+                ), ledger_seq = :end
+                WHERE (group_id, user_id) IN (SELECT group_id, user_id FROM pending)
+            ''', params)
+            cursor.execute(f'''
+                WITH {pending}
+                INSERT INTO group_points (group_id, user_id, points, ledger_seq)
+                SELECT group_id, user_id, delta, :end FROM pending p WHERE NOT EXISTS (
+                    SELECT 1 FROM group_points WHERE group_id = p.group_id AND user_id = p.user_id
+                )
+            ''', params)
+
+            tail = 'FROM points_ledger WHERE user_id = users.user_id AND id > users.ledger_seq AND id <= :end'
+            cursor.execute(f'''
+                UPDATE users SET
+                    points = points + COALESCE((SELECT SUM(delta) {tail}), 0),
+                    last_message_time = COALESCE(
+                        (SELECT MAX(created_at) {tail} AND reason = '{LEDGER_MESSAGE}'), last_message_time
+                    ),
+                    ledger_seq = :end
+                WHERE ledger_seq < :end AND user_id IN (
+                    SELECT DISTINCT user_id FROM points_ledger WHERE id > :start AND id <= :end
+                )
+            ''', params)
+            cursor.execute(
+                'INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', ('ledger_compacted_id', str(end_id))
+            )
+            return count
+
+    @staticmethod
+    def _fill_group_points_seq(cursor):
+        # 没有合并序号的 group_points 行是与用户的 ledger_seq 同步合并的
+        cursor.execute('''
+            UPDATE group_points SET ledger_seq = COALESCE((
+                SELECT ledger_seq FROM users WHERE user_id = group_points.user_id
+            ), 0)
+            WHERE ledger_seq IS NULL
+        ''')
+
+    def export_ledger_segment(self, before, limit=50000):
+        """返回 before 之前、已合并到 users.points 和 group_points 的最早一段账本记录（按 id 排序）"""
+        return self._query(f'''
+            SELECT id, user_id, group_id, delta, reason, source, created_at FROM points_ledger
+            WHERE created_at < ? AND id <= COALESCE((SELECT ledger_seq FROM users WHERE user_id = points_ledger.user_id), 0)
+            AND (group_id IS NULL OR NOT {GROUP_LEDGER_SQL} OR id <= COALESCE((
+                SELECT ledger_seq FROM group_points
+                WHERE group_id = points_ledger.group_id AND user_id = points_ledger.user_id
+            ), 0))
+            ORDER BY id LIMIT ?
+        ''', (before, limit))
+
+    def delete_ledger_rows(self, ids):
+        """删除已归档的账本记录"""
+        with self.transaction() as cursor:
+            cursor.executemany('DELETE FROM points_ledger WHERE id = ?', [(ledger_id,) for ledger_id in ids])
+
+    def load_group_settings(self):
+        """预加载全部群组设置到缓存"""
+        rows = self._query('SELECT * FROM group_settings')
+        with self._settings_lock:
+            self._settings_generation += 1
+            self._settings_cache = {row[0]: GroupSettings(*row) for row in rows}
+
+    def _cache_group_settings(self, group_id, row):
+        with self._settings_lock:
+            self._settings_generation += 1
+            self._settings_cache[group_id] = GroupSettings(*row) if row else None
 
     def get_group_settings(self, group_id):
-        cursor = self.conn.cursor()
-        cursor.execute('SELECT * FROM group_settings WHERE group_id = ?', (group_id,))
-        return cursor.fetchone()
+        try:
+            return self._settings_cache[group_id]
+        except KeyError:
+            pass
+
+        generation = self._settings_generation
+        row = self._query_one('SELECT * FROM group_settings WHERE group_id = ?', (group_id,))
+        settings = GroupSettings(*row) if row else None
+        with self._settings_lock:
+            # 读取期间设置被修改过时，读到的可能是旧数据，不写入缓存
+            if self._settings_generation == generation:
+                self._settings_cache[group_id] = settings
+        return settings
 
     def set_group_settings(self, group_id, settings):
-        cursor = self.conn.cursor()
-        cursor.execute('''
-            INSERT OR REPLACE INTO group_settings 
-            (group_id, min_words, points_per_word, points_per_media, daily_points, invite_points, is_allowed)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            group_id,
-            settings.get('min_words', 5),
-            settings.get('points_per_word', 0.1),
-            settings.get('points_per_media', 1),
-            settings.get('daily_points', 5),
-            settings.get('invite_points', 10),
-            1 if group_id in ALLOWED_GROUPS else 0
-        ))
-        self.conn.commit()
+        # 提交后仍持有写锁把新设置写入缓存，缓存的更新顺序与提交顺序一致
+        with self.lock:
+            with self.transaction() as cursor:
+                cursor.execute('''
+                    INSERT OR REPLACE INTO group_settings 
+                    (group_id, min_words, points_per_word, points_per_media, daily_points, invite_points, is_allowed)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', (
+                    group_id,
+                    settings.get('min_words', 5),
+                    settings.get('points_per_word', 0.1),
+                    settings.get('points_per_media', 1),
+                    settings.get('daily_points', 5),
+                    settings.get('invite_points', 10),
+                    1 if group_id in self.allowed_groups else 0
+                ))
+                cursor.execute('SELECT * FROM group_settings WHERE group_id = ?', (group_id,))
+                row = cursor.fetchone()
+            self._cache_group_settings(group_id, row)
 
     def is_group_allowed(self, group_id):
-        return group_id in ALLOWED_GROUPS
+        return group_id in self.allowed_groups
+
+    def allow_group(self, group_id):
+        """将群组加入白名单，已在白名单中时返回 False"""
+        if group_id in self.allowed_groups:
+            return False
+        self.allowed_groups.add(group_id)
+        self._set_group_allowed(group_id, 1)
+        return True
+
+    def disallow_group(self, group_id):
+        """将群组移出白名单，不在白名单中时返回 False"""
+        if group_id not in self.allowed_groups:
+            return False
+        self.allowed_groups.discard(group_id)
+        self._set_group_allowed(group_id, 0)
+        return True
+
+    def _set_group_allowed(self, group_id, is_allowed):
+        with self.lock:
+            with self.transaction() as cursor:
+                cursor.execute('INSERT OR IGNORE INTO group_settings (group_id) VALUES (?)', (group_id,))
+                cursor.execute(
+                    'UPDATE group_settings SET is_allowed = ? WHERE group_id = ?',
+                    (is_allowed, group_id)
+                )
+                cursor.execute('SELECT * FROM group_settings WHERE group_id = ?', (group_id,))
+                row = cursor.fetchone()
+            self._cache_group_settings(group_id, row)
 
     def create_lottery(self, group_id, creator_id, points_required, keyword, end_time, 
                       max_participants, winners_count, prize_description, prize_type="normal"):
-        cursor = self.conn.cursor()
-        cursor.execute('''
-            INSERT INTO lotteries 
-            (group_id, creator_id, points_required, keyword, end_time, max_participants, 
-             status, winners_count, prize_description, prize_type)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            group_id, creator_id, points_required, keyword, end_time, max_participants,
-            'active', winners_count, prize_description, prize_type
-        ))
-        self.conn.commit()
-        return cursor.lastrowid
+        with self.transaction() as cursor:
+            cursor.execute('''
+                INSERT INTO lotteries 
+                (group_id, creator_id, points_required, keyword, end_time, max_participants, 
+                 status, winners_count, prize_description, prize_type)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (
+                group_id, creator_id, points_required, keyword, end_time, max_participants,
+                'active', winners_count, prize_description, prize_type
+            ))
+            lottery_id = cursor.lastrowid
+        if keyword:
+            self._index_keyword(group_id, keyword, lottery_id, end_time)
+        return lottery_id
 
     def get_lottery(self, lottery_id):
-        cursor = self.conn.cursor()
-        cursor.execute('SELECT * FROM lotteries WHERE id = ?', (lottery_id,))
-        return cursor.fetchone()
+        return self._query_one('SELECT * FROM lotteries WHERE id = ?', (lottery_id,))
 
     def get_active_lotteries(self, group_id):
-        cursor = self.conn.cursor()
-        cursor.execute(
+        return self._query(
             'SELECT * FROM lotteries WHERE group_id = ? AND status = "active"',
             (group_id,)
         )
-        return cursor.fetchall()
 
-    def join_lottery(self, lottery_id, user_id, username):
-        cursor = self.conn.cursor()
-        # 检查是否已经参与
-        cursor.execute(
-            'SELECT * FROM lottery_participants WHERE lottery_id = ? AND user_id = ?',
-            (lottery_id, user_id)
+    def get_next_lottery_end(self):
+        """返回最早结束的进行中抽奖的结束时间，没有时返回 None"""
+        end_time = self._query_one('SELECT MIN(end_time) FROM lotteries WHERE status = "active"')[0]
+        return datetime.fromisoformat(end_time) if end_time else None
+
+    def get_due_lotteries(self, now=None):
+        """返回已到结束时间但尚未开奖的抽奖"""
+        return self._query(
+            'SELECT * FROM lotteries WHERE status = "active" AND end_time <= ? ORDER BY end_time',
+            (now or datetime.now(),)
         )
-        if cursor.fetchone():
-            return False
-            
+
+    def draw_lottery(self, lottery_id, winners_count):
+        """开奖：一次遍历参与者随机抽取中奖者，批量标记并结束抽奖
+
+        返回中奖者 (user_id, username) 列表；抽奖已不在进行中时返回 None
+        """
+        rng = random.SystemRandom()
+        with self.transaction() as cursor:
+            cursor.execute(
+                'UPDATE lotteries SET status = "finished" WHERE id = ? AND status = "active"',
+                (lottery_id,)
+            )
+            if cursor.rowcount == 0:
+                return None
+
+            # 蓄水池抽样，内存占用只与中奖人数有关
+            winners = []
+            seen = 0
+            cursor.execute(
+                'SELECT rowid, user_id, username FROM lottery_participants WHERE lottery_id = ?',
+                (lottery_id,)
+            )
+            while True:
+                rows = cursor.fetchmany(1000)
+                if not rows:
+                    break
+                for row in rows:
+                    if len(winners) < winners_count:
+                        winners.append(row)
+                    else:
+                        index = rng.randrange(seen + 1)
+                        if index < winners_count:
+                            winners[index] = row
+                    seen += 1
+
+            cursor.executemany(
+                'UPDATE lottery_participants SET is_winner = 1 WHERE rowid = ?',
+                [(row[0],) for row in winners]
+            )
+
+        return [(user_id, username) for _, user_id, username in winners]
+
+    def load_keyword_index(self, group_id=None):
+        """从数据库加载未过期的口令抽奖，group_id 为空时重建全部索引"""
+        query = 'SELECT id, group_id, keyword, end_time FROM lotteries ' \
+                'WHERE status = "active" AND keyword != "" AND end_time > ?'
+        params = (datetime.now(),)
+        if group_id is not None:
+            query += ' AND group_id = ?'
+            params += (group_id,)
+        rows = self._query(query + ' ORDER BY id', params)
+
+        with self.lock:
+            if group_id is None:
+                self._keyword_index = {}
+            else:
+                self._keyword_index.pop(group_id, None)
+            for lottery_id, lottery_group_id, keyword, end_time in rows:
+                self._index_keyword(lottery_group_id, keyword, lottery_id, end_time)
+
+    def _index_keyword(self, group_id, keyword, lottery_id, end_time):
+        if isinstance(end_time, str):
+            end_time = datetime.fromisoformat(end_time)
+        with self.lock:
+            keywords = self._keyword_index.setdefault(group_id, {})
+            # 同一口令以最早创建的抽奖为准
+            keywords.setdefault(keyword, (lottery_id, end_time))
+
+    def unindex_lottery(self, group_id, lottery_id):
+        """抽奖结束后从口令索引中移除，并补上同口令的其他抽奖"""
+        # 其他线程可能同时写入索引，遍历副本；复制在持有 GIL 时一次完成，不需要加写锁
+        keywords = self._keyword_index.get(group_id)
+        if keywords and any(entry[0] == lottery_id for entry in list(keywords.values())):
+            self.load_keyword_index(group_id)
+
+    def find_keyword_lottery(self, group_id, text):
+        """根据消息内容查找口令抽奖ID，没有匹配时返回 None"""
+        keywords = self._keyword_index.get(group_id)
+        if not keywords:
+            return None
+
+        keyword = text.strip()
+        entry = keywords.get(keyword)
+        while entry:
+            lottery_id, end_time = entry
+            if end_time > datetime.now():
+                return lottery_id
+            # 抽奖已过期，重建该群组索引后再查一次
+            self.unindex_lottery(group_id, lottery_id)
+            entry = self._keyword_index.get(group_id, {}).get(keyword)
+        return None
+
+    def join_lottery(self, lottery_id, user_id, username, points_required=0):
+        """在一个事务内加入抽奖并按需扣除积分，返回 JOIN_* 状态码"""
+        # 先写入该用户缓冲中的积分，扣分判断才准确
+        if points_required > 0 and self.points_buffer.has_pending(user_id):
+            self.points_buffer.flush()
+
+        try:
+            with self.transaction() as cursor:
+                result = self._add_participant(cursor, lottery_id, user_id, username)
+                if result != JOIN_OK:
+                    return result
+
+                if points_required <= 0:
+                    return JOIN_OK
+
+                cursor.execute(f'SELECT {BALANCE_SQL} FROM users WHERE user_id = ?', (user_id,))
+                row = cursor.fetchone()
+                if not row or row[0] < points_required:
+                    # 由 transaction() 回滚，不提交空事务，回滚的行也不计入写入量
+                    raise _InsufficientPoints()
+                cursor.execute('SELECT group_id FROM lotteries WHERE id = ?', (lottery_id,))
+                group_id = cursor.fetchone()[0]
+                self._append_ledger(cursor, [
+                    (user_id, group_id, -points_required, LEDGER_LOTTERY, str(lottery_id), datetime.now())
+                ])
+        except _InsufficientPoints:
+            return JOIN_INSUFFICIENT_POINTS
+
+        # 抽奖消耗不计入群组排行，不需要更新排行缓存
+        return JOIN_OK
+
+    @staticmethod
+    def _add_participant(cursor, lottery_id, user_id, username):
+        """抽奖进行中且用户未参与时加入，返回 JOIN_* 状态码"""
+        # 口令参与的消息不计积分、不经过积分缓冲，在这里创建用户，与参与记录在同一事务内
         cursor.execute(
-            'INSERT INTO lottery_participants (lottery_id, user_id, username) VALUES (?, ?, ?)',
-            (lottery_id, user_id, username)
+            'INSERT OR IGNORE INTO users (user_id, username, joined_date) VALUES (?, ?, ?)',
+            (user_id, username, datetime.now())
         )
-        self.conn.commit()
-        return True
+        cursor.execute('''
+            INSERT OR IGNORE INTO lottery_participants (lottery_id, user_id, username)
+            SELECT ?, ?, ? WHERE EXISTS (
+                SELECT 1 FROM lotteries WHERE id = ? AND status = "active"
+            )
+        ''', (lottery_id, user_id, username, lottery_id))
+        if cursor.rowcount == 0:
+            cursor.execute(
+                'SELECT 1 FROM lottery_participants WHERE lottery_id = ? AND user_id = ?',
+                (lottery_id, user_id)
+            )
+            return JOIN_ALREADY_JOINED if cursor.fetchone() else JOIN_NOT_ACTIVE
+        return JOIN_OK
 
-    def export_data(self):
-        cursor = self.conn.cursor()
-        data = {
-            'users': [],
-            'group_settings': [],
-            'lotteries': [],
-            'lottery_participants': [],
-            'invite_history': []
-        }
-        
-        for table in data.keys():
-            cursor.execute(f'SELECT * FROM {table}')
+    def get_meta(self, key, default=None):
+        row = self._query_one('SELECT value FROM meta WHERE key = ?', (key,))
+        return row[0] if row else default
+
+    def set_meta(self, key, value):
+        with self.transaction() as cursor:
+            cursor.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, str(value)))
+
+    def get_change_seq(self, conn=None):
+        """返回最新的变更序号，没有未备份的变更时返回 None"""
+        if conn is not None:
+            return conn.execute('SELECT MAX(seq) FROM change_log').fetchone()[0]
+        return self._query_one('SELECT MAX(seq) FROM change_log')[0]
+
+    def snapshot(self, path, pages=256, sleep=0.005):
+        """用 SQLite 在线备份 API 分步复制一份时间点一致的快照到 path
+
+        源连接在整个复制过程中保持同一个读事务，WAL 模式下写操作不受影响，
+        复制也不会因为其他连接的写入而重新开始
+        """
+        target = sqlite3.connect(path)
+        try:
+            if self.db_file == ':memory:':
+                with self.lock:
+                    self.conn.backup(target)
+                return
+
+            source = sqlite3.connect(self.db_file, isolation_level=None, timeout=self.profile['busy_timeout'] / 1000)
+            try:
+                source.execute('BEGIN')
+                source.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()
+                source.backup(target, pages=pages, sleep=sleep)
+                source.execute('COMMIT')
+            finally:
+                source.close()
+        finally:
+            target.close()
+
+    def iter_rows(self, table, where='', params=(), batch_size=1000, conn=None):
+        """逐批读取表中的行（包含 _rowid），内存占用与表大小无关；conn 为空时读当前数据库"""
+        cursor = (conn or self.reader()).cursor()
+        try:
+            cursor.execute(f'SELECT rowid AS _rowid, * FROM {table} {where}', params)
             columns = [description[0] for description in cursor.description]
-            rows = cursor.fetchall()
-            data[table] = [dict(zip(columns, row)) for row in rows]
-            
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield dict(zip(columns, row))
+        finally:
+            cursor.close()
+
+    def export_records(self, conn=None):
+        """逐行导出全部备份表，每条记录为 {'table': 表名, 'row': 行数据}"""
+        for table in BACKUP_TABLES:
+            for row in self.iter_rows(table, conn=conn):
+                yield {'table': table, 'row': row}
+
+    def export_change_records(self, max_seq, conn=None):
+        """逐行导出序号不超过 max_seq 的变更，删除的行记录为 {'table': 表名, 'delete': rowid}"""
+        for table in BACKUP_TABLES:
+            changed = 'WHERE rowid IN (SELECT row_id FROM change_log WHERE table_name = ? AND seq <= ?)'
+            for row in self.iter_rows(table, changed, (table, max_seq), conn=conn):
+                yield {'table': table, 'row': row}
+
+            cursor = (conn or self.reader()).cursor()
+            try:
+                cursor.execute(f'''
+                    SELECT row_id FROM change_log WHERE table_name = ? AND seq <= ?
+                    AND row_id NOT IN (SELECT rowid FROM {table})
+                ''', (table, max_seq))
+                for (row_id,) in cursor:
+                    yield {'table': table, 'delete': row_id}
+            finally:
+                cursor.close()
+
+    @staticmethod
+    def _rowid_range(low, high):
+        """rowid 在 [low, high) 内的条件，low 或 high 为 None 时该侧不限"""
+        conditions, params = [], []
+        if low is not None:
+            conditions.append('rowid >= ?')
+            params.append(low)
+        if high is not None:
+            conditions.append('rowid < ?')
+            params.append(high)
+        return ('WHERE ' + ' AND '.join(conditions) if conditions else ''), params
+
+    def get_chunk_starts(self, table, chunk_rows, low=None, high=None, conn=None):
+        """按 rowid 顺序每 chunk_rows 行取一个分块起点，只统计 rowid 在 [low, high) 内的行
+
+        rowid 可能很稀疏（用户ID、群组ID）甚至为负数，按行数划分分块数量才与表大小成正比
+        """
+        where, params = self._rowid_range(low, high)
+        cursor = (conn or self.reader()).cursor()
+        try:
+            cursor.execute(f'''
+                SELECT row_id FROM (
+                    SELECT rowid AS row_id, ROW_NUMBER() OVER (ORDER BY rowid) - 1 AS n FROM {table} {where}
+                ) WHERE n % ? = 0 ORDER BY row_id
+            ''', params + [chunk_rows])
+            return [row_id for (row_id,) in cursor.fetchall()]
+        finally:
+            cursor.close()
+
+    def count_rows(self, table, low=None, high=None, conn=None):
+        """返回 rowid 在 [low, high) 内的行数"""
+        where, params = self._rowid_range(low, high)
+        cursor = (conn or self.reader()).cursor()
+        try:
+            cursor.execute(f'SELECT COUNT(*) FROM {table} {where}', params)
+            return cursor.fetchone()[0]
+        finally:
+            cursor.close()
+
+    def get_changed_rows(self, max_seq, conn=None):
+        """返回序号不超过 max_seq 的变更涉及的 (表名, rowid)"""
+        cursor = (conn or self.reader()).cursor()
+        try:
+            cursor.execute('SELECT table_name, row_id FROM change_log WHERE seq <= ?', (max_seq,))
+            return cursor.fetchall()
+        finally:
+            cursor.close()
+
+    def export_chunk_records(self, table, low=None, high=None, conn=None):
+        """按 rowid 顺序导出表中 rowid 在 [low, high) 内的行"""
+        where, params = self._rowid_range(low, high)
+        for row in self.iter_rows(table, where + ' ORDER BY rowid', params, conn=conn):
+            yield {'table': table, 'row': row}
+
+    def export_data(self):
+        data = {table: [] for table in BACKUP_TABLES}
+        for record in self.export_records():
+            data[record['table']].append(record['row'])
         return data
 
-    def import_data(self, data):
-        cursor = self.conn.cursor()
-        for table, rows in data.items():
-            if not rows:
+    def mark_backed_up(self, max_seq, generation, checksum, chunks=None, backups_since_full=0):
+        """备份上传（或恢复）成功后清理已备份的变更记录，并记录备份代数、校验值和各分块的内容哈希
+
+        chunks 为空时下一次备份会重新读取全部表；分块名为 "表名:起点 rowid"，旧版本按 rowid 编号的分块
+        记录在 backup_chunks 中，不再读取，升级后的第一次备份为全量备份
+        """
+        with self.transaction() as cursor:
+            if max_seq is not None:
+                cursor.execute('DELETE FROM change_log WHERE seq <= ?', (max_seq,))
+            cursor.executemany('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', [
+                ('backup_generation', str(generation)),
+                ('backup_checksum', checksum or ''),
+                ('backup_chunk_ranges', json.dumps(chunks or {})),
+                ('backups_since_full', str(backups_since_full))
+            ])
+
+    def import_records(self, records, batch_size=5000):
+        """批量导入 export_records / export_change_records 格式的记录，返回导入的记录数
+
+        整个导入在一个事务内完成：导入期间放宽同步设置，先删除表上的非唯一索引和变更跟踪触发器，
+        数据写入后再重建，导入的数据不会记录到 change_log
+        """
+        start = time.perf_counter()
+        statements = {}
+        count = 0
+
+        with self.lock:
+            self.conn.execute('PRAGMA synchronous = OFF')
+            try:
+                with self.transaction() as cursor:
+                    cursor.execute('BEGIN')
+                    deferred = self._drop_deferred_objects(cursor)
+
+                    batch_sql, batch = None, []
+                    for record in records:
+                        table = record['table']
+                        if table not in BACKUP_TABLES:
+                            raise ValueError(f"Unknown table in backup: {table}")
+
+                        if 'delete' in record:
+                            sql = f'DELETE FROM {table} WHERE rowid = ?'
+                            values = (record['delete'],)
+                        else:
+                            row = record['row']
+                            key = (table, tuple(row.keys()))
+                            sql = statements.get(key)
+                            if sql is None:
+                                # 导出时的 _rowid 对应表的 rowid
+                                columns = ['rowid' if column == '_rowid' else column for column in row.keys()]
+                                placeholders = ','.join(['?' for _ in columns])
+                                sql = f'INSERT OR REPLACE INTO {table} ({",".join(columns)}) VALUES ({placeholders})'
+                                statements[key] = sql
+                            values = tuple(row.values())
+
+                        # 相同语句的记录攒成一批用 executemany 写入
+                        if sql != batch_sql or len(batch) >= batch_size:
+                            if batch:
+                                cursor.executemany(batch_sql, batch)
+                            batch_sql, batch = sql, []
+                        batch.append(values)
+                        count += 1
+
+                    if batch:
+                        cursor.executemany(batch_sql, batch)
+
+                    # 导入的用户记录各自带有已合并到的账本序号，下次合并从头检查账本
+                    cursor.execute("DELETE FROM meta WHERE key = 'ledger_compacted_id'")
+                    # 旧备份中的用户记录没有邀请计数，按导入的邀请记录重新计算
+                    self._rebuild_invite_counters(cursor)
+                    # 旧备份中的群组余额没有合并序号，当时与同一快照中用户的序号一致
+                    self._fill_group_points_seq(cursor)
+
+                    for sql in deferred:
+                        cursor.execute(sql)
+            finally:
+                self.conn.execute(f'PRAGMA synchronous = {self.profile["synchronous"]}')
+
+        elapsed = time.perf_counter() - start
+        logger.info(f"Imported {count} records in {elapsed:.2f}s ({count / max(elapsed, 1e-6):.0f} rows/s)")
+
+        self.load_group_settings()
+        self.load_keyword_index()
+        self.leaderboard.clear()
+        return count
+
+    def _drop_deferred_objects(self, cursor):
+        """删除备份表上的非唯一索引和触发器，返回重建它们的 SQL"""
+        placeholders = ','.join(['?' for _ in BACKUP_TABLES])
+        cursor.execute(f'''
+            SELECT type, name, sql FROM sqlite_master
+            WHERE type IN ('index', 'trigger') AND sql IS NOT NULL
+            AND tbl_name IN ({placeholders})
+        ''', BACKUP_TABLES)
+        deferred = []
+        for object_type, name, sql in cursor.fetchall():
+            # 唯一索引决定 INSERT OR REPLACE 的冲突行为，必须保留
+            if object_type == 'index' and sql.upper().startswith('CREATE UNIQUE'):
                 continue
-                
-            columns = rows[0].keys()
-            placeholders = ','.join(['?' for _ in columns])
-            column_names = ','.join(columns)
-            
-            for row in rows:
-                values = tuple(row.values())
-                cursor.execute(
-                    f'INSERT OR REPLACE INTO {table} ({column_names}) VALUES ({placeholders})',
-                    values
-                )
-        
-        self.conn.commit()
+            cursor.execute(f'DROP {object_type.upper()} {name}')
+            deferred.append(sql)
+        return deferred
 
-    def update_user_message_time(self, user_id):
-        cursor = self.conn.cursor()
-        cursor.execute(
-            'UPDATE users SET last_message_time = ? WHERE user_id = ?',
-            (datetime.now(), user_id)
+    def import_data(self, data):
+        self.import_records(
+            {'table': table, 'row': row}
+            for table, rows in data.items()
+            for row in rows
         )
-        self.conn.commit()
\ No newline at end of file
+
+    def update_user_message_time(self, user_id):
+        with self.transaction() as cursor:
+            cursor.execute(
+                'UPDATE users SET last_message_time = ? WHERE user_id = ?',
+                (datetime.now(), user_id)
+            )
\ No newline at end of file
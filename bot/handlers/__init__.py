@@ -1,5 +1,6 @@
-from .bot import PointsBot
-from .database import Database
-from .backup import WebDAVBackup
+from .admin import AdminHandlers
+from .points import PointsHandlers
+from .lottery import LotteryHandlers
+from .message import MessageHandlers
 
-__all__ = ['PointsBot', 'Database', 'WebDAVBackup']
\ No newline at end of file
+__all__ = ['AdminHandlers', 'PointsHandlers', 'LotteryHandlers', 'MessageHandlers']
\ No newline at end of file
@@ -1,104 +1,124 @@
 from telegram import Update, ParseMode
 from telegram.ext import CallbackContext
 from telegram.ext import CommandHandler
-from config import SUPER_ADMIN, ALLOWED_GROUPS
+from config import SUPER_ADMIN, ADMIN_CACHE_TTL
+from ..admin_cache import AdminCache
 import logging
 
 logger = logging.getLogger(__name__)
 
+# 所有处理器共用的管理员缓存，由 chat_member 更新刷新
+admin_cache = AdminCache(ADMIN_CACHE_TTL)
+
 def is_admin(update: Update, context: CallbackContext) -> bool:
     if not update.effective_chat.type in ['group', 'supergroup']:
         return False
     
-    user = context.bot.get_chat_member(
+    return admin_cache.is_admin(
+        context.bot,
         update.effective_chat.id,
         update.effective_user.id
     )
-    
-    return user.status in ['creator', 'administrator']
 
 def is_super_admin(user_id: int) -> bool:
     return user_id == SUPER_ADMIN
 
 class AdminHandlers:
-    def __init__(self, db):
+    def __init__(self, db, sender, on_change=None):
+        """回复都经过 sender 发送；on_change 在管理员修改数据后调用，用于请求尽快备份"""
         self.db = db
+        self.sender = sender
+        self.on_change = on_change
+
+    def _changed(self):
+        if self.on_change:
+            self.on_change()
 
     def add_allowed_group(self, update: Update, context: CallbackContext):
         if not is_super_admin(update.effective_user.id):
-            update.message.reply_text("只有超级管理员可以添加群组白名单")
+            self.sender.reply(update.message, "只有超级管理员可以添加群组白名单")
             return
 
         try:
             group_id = int(context.args[0])
-            if group_id not in ALLOWED_GROUPS:
-                ALLOWED_GROUPS.append(group_id)
-                self.db.set_group_settings(group_id, {'is_allowed': True})
-                update.message.reply_text(f"已将群组 {group_id} 添加到白名单")
+            if self.db.allow_group(group_id):
+                self._changed()
+                self.sender.reply(update.message, f"已将群组 {group_id} 添加到白名单")
             else:
-                update.message.reply_text("该群组已在白名单中")
+                self.sender.reply(update.message, "该群组已在白名单中")
         except (IndexError, ValueError):
-            update.message.reply_text("使用方法: /addgroup <群组ID>")
+            self.sender.reply(update.message, "使用方法: /addgroup <群组ID>")
 
     def remove_allowed_group(self, update: Update, context: CallbackContext):
         if not is_super_admin(update.effective_user.id):
-            update.message.reply_text("只有超级管理员可以移除群组白名单")
+            self.sender.reply(update.message, "只有超级管理员可以移除群组白名单")
             return
 
         try:
             group_id = int(context.args[0])
-            if group_id in ALLOWED_GROUPS:
-                ALLOWED_GROUPS.remove(group_id)
-                self.db.set_group_settings(group_id, {'is_allowed': False})
-                update.message.reply_text(f"已将群组 {group_id} 从白名单移除")
+            if self.db.disallow_group(group_id):
+                self._changed()
+                self.sender.reply(update.message, f"已将群组 {group_id} 从白名单移除")
             else:
-                update.message.reply_text("该群组不在白名单中")
+                self.sender.reply(update.message, "该群组不在白名单中")
         except (IndexError, ValueError):
-            update.message.reply_text("使用方法: /removegroup <群组ID>")
+            self.sender.reply(update.message, "使用方法: /removegroup <群组ID>")
 
     def add_points(self, update: Update, context: CallbackContext):
         if not is_admin(update, context):
-            update.message.reply_text("此命令仅管理员可用")
+            self.sender.reply(update.message, "此命令仅管理员可用")
             return
 
         try:
             user_id = int(context.args[0])
             points = float(context.args[1])
             
-            self.db.update_points(user_id, points)
-            update.message.reply_text(
+            if not self.db.update_points(
+                user_id, points, source=str(update.effective_user.id), group_id=update.effective_chat.id
+            ):
+                self.sender.reply(update.message, "用户不存在")
+                return
+            self._changed()
+            self.sender.reply(
+                update.message,
                 f"已为用户 {user_id} 添加 {points} 积分",
                 parse_mode=ParseMode.HTML
             )
             logger.info(f"Admin {update.effective_user.id} added {points} points to user {user_id}")
         except (IndexError, ValueError):
-            update.message.reply_text("使用方法: /addpoints <用户ID> <积分>")
+            self.sender.reply(update.message, "使用方法: /addpoints <用户ID> <积分>")
 
     def deduct_points(self, update: Update, context: CallbackContext):
         if not is_admin(update, context):
-            update.message.reply_text("此命令仅管理员可用")
+            self.sender.reply(update.message, "此命令仅管理员可用")
             return
 
         try:
             user_id = int(context.args[0])
             points = float(context.args[1])
             
-            self.db.update_points(user_id, -points)
-            update.message.reply_text(
+            if not self.db.update_points(
+                user_id, -points, source=str(update.effective_user.id), group_id=update.effective_chat.id
+            ):
+                self.sender.reply(update.message, "用户不存在")
+                return
+            self._changed()
+            self.sender.reply(
+                update.message,
                 f"已从用户 {user_id} 扣除 {points} 积分",
                 parse_mode=ParseMode.HTML
             )
             logger.info(f"Admin {update.effective_user.id} deducted {points} points from user {user_id}")
         except (IndexError, ValueError):
-            update.message.reply_text("使用方法: /deductpoints <用户ID> <积分>")
+            self.sender.reply(update.message, "使用方法: /deductpoints <用户ID> <积分>")
 
     def set_group_settings(self, update: Update, context: CallbackContext):
         if not is_admin(update, context):
-            update.message.reply_text("此命令仅管理员可用")
+            self.sender.reply(update.message, "此命令仅管理员可用")
             return
 
         if not self.db.is_group_allowed(update.effective_chat.id):
-            update.message.reply_text("此群组不在白名单中")
+            self.sender.reply(update.message, "此群组不在白名单中")
             return
 
         try:
@@ -114,38 +134,43 @@ class AdminHandlers:
             }
             
             if setting_type not in valid_settings:
-                update.message.reply_text(
+                self.sender.reply(
+                    update.message,
                     "无效的设置类型\n可用设置：\n" + 
                     "\n".join([f"- {k}: {v}" for k, v in valid_settings.items()])
                 )
                 return
                 
             group_id = update.effective_chat.id
-            current_settings = self.db.get_group_settings(group_id) or {}
+            settings = self.db.get_group_settings(group_id)
+            current_settings = settings._asdict() if settings else {}
             current_settings[setting_type] = value
             
             self.db.set_group_settings(group_id, current_settings)
-            update.message.reply_text(
+            self._changed()
+            self.sender.reply(
+                update.message,
                 f"已更新群组设置：{valid_settings[setting_type]} = {value}",
                 parse_mode=ParseMode.HTML
             )
             logger.info(f"Admin {update.effective_user.id} updated {setting_type} to {value} in group {group_id}")
         except (IndexError, ValueError):
-            update.message.reply_text(
+            self.sender.reply(
+                update.message,
                 "使用方法: /setsetting <设置类型> <值>\n"
                 "例如: /setsetting min_words 5"
             )
 
     def get_group_settings(self, update: Update, context: CallbackContext):
         if not is_admin(update, context):
-            update.message.reply_text("此命令仅管理员可用")
+            self.sender.reply(update.message, "此命令仅管理员可用")
             return
 
         group_id = update.effective_chat.id
         settings = self.db.get_group_settings(group_id)
         
         if not settings:
-            update.message.reply_text("此群组暂无设置")
+            self.sender.reply(update.message, "此群组暂无设置")
             return
             
         settings_text = "当前群组设置：\n"
@@ -156,4 +181,4 @@ class AdminHandlers:
         settings_text += f"邀请积分：{settings[5]}\n"
         settings_text += f"白名单状态：{'已启用' if settings[6] else '未启用'}"
         
-        update.message.reply_text(settings_text, parse_mode=ParseMode.HTML)
\ No newline at end of file
+        self.sender.reply(update.message, settings_text, parse_mode=ParseMode.HTML)
\ No newline at end of file
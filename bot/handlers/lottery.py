@@ -5,23 +5,27 @@ import random
 import logging
 from .admin import is_admin
 from config import ALLOWED_GROUPS, MAX_LOTTERY_DURATION, MAX_WINNERS
+from ..database import JOIN_OK, JOIN_ALREADY_JOINED, JOIN_INSUFFICIENT_POINTS
+from ..sender import PRIORITY_HIGH, PRIORITY_LOW
 
 logger = logging.getLogger(__name__)
 
 class LotteryHandlers:
-    def __init__(self, db):
+    def __init__(self, db, sender, draw_scheduler=None):
         self.db = db
+        self.sender = sender
+        self.draw_scheduler = draw_scheduler
         self.pending_lottery = {}  # 存储正在创建的抽奖信息
 
     def start_lottery_setup(self, update: Update, context: CallbackContext):
         # 检查是否在群组中
         if update.effective_chat.type in ['group', 'supergroup']:
             if not is_admin(update, context):
-                update.message.reply_text("只有管理员可以创建抽奖")
+                self.sender.reply(update.message, "只有管理员可以创建抽奖")
                 return
                 
             if not self.db.is_group_allowed(update.effective_chat.id):
-                update.message.reply_text("此群组不在白名单中")
+                self.sender.reply(update.message, "此群组不在白名单中")
                 return
                 
             # 存储群组ID
@@ -34,7 +38,8 @@ class LotteryHandlers:
             bot_username = context.bot.username
             deep_link = f"https://t.me/{bot_username}?start=lottery"
             
-            update.message.reply_text(
+            self.sender.reply(
+                update.message,
                 "🎉 请点击下方链接私聊我设置抽奖\n"
                 f"{deep_link}"
             )
@@ -140,6 +145,8 @@ class LotteryHandlers:
                     lottery_info['winners_count'],
                     lottery_info['prize_description']
                 )
+                if self.draw_scheduler:
+                    self.draw_scheduler.schedule()
 
                 # 在群组中发布抽奖信息
                 lottery_text = (
@@ -156,9 +163,10 @@ class LotteryHandlers:
                     lottery_text += f"🔑 参与口令：{lottery_info['keyword']}\n"
                     lottery_text += "发送口令即可参与抽奖"
 
-                context.bot.send_message(
+                self.sender.send(
                     lottery_info['group_id'],
                     lottery_text,
+                    PRIORITY_HIGH,
                     parse_mode=ParseMode.HTML
                 )
 
@@ -192,46 +200,37 @@ class LotteryHandlers:
 
     def join_lottery(self, update: Update, context: CallbackContext):
         if not update.effective_chat.type in ['group', 'supergroup']:
-            update.message.reply_text("请在群组中使用此命令")
+            self.sender.reply(update.message, "请在群组中使用此命令")
             return
             
         try:
             lottery_id = int(context.args[0])
         except (IndexError, ValueError):
-            update.message.reply_text("使用方法: /joinlottery <抽奖ID>")
+            self.sender.reply(update.message, "使用方法: /joinlottery <抽奖ID>")
             return
             
         lottery = self.db.get_lottery(lottery_id)
         if not lottery:
-            update.message.reply_text("找不到该抽奖")
+            self.sender.reply(update.message, "找不到该抽奖")
             return
             
         if lottery[7] != 'active':
-            update.message.reply_text("该抽奖已结束")
+            self.sender.reply(update.message, "该抽奖已结束", PRIORITY_LOW)
             return
             
         if lottery[1] != update.effective_chat.id:
-            update.message.reply_text("该抽奖不属于此群组")
-            return
-            
-        user = self.db.get_user(update.effective_user.id)
-        if not user:
-            update.message.reply_text("请先发送消息以创建账户")
+            self.sender.reply(update.message, "该抽奖不属于此群组")
             return
             
-        if lottery[3] > 0:  # 积分抽奖
-            if user[2] < lottery[3]:
-                update.message.reply_text("您的积分不足以参与此抽奖")
-                return
-                
-            # 扣除积分
-            self.db.update_points(update.effective_user.id, -lottery[3])
-            
-        # 加入抽奖
-        if self.db.join_lottery(lottery_id, update.effective_user.id, update.effective_user.username):
-            update.message.reply_text("✅ 成功参与抽奖！")
-            logger.info(f"User {update.effective_user.id} joined lottery #{lottery_id}")
+        # 加入抽奖和扣除积分在同一个事务内完成
+        user_id = update.effective_user.id
+        result = self.db.join_lottery(lottery_id, user_id, update.effective_user.username, lottery[3])
+        if result == JOIN_OK:
+            self.sender.add_join(lottery[1], lottery_id, user_id, update.effective_user.username)
+            logger.info(f"User {user_id} joined lottery #{lottery_id}")
+        elif result == JOIN_ALREADY_JOINED:
+            self.sender.add_join(lottery[1], lottery_id, user_id, update.effective_user.username, joined=False)
+        elif result == JOIN_INSUFFICIENT_POINTS:
+            self.sender.reply(update.message, "您的积分不足以参与此抽奖", PRIORITY_LOW)
         else:
-            update.message.reply_text("您已经参与过此抽奖")
-            if lottery[3] > 0:  # 如果是积分抽奖，退还积分
-                self.db.update_points(update.effective_user.id, lottery[3])
\ No newline at end of file
+            self.sender.reply(update.message, "该抽奖已结束", PRIORITY_LOW)
\ No newline at end of file
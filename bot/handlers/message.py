@@ -1,35 +1,37 @@
 from telegram import Update
 from telegram.ext import CallbackContext
+from datetime import datetime
 import logging
 from config import ALLOWED_GROUPS
+from ..database import JOIN_OK, JOIN_ALREADY_JOINED
 
 logger = logging.getLogger(__name__)
 
 class MessageHandlers:
-    def __init__(self, db):
+    def __init__(self, db, sender):
         self.db = db
+        self.sender = sender
 
-    def handle_message(self, update: Update, context: CallbackContext):
+    def score_message(self, update: Update):
+        """计算一条群消息的积分，返回 (group_id, user_id, username, 积分, 抽奖ID)；
+        消息是抽奖口令时返回对应的抽奖且不计积分，不需要处理的消息返回 None"""
         if not update.effective_chat or not update.effective_user:
-            return
+            return None
             
         if update.effective_chat.type not in ['group', 'supergroup']:
-            return
+            return None
             
         if not self.db.is_group_allowed(update.effective_chat.id):
-            return
+            return None
             
         user_id = update.effective_user.id
         group_id = update.effective_chat.id
         username = update.effective_user.username
         
-        # 确保用户存在
-        self.db.add_user(user_id, username)
-        
         # 获取群组设置
         settings = self.db.get_group_settings(group_id)
         if not settings:
-            return
+            return None
             
         # 初始化积分
         points = 0
@@ -37,16 +39,9 @@ class MessageHandlers:
         # 处理文字消息
         if update.message.text:
             # 检查是否是抽奖口令
-            active_lotteries = self.db.get_active_lotteries(group_id)
-            for lottery in active_lotteries:
-                if lottery[4] and update.message.text.strip() == lottery[4]:
-                    # 是抽奖口令，加入抽奖
-                    if self.db.join_lottery(lottery[0], user_id, username):
-                        update.message.reply_text("✅ 成功参与抽奖！")
-                        logger.info(f"User {user_id} joined lottery #{lottery[0]} by keyword")
-                    else:
-                        update.message.reply_text("您已经参与过此抽奖")
-                    return
+            lottery_id = self.db.find_keyword_lottery(group_id, update.message.text)
+            if lottery_id:
+                return group_id, user_id, username, 0, lottery_id
                     
             # 计算消息积分
             words = len(update.message.text)
@@ -62,7 +57,26 @@ class MessageHandlers:
         ]):
             points = settings[3]  # points_per_media
             
+        return group_id, user_id, username, points, None
+
+    def handle_message(self, update: Update, context: CallbackContext):
+        scored = self.score_message(update)
+        if scored is None:
+            return
+        group_id, user_id, username, points, lottery_id = scored
+
+        if lottery_id:
+            # 是抽奖口令，加入抽奖；参与确认合并后由发送队列统一发送
+            result = self.db.join_lottery(lottery_id, user_id, username)
+            if result == JOIN_OK:
+                self.sender.add_join(group_id, lottery_id, user_id, username)
+                logger.debug("User %s joined lottery #%s by keyword", user_id, lottery_id)
+            elif result == JOIN_ALREADY_JOINED:
+                self.sender.add_join(group_id, lottery_id, user_id, username, joined=False)
+            return
+            
+        # 写入积分缓冲，由缓冲统一创建用户并批量写入积分和发言时间
+        self.db.points_buffer.add(user_id, username, points, datetime.now() if points > 0 else None, group_id)
         if points > 0:
-            self.db.update_points(user_id, points)
-            self.db.update_user_message_time(user_id)
-            logger.info(f"User {user_id} earned {points} points in group {group_id}")
\ No newline at end of file
+            # 每条消息都会执行，日志参数延迟格式化，未开启 debug 时没有开销
+            logger.debug("User %s earned %s points in group %s", user_id, points, group_id)
\ No newline at end of file
@@ -4,47 +4,42 @@ from datetime import datetime, timedelta
 import random
 import string
 import logging
-from config import ALLOWED_GROUPS
+from config import ALLOWED_GROUPS, LEADERBOARD_SIZE, LEADERBOARD_DEFAULT
 
 logger = logging.getLogger(__name__)
 
 class PointsHandlers:
-    def __init__(self, db):
+    def __init__(self, db, sender):
+        """回复都经过 sender 发送，遵守全局和每个聊天的发送频率限制"""
         self.db = db
+        self.sender = sender
 
     def check_points(self, update: Update, context: CallbackContext):
         user_id = update.effective_user.id
         user = self.db.get_user(user_id)
         
         if not user:
-            update.message.reply_text("您还没有积分记录")
+            self.sender.reply(update.message, "您还没有积分记录")
             return
             
-        # 获取邀请统计
-        cursor = self.db.conn.cursor()
-        cursor.execute(
-            'SELECT COUNT(*), SUM(points_awarded) FROM invite_history WHERE inviter_id = ?',
-            (user_id,)
-        )
-        invite_stats = cursor.fetchone()
-        
+        # 邀请统计记录在用户行上
         stats_text = (
             f"👤 用户：@{user[1]}\n"
             f"💰 当前积分：{user[2]:.1f}\n"
             f"📅 注册时间：{user[6]}\n"
-            f"🤝 成功邀请：{invite_stats[0] or 0} 人\n"
-            f"✨ 邀请获得：{invite_stats[1] or 0} 积分"
+            f"🤝 成功邀请：{user[8]} 人\n"
+            f"✨ 邀请获得：{user[9]:g} 积分"
         )
         
-        update.message.reply_text(stats_text, parse_mode=ParseMode.HTML)
+        self.sender.reply(update.message, stats_text, parse_mode=ParseMode.HTML)
 
     def daily_checkin(self, update: Update, context: CallbackContext):
         if not update.effective_chat.type in ['group', 'supergroup']:
-            update.message.reply_text("请在群组中使用此命令")
+            self.sender.reply(update.message, "请在群组中使用此命令")
             return
             
         if not self.db.is_group_allowed(update.effective_chat.id):
-            update.message.reply_text("此群组不在白名单中")
+            self.sender.reply(update.message, "此群组不在白名单中")
             return
             
         user_id = update.effective_user.id
@@ -52,115 +47,144 @@ class PointsHandlers:
         
         user = self.db.get_user(user_id)
         if not user:
-            update.message.reply_text("请先发送消息以创建账户")
+            self.sender.reply(update.message, "请先发送消息以创建账户")
             return
             
         last_checkin = user[3]
         if last_checkin:
             last_checkin = datetime.strptime(last_checkin, '%Y-%m-%d').date()
             if last_checkin == datetime.now().date():
-                update.message.reply_text("您今天已经签到过了")
+                self.sender.reply(update.message, "您今天已经签到过了")
                 return
         
         settings = self.db.get_group_settings(group_id)
         daily_points = settings[4] if settings else 5
         
-        self.db.update_points(user_id, daily_points)
-        cursor = self.db.conn.cursor()
-        cursor.execute(
-            'UPDATE users SET last_checkin = ? WHERE user_id = ?',
-            (datetime.now().date().isoformat(), user_id)
-        )
-        self.db.conn.commit()
+        if not self.db.checkin(user_id, daily_points, group_id):
+            self.sender.reply(update.message, "您今天已经签到过了")
+            return
         
-        update.message.reply_text(
+        self.sender.reply(
+            update.message,
             f"✅ 签到成功！\n💰 获得 {daily_points} 积分",
             parse_mode=ParseMode.HTML
         )
         logger.info(f"User {user_id} checked in and got {daily_points} points")
 
+    def show_top(self, update: Update, context: CallbackContext):
+        """/top [N]：显示本群积分排行前 N 名，只统计在本群获得的积分，抽奖消耗不扣减排行积分"""
+        if not update.effective_chat.type in ['group', 'supergroup']:
+            self.sender.reply(update.message, "请在群组中使用此命令")
+            return
+            
+        if not self.db.is_group_allowed(update.effective_chat.id):
+            self.sender.reply(update.message, "此群组不在白名单中")
+            return
+            
+        limit = LEADERBOARD_DEFAULT
+        if context.args:
+            try:
+                limit = int(context.args[0])
+            except ValueError:
+                self.sender.reply(update.message, f"用法：/top [人数]，人数为 1-{LEADERBOARD_SIZE}")
+                return
+            limit = max(1, min(limit, LEADERBOARD_SIZE))
+            
+        rows = self.db.leaderboard.top(update.effective_chat.id, limit)
+        if not rows:
+            self.sender.reply(update.message, "本群还没有积分记录")
+            return
+            
+        lines = [f"🏆 本群积分排行（前 {len(rows)} 名）"]
+        for index, (user_id, username, points) in enumerate(rows, 1):
+            name = f"@{username}" if username else f"用户 {user_id}"
+            lines.append(f"{index}. {name}：{points:.1f}")
+        lines.append("\n只统计在本群获得的积分，不含抽奖消耗和积分账本启用前的积分")
+        
+        self.sender.reply(update.message, "\n".join(lines), parse_mode=ParseMode.HTML)
+
+    def show_rank(self, update: Update, context: CallbackContext):
+        """/rank：显示自己在本群的积分排名"""
+        if not update.effective_chat.type in ['group', 'supergroup']:
+            self.sender.reply(update.message, "请在群组中使用此命令")
+            return
+            
+        if not self.db.is_group_allowed(update.effective_chat.id):
+            self.sender.reply(update.message, "此群组不在白名单中")
+            return
+            
+        user_id = update.effective_user.id
+        
+        # 先写入该用户缓冲中的积分，排名才包含刚发的消息
+        if self.db.points_buffer.has_pending(user_id):
+            self.db.points_buffer.flush()
+            
+        rank = self.db.leaderboard.rank(update.effective_chat.id, user_id)
+        if not rank:
+            self.sender.reply(update.message, "您在本群还没有积分记录")
+            return
+            
+        self.sender.reply(
+            update.message,
+            f"📊 您在本群的积分排名：第 {rank[0]} 名\n💰 本群积分：{rank[1]:.1f}",
+            parse_mode=ParseMode.HTML
+        )
+
     def generate_invite(self, update: Update, context: CallbackContext):
         if not update.effective_chat.type in ['group', 'supergroup']:
-            update.message.reply_text("请在群组中使用此命令")
+            self.sender.reply(update.message, "请在群组中使用此命令")
             return
             
         if not self.db.is_group_allowed(update.effective_chat.id):
-            update.message.reply_text("此群组不在白名单中")
+            self.sender.reply(update.message, "此群组不在白名单中")
             return
             
         user_id = update.effective_user.id
         user = self.db.get_user(user_id)
         
         if not user:
-            update.message.reply_text("请先发送消息以创建账户")
+            self.sender.reply(update.message, "请先发送消息以创建账户")
             return
             
         if not user[4]:  # 如果没有邀请码
             invite_code = ''.join(random.choices(string.ascii_uppercase + string.digits, k=8))
-            cursor = self.db.conn.cursor()
-            cursor.execute(
-                'UPDATE users SET invite_code = ? WHERE user_id = ?',
-                (invite_code, user_id)
-            )
-            self.db.conn.commit()
+            self.db.set_invite_code(user_id, invite_code)
         else:
             invite_code = user[4]
             
         # 获取群组信息
         chat = context.bot.get_chat(update.effective_chat.id)
         if not chat.username:
-            update.message.reply_text("此群组未设置公开链接，无法生成邀请链接")
+            self.sender.reply(update.message, "此群组未设置公开链接，无法生成邀请链接")
             return
             
         invite_link = f"https://t.me/{chat.username}?start={invite_code}"
         
-        # 获取邀请统计
-        cursor = self.db.conn.cursor()
-        cursor.execute(
-            'SELECT COUNT(*), SUM(points_awarded) FROM invite_history WHERE inviter_id = ?',
-            (user_id,)
-        )
-        invite_stats = cursor.fetchone()
-        
         settings = self.db.get_group_settings(update.effective_chat.id)
         invite_points = settings[5] if settings else 10
         
         update_message = (
             f"🔗 您的邀请链接：\n{invite_link}\n\n"
             f"📊 邀请统计：\n"
-            f"👥 已邀请：{invite_stats[0] or 0} 人\n"
-            f"💰 获得积分：{invite_stats[1] or 0}\n"
+            f"👥 已邀请：{user[8]} 人\n"
+            f"💰 获得积分：{user[9]:g}\n"
             f"✨ 每邀请一人可得：{invite_points} 积分"
         )
         
-        update.message.reply_text(update_message, parse_mode=ParseMode.HTML)
+        self.sender.reply(update.message, update_message, parse_mode=ParseMode.HTML)
 
     def handle_start_command(self, update: Update, context: CallbackContext):
         if len(context.args) == 1:
             invite_code = context.args[0]
-            cursor = self.db.conn.cursor()
-            cursor.execute('SELECT user_id FROM users WHERE invite_code = ?', (invite_code,))
-            inviter = cursor.fetchone()
+            inviter = self.db.get_user_by_invite_code(invite_code)
             
             if inviter:
                 inviter_id = inviter[0]
                 invited_id = update.effective_user.id
                 
-                # 检查是否已经被邀请过
-                cursor.execute(
-                    'SELECT * FROM invite_history WHERE invited_id = ?',
-                    (invited_id,)
-                )
-                if not cursor.fetchone():
-                    # 记录邀请
-                    settings = self.db.get_group_settings(update.effective_chat.id)
-                    invite_points = settings[5] if settings else 10
-                    
-                    cursor.execute(
-                        'INSERT INTO invite_history (inviter_id, invited_id, group_id, points_awarded) VALUES (?, ?, ?, ?)',
-                        (inviter_id, invited_id, update.effective_chat.id, invite_points)
-                    )
-                    self.db.update_points(inviter_id, invite_points)
-                    self.db.conn.commit()
-                    
+                settings = self.db.get_group_settings(update.effective_chat.id)
+                invite_points = settings[5] if settings else 10
+                
+                # 记录邀请，已经被邀请过的用户不再奖励
+                if self.db.record_invite(inviter_id, invited_id, update.effective_chat.id, invite_points):
                     logger.info(f"User {invited_id} was invited by {inviter_id} and awarded {invite_points} points")
\ No newline at end of file
@@ -0,0 +1,147 @@
+from telegram import Update
+from telegram.ext import CallbackContext
+from datetime import datetime
+import threading
+import time
+import logging
+from .database import JOIN_OK, JOIN_ALREADY_JOINED
+
+logger = logging.getLogger(__name__)
+
+class MessageBatcher:
+    """群消息的批量处理：处理器只把消息放入队列，后台线程把一批消息按用户合并积分，
+    连同口令参与在一个事务内写入，提交后再发送参与确认"""
+
+    def __init__(self, db, message_handlers, sender, max_batch=100, max_delay=0.05):
+        self.db = db
+        self.message_handlers = message_handlers
+        self.sender = sender
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+
+        self._cond = threading.Condition()
+        self._updates = []
+        self._stopped = False
+        self._thread = None
+
+        # 统计信息
+        self.batches = 0
+        self.messages = 0
+        self.max_batch_seen = 0
+        self.last_batch_latency = 0.0
+
+    def enqueue(self, update: Update, context: CallbackContext):
+        with self._cond:
+            self._updates.append(update)
+            if len(self._updates) == 1 or len(self._updates) >= self.max_batch:
+                self._cond.notify()
+
+    def _next_batch(self):
+        """等到有消息后再最多等待 max_delay 凑满一批，停止且队列为空时返回 None"""
+        with self._cond:
+            while not self._updates and not self._stopped:
+                self._cond.wait()
+            if not self._updates:
+                return None
+
+            deadline = time.monotonic() + self.max_delay
+            while len(self._updates) < self.max_batch and not self._stopped:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            batch = self._updates[:self.max_batch]
+            del self._updates[:self.max_batch]
+            return batch
+
+    def process(self, updates):
+        """处理一批消息，写入失败时退回逐条处理"""
+        start = time.perf_counter()
+        entries = {}  # (user_id, group_id) -> [username, 积分增量, 最后发言时间]
+        joins = []  # (lottery_id, user_id, username, group_id)
+
+        for update in updates:
+            scored = self.message_handlers.score_message(update)
+            if scored is None:
+                continue
+            group_id, user_id, username, points, lottery_id = scored
+            if lottery_id:
+                joins.append((lottery_id, user_id, username, group_id))
+                continue
+
+            message_time = datetime.now() if points > 0 else None
+            entry = entries.get((user_id, group_id))
+            if entry is None:
+                entries[(user_id, group_id)] = [username, points, message_time]
+            else:
+                entry[0] = username or entry[0]
+                entry[1] += points
+                entry[2] = message_time or entry[2]
+
+        try:
+            results = self.db.apply_message_batch(
+                [(user_id, username, delta, message_time, group_id)
+                 for (user_id, group_id), (username, delta, message_time) in entries.items()],
+                [(lottery_id, user_id, username) for lottery_id, user_id, username, _ in joins]
+            )
+        except Exception as e:
+            logger.error(f"Batch of {len(updates)} messages failed, handling one by one: {str(e)}")
+            for update in updates:
+                try:
+                    self.message_handlers.handle_message(update, None)
+                except Exception as e:
+                    logger.error(f"Message handling failed: {str(e)}")
+            return
+
+        # 事务提交后再发送参与确认
+        for (lottery_id, user_id, username, group_id), result in zip(joins, results):
+            if result == JOIN_OK:
+                self.sender.add_join(group_id, lottery_id, user_id, username)
+            elif result == JOIN_ALREADY_JOINED:
+                self.sender.add_join(group_id, lottery_id, user_id, username, joined=False)
+
+        latency = time.perf_counter() - start
+        self.batches += 1
+        self.messages += len(updates)
+        self.max_batch_seen = max(self.max_batch_seen, len(updates))
+        self.last_batch_latency = latency
+        logger.debug(
+            f"Processed {len(updates)} messages ({len(entries)} users, {len(joins)} joins) "
+            f"in {latency * 1000:.1f}ms"
+        )
+
+    def start(self):
+        def batch_task():
+            while True:
+                batch = self._next_batch()
+                if batch is None:
+                    break
+                try:
+                    self.process(batch)
+                except Exception as e:
+                    logger.error(f"Message batch failed: {str(e)}")
+
+        self._stopped = False
+        self._thread = threading.Thread(target=batch_task, name='message-batcher')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """处理完队列中剩余的消息后停止"""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        logger.info(f"Message batcher stopped: {self.stats()}")
+
+    def stats(self):
+        return {
+            'pending': len(self._updates),
+            'batches': self.batches,
+            'messages': self.messages,
+            'max_batch': self.max_batch_seen,
+            'last_batch_latency_ms': round(self.last_batch_latency * 1000, 2)
+        }
\ No newline at end of file
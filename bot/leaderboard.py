@@ -0,0 +1,97 @@
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+def _rank_key(row):
+    # 余额高的在前，余额相同时按用户ID
+    return -row[2], row[0]
+
+class Leaderboard:
+    """缓存每个群组积分排行的前 size 名
+
+    积分变动时只记录群组内变动的用户，下次查询时只重新读取这些用户的余额合并到缓存；
+    只有缓存中的用户余额下降、无法确定新的前 size 名时才从索引重新读取整个排行
+    """
+
+    def __init__(self, db, size=50):
+        self.db = db
+        self.size = size
+
+        self._lock = threading.Lock()
+        self._top = {}  # group_id -> [(user_id, username, 余额)]，按排名排序
+        self._dirty = {}  # group_id -> 缓存之后积分有变动的 user_id 集合
+
+        # 统计信息
+        self.hits = 0
+        self.merges = 0
+        self.reloads = 0
+
+    def touch(self, changes):
+        """记录积分变动，changes 为 (group_id, user_id) 列表；没有缓存的群组下次查询时整体读取，不需要记录"""
+        with self._lock:
+            for group_id, user_id in changes:
+                if group_id in self._top:
+                    self._dirty.setdefault(group_id, set()).add(user_id)
+
+    def clear(self):
+        with self._lock:
+            self._top.clear()
+            self._dirty.clear()
+
+    def top(self, group_id, limit):
+        """返回群组积分排行的前 limit 名 (user_id, username, 余额)，limit 不超过 size"""
+        with self._lock:
+            return self._refresh(group_id)[:limit]
+
+    def rank(self, group_id, user_id):
+        """返回用户在群组中的 (名次, 余额)，在群组中没有积分记录时返回 None"""
+        with self._lock:
+            rows = self._refresh(group_id)
+        for index, row in enumerate(rows):
+            if row[0] == user_id:
+                return index + 1, row[2]
+        return self.db.get_group_rank(group_id, user_id)
+
+    def _refresh(self, group_id):
+        # 在锁内读取数据库：读取期间提交的变动会等到缓存更新后再记录，不会丢失
+        rows = self._top.get(group_id)
+        dirty = self._dirty.pop(group_id, None)
+        if rows is not None and not dirty:
+            self.hits += 1
+            return rows
+
+        if rows is not None:
+            merged = self._merge(rows, dirty, self.db.get_group_balances(group_id, dirty))
+            if merged is not None:
+                self.merges += 1
+                self._top[group_id] = merged
+                return merged
+
+        rows = self.db.get_group_top(group_id, self.size)
+        self.reloads += 1
+        self._top[group_id] = rows
+        return rows
+
+    def _merge(self, rows, dirty, changed):
+        """把变动用户的新余额合并到缓存的排行，无法确定新的前 size 名时返回 None"""
+        merged = [row for row in rows if row[0] not in dirty] + list(changed)
+        merged.sort(key=_rank_key)
+        if len(rows) < self.size:
+            # 缓存包含群组的全部用户，之后新增的用户都在变动中
+            return merged[:self.size]
+
+        # 缓存之外的用户都排在原来的最后一名之后，只有排在它之前的才能确定名次
+        cutoff = _rank_key(rows[-1])
+        merged = [row for row in merged if _rank_key(row) <= cutoff]
+        if len(merged) < self.size:
+            return None
+        return merged[:self.size]
+
+    def stats(self):
+        return {
+            'groups': len(self._top),
+            'hits': self.hits,
+            'merges': self.merges,
+            'reloads': self.reloads
+        }
\ No newline at end of file
@@ -0,0 +1,115 @@
+from datetime import datetime, timedelta
+import gzip
+import json
+import os
+import threading
+import time
+import logging
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+COMPACTED_ROWS = registry.counter('points_ledger_compacted_total', '合并到 users.points 的账本记录数')
+ARCHIVED_ROWS = registry.counter('points_ledger_archived_total', '归档后从数据库删除的账本记录数')
+
+class LedgerCompactor:
+    """后台把积分账本合并到 users.points；设置了保留天数时，把更早且已合并的账本分段归档到文件后删除"""
+
+    def __init__(self, db, interval=60, batch_size=50000, archive_days=0, archive_dir='ledger_archive'):
+        self.db = db
+        self.interval = interval
+        self.batch_size = batch_size
+        self.archive_days = archive_days
+        self.archive_dir = archive_dir
+
+        self._stopped = threading.Event()
+        self._thread = None
+        self._last_archive = None
+
+        # 统计信息
+        self.runs = 0
+        self.compacted = 0
+        self.archived = 0
+        self.last_duration = 0.0
+
+    def compact(self):
+        """合并全部尚未合并的账本记录，返回合并的条数"""
+        start = time.perf_counter()
+        total = 0
+        while True:
+            # 分批合并，每批一个事务，避免长时间占用写锁
+            count = self.db.compact_ledger(self.batch_size)
+            total += count
+            if count < self.batch_size:
+                break
+        COMPACTED_ROWS.inc(total)
+        self.runs += 1
+        self.compacted += total
+        self.last_duration = time.perf_counter() - start
+        if total:
+            logger.debug(f"Compacted {total} ledger rows in {self.last_duration * 1000:.1f}ms")
+        return total
+
+    def archive(self):
+        """把保留期之前、已合并的账本按段写入 archive_dir 下的 gzip NDJSON 文件并删除，返回归档的条数"""
+        if not self.archive_days:
+            return 0
+        before = datetime.now() - timedelta(days=self.archive_days)
+        os.makedirs(self.archive_dir, exist_ok=True)
+
+        total = 0
+        while True:
+            rows = self.db.export_ledger_segment(before, self.batch_size)
+            if not rows:
+                break
+            path = os.path.join(self.archive_dir, f'ledger_{rows[0][0]:012d}_{rows[-1][0]:012d}.ndjson.gz')
+            with gzip.open(path + '.part', 'wt', encoding='utf-8') as f:
+                for row in rows:
+                    f.write(json.dumps(dict(zip(
+                        ('id', 'user_id', 'group_id', 'delta', 'reason', 'source', 'created_at'), row
+                    )), ensure_ascii=False) + '\n')
+            # 文件完整写入后才删除数据库中的记录
+            os.replace(path + '.part', path)
+            self.db.delete_ledger_rows([row[0] for row in rows])
+            total += len(rows)
+            logger.info(f"Archived {len(rows)} ledger rows to {path}")
+
+        ARCHIVED_ROWS.inc(total)
+        self.archived += total
+        return total
+
+    def start(self):
+        def compact_task():
+            while not self._stopped.wait(self.interval):
+                try:
+                    self.compact()
+                    # 归档每天最多检查一次
+                    now = time.monotonic()
+                    if self.archive_days and (self._last_archive is None or now - self._last_archive >= 86400):
+                        self._last_archive = now
+                        self.archive()
+                except Exception as e:
+                    logger.error(f"Ledger compaction failed: {str(e)}")
+
+        self._stopped.clear()
+        self._thread = threading.Thread(target=compact_task, name='ledger-compactor')
+        self._thread.daemon = True
+        self._thread.start()
+        logger.info("Ledger compactor started")
+
+    def stop(self):
+        """停止后台线程并做最后一次合并"""
+        self._stopped.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        self.compact()
+        logger.info(f"Ledger compactor stopped: {self.stats()}")
+
+    def stats(self):
+        return {
+            'runs': self.runs,
+            'compacted': self.compacted,
+            'archived': self.archived,
+            'last_duration_ms': round(self.last_duration * 1000, 2)
+        }
\ No newline at end of file
@@ -0,0 +1,90 @@
+from telegram import ParseMode
+from telegram.ext import CallbackContext
+from datetime import datetime, timedelta
+import html
+import threading
+import logging
+from .sender import PRIORITY_HIGH
+
+logger = logging.getLogger(__name__)
+
+class LotteryDrawScheduler:
+    """基于 JobQueue 的开奖调度：只在最早结束的抽奖到期时唤醒，开奖后再安排下一次；
+    开奖失败的抽奖仍是进行中，至少等待 retry_delay 秒后再重试"""
+
+    def __init__(self, db, job_queue, sender, retry_delay=60):
+        self.db = db
+        self.job_queue = job_queue
+        self.sender = sender
+        self.retry_delay = retry_delay
+        self._job = None
+        self._next_run = None
+        self._lock = threading.Lock()
+
+    def schedule(self, min_delay=0):
+        """根据最早结束的进行中抽奖安排下一次开奖，过期未开奖的在 min_delay 秒后执行"""
+        next_end = self.db.get_next_lottery_end()
+        with self._lock:
+            if next_end is None:
+                self._cancel()
+                return
+            next_end = max(next_end, datetime.now() + timedelta(seconds=min_delay))
+
+            if self._job and self._next_run and self._next_run <= next_end:
+                return
+
+            self._cancel()
+            delay = max((next_end - datetime.now()).total_seconds(), 0)
+            self._job = self.job_queue.run_once(self._run_draws, delay, name='lottery_draw')
+            self._next_run = next_end
+        logger.info(f"Next lottery draw scheduled at {next_end}")
+
+    def _cancel(self):
+        if self._job:
+            self._job.schedule_removal()
+        self._job = None
+        self._next_run = None
+
+    def _run_draws(self, context: CallbackContext):
+        with self._lock:
+            self._job = None
+            self._next_run = None
+        failed = False
+        try:
+            for lottery in self.db.get_due_lotteries():
+                try:
+                    self.draw(lottery)
+                except Exception as e:
+                    failed = True
+                    logger.error(f"Draw for lottery #{lottery[0]} failed: {str(e)}")
+        except Exception:
+            failed = True
+            raise
+        finally:
+            # 失败的抽奖仍然到期，立即重新安排会反复失败，等待一段时间再试
+            self.schedule(self.retry_delay if failed else 0)
+
+    def draw(self, lottery):
+        lottery_id, group_id = lottery[0], lottery[1]
+        winners = self.db.draw_lottery(lottery_id, lottery[8])
+        if winners is None:
+            return
+
+        self.db.unindex_lottery(group_id, lottery_id)
+        logger.info(f"Lottery #{lottery_id} drawn with {len(winners)} winners")
+
+        text = (
+            f"🎊 抽奖活动 #{lottery_id} 已开奖！\n\n"
+            f"🎁 奖品：{html.escape(lottery[9] or '')}\n"
+        )
+        if winners:
+            text += "🏆 中奖名单：\n" + "\n".join(
+                f"@{username}" if username else f'<a href="tg://user?id={user_id}">{user_id}</a>'
+                for user_id, username in winners
+            )
+        else:
+            text += "😢 无人参与，本次抽奖没有中奖者"
+
+        # 还在汇总窗口内的参与确认先入队，不会出现在开奖通知之后
+        self.sender.flush_digest(group_id, lottery_id, PRIORITY_HIGH)
+        self.sender.send(group_id, text, PRIORITY_HIGH, parse_mode=ParseMode.HTML)
\ No newline at end of file
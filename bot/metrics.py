@@ -0,0 +1,252 @@
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from bisect import bisect_left
+import functools
+import inspect
+import threading
+import time
+import types
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 延迟直方图的桶上限（秒）
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _format_labels(label_name, label):
+    if label_name is None:
+        return ''
+    value = str(label).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return f'{label_name}="{value}"'
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    """只增不减的计数，可以按一个标签区分"""
+
+    type = 'counter'
+
+    def __init__(self, name, help, label_name=None):
+        self.name = name
+        self.help = help
+        self.label_name = label_name
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, amount=1, label=None):
+        with self._lock:
+            self._values[label] = self._values.get(label, 0) + amount
+
+    def get(self, label=None):
+        return self._values.get(label, 0)
+
+    def samples(self):
+        with self._lock:
+            values = list(self._values.items())
+        for label, value in values:
+            yield self.name, _format_labels(self.label_name, label), value
+
+class Gauge:
+    """当前值；指定 callback 时在输出时调用它取值"""
+
+    type = 'gauge'
+
+    def __init__(self, name, help, label_name=None, callback=None):
+        self.name = name
+        self.help = help
+        self.label_name = label_name
+        self.callback = callback
+        self._values = {}
+
+    def set(self, value, label=None):
+        self._values[label] = value
+
+    def get(self, label=None):
+        return self._values.get(label, 0)
+
+    def samples(self):
+        if self.callback:
+            try:
+                value = self.callback()
+            except Exception as e:
+                logger.error(f"Failed to collect {self.name}: {str(e)}")
+                return
+            # 回调可以返回单个值，也可以返回 {标签: 值}
+            values = value.items() if isinstance(value, dict) else [(None, value)]
+        else:
+            values = list(self._values.items())
+        for label, value in values:
+            yield self.name, _format_labels(self.label_name, label), value
+
+class Histogram:
+    """按桶统计的分布，同时记录次数和总和"""
+
+    type = 'histogram'
+
+    def __init__(self, name, help, label_name=None, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_name = label_name
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._values = {}  # 标签 -> [各桶计数（最后一个是 +Inf）, 总和]
+
+    def observe(self, value, label=None):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(label)
+            if entry is None:
+                entry = self._values[label] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def count(self, label=None):
+        entry = self._values.get(label)
+        return sum(entry[0]) if entry else 0
+
+    def samples(self):
+        with self._lock:
+            values = [(label, list(counts), total) for label, (counts, total) in self._values.items()]
+        for label, counts, total in values:
+            labels = _format_labels(self.label_name, label)
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                yield f'{self.name}_bucket', f'{labels},{le}' if labels else le, cumulative
+            yield f'{self.name}_sum', labels, total
+            yield f'{self.name}_count', labels, cumulative
+
+class MetricsRegistry:
+    """进程内的全部指标，按 Prometheus 文本格式输出"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                # 同名指标只注册一次，重复创建时返回已有的
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, help, label_name=None):
+        return self._register(Counter(name, help, label_name))
+
+    def gauge(self, name, help, label_name=None, callback=None):
+        gauge = self._register(Gauge(name, help, label_name, callback))
+        if callback is not None:
+            # 重新创建的对象（如新的 PointsBot）替换旧的回调
+            gauge.callback = callback
+        return gauge
+
+    def histogram(self, name, help, label_name=None, buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, help, label_name, buckets))
+
+    def render(self):
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda metric: metric.name)
+        lines = []
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{{{labels}}} {_format_value(value)}' if labels else f'{name} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+registry = MetricsRegistry()
+
+HANDLER_SECONDS = registry.histogram('points_handler_seconds', '处理器执行耗时', 'handler')
+HANDLER_ERRORS = registry.counter('points_handler_errors_total', '处理器抛出的异常数', 'handler')
+DB_CALL_SECONDS = registry.histogram('points_db_call_seconds', 'Database 方法执行耗时', 'method')
+DB_SLOW_CALLS = registry.counter('points_db_slow_calls_total', '超过慢查询阈值的 Database 方法调用数', 'method')
+
+def timed(callback, histogram, label, errors=None, slow_threshold=None, slow_counter=None):
+    """包装一个函数，记录每次调用的耗时；超过 slow_threshold（秒）时记一条警告"""
+    @functools.wraps(callback)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return callback(*args, **kwargs)
+        except Exception:
+            if errors is not None:
+                errors.inc(label=label)
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            histogram.observe(elapsed, label)
+            if slow_threshold is not None and elapsed >= slow_threshold:
+                if slow_counter is not None:
+                    slow_counter.inc(label=label)
+                logger.warning(f"Slow call {label}: {elapsed * 1000:.1f} ms")
+    wrapper._timed = True
+    return wrapper
+
+def instrumented(slow_threshold=None, exclude=()):
+    """Database 的类装饰器：为所有公开方法记录调用次数和耗时，超过 slow_threshold（秒）的调用记为慢查询"""
+    def decorate(cls):
+        for name, value in list(vars(cls).items()):
+            # 静态方法、属性和私有方法不计；生成器只有创建时在方法内，耗时没有意义
+            if name.startswith('_') or name in exclude or not isinstance(value, types.FunctionType):
+                continue
+            if inspect.isgeneratorfunction(value):
+                continue
+            setattr(cls, name, timed(
+                value, DB_CALL_SECONDS, name, slow_threshold=slow_threshold, slow_counter=DB_SLOW_CALLS
+            ))
+        return cls
+    return decorate
+
+def instrument_dispatcher(dispatcher):
+    """为分发器中已注册的全部处理器记录执行耗时和异常数，按回调函数名区分"""
+    for handlers in dispatcher.handlers.values():
+        for handler in handlers:
+            if getattr(handler.callback, '_timed', False):
+                continue
+            label = getattr(handler.callback, '__qualname__', repr(handler.callback))
+            handler.callback = timed(handler.callback, HANDLER_SECONDS, label, HANDLER_ERRORS)
+
+class MetricsServer:
+    """在本地端口以 Prometheus 文本格式提供 /metrics"""
+
+    def __init__(self, registry, host='127.0.0.1', port=9108):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._server = None
+
+    def start(self):
+        registry = self.registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        thread = threading.Thread(target=self._server.serve_forever, name='metrics')
+        thread.daemon = True
+        thread.start()
+        logger.info(f"Metrics available at http://{self.host}:{self.port}/metrics")
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
\ No newline at end of file
@@ -0,0 +1,49 @@
+from telegram import Update
+from telegram.ext import CallbackContext
+import gzip
+import json
+import threading
+import time
+import zlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+class UpdateRecorder:
+    """把收到的更新连同接收时间追加写入日志，每行一条 [时间戳, 更新]，文件名以 .gz 结尾时压缩"""
+
+    def __init__(self, path, flush_every=100):
+        self.path = path
+        self.flush_every = flush_every
+        opener = gzip.open if path.endswith('.gz') else open
+        self._file = opener(path, 'at', encoding='utf-8')
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def record(self, update: Update, context: CallbackContext):
+        line = json.dumps([round(time.time(), 3), update.to_dict()], ensure_ascii=False, separators=(',', ':'))
+        with self._lock:
+            self._file.write(line + '\n')
+            self.count += 1
+            if self.count % self.flush_every == 0:
+                self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+        logger.info(f"Update recorder closed: {self.count} updates written to {self.path}")
+
+def read_update_log(path):
+    """逐条读取更新日志，返回 (时间戳, 更新数据)；进程异常退出时写了一半的末尾会被忽略"""
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8') as f:
+        try:
+            for line in f:
+                try:
+                    timestamp, payload = json.loads(line)
+                except ValueError:
+                    logger.warning(f"Skipped a truncated record in {path}")
+                    continue
+                yield timestamp, payload
+        except (EOFError, zlib.error) as e:
+            logger.warning(f"Update log {path} ends with an incomplete block: {str(e)}")
\ No newline at end of file
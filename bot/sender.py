@@ -0,0 +1,223 @@
+from telegram.error import RetryAfter, TelegramError
+import heapq
+import itertools
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 发送优先级，数值越小越先发送
+PRIORITY_HIGH = 0  # 开奖结果等重要通知
+PRIORITY_NORMAL = 1  # 普通回复
+PRIORITY_LOW = 2  # 参与确认汇总等可以延后、积压过多时可以丢弃的消息
+
+class MessageSender:
+    """统一的发送队列：处理器只负责入队，由后台线程按优先级发送，
+    同时遵守全局和每个聊天的发送频率限制；同一抽奖的参与确认在汇总窗口内合并为一条消息"""
+
+    def __init__(self, bot, global_rate=25, group_interval=3.0, private_interval=1.0,
+                 digest_window=5.0, max_low_backlog=20, workers=4):
+        self.bot = bot
+        self.global_rate = global_rate
+        self.group_interval = group_interval
+        self.private_interval = private_interval
+        self.digest_window = digest_window
+        self.max_low_backlog = max_low_backlog
+        self.workers = workers
+
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+        self._chats = {}  # chat_id -> 待发送消息堆 [(优先级, 序号, 发送参数)]
+        self._entries = {}  # chat_id -> 调度堆中该聊天有效条目的序号
+        self._waiting = []  # 冷却中的聊天 [(可发送时间, 序号, chat_id)]
+        self._runnable = []  # 可立即发送的聊天 [(队首优先级, 序号, chat_id)]
+        self._next_allowed = {}  # chat_id -> 下次允许发送的时间
+        self._digests = {}  # (chat_id, lottery_id) -> [截止时间, 新参与者名单, 已参与过的人数]
+        self._tokens = float(global_rate)
+        self._refilled = time.monotonic()
+        self._stopped = False
+        self._threads = []
+
+        # 统计信息
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self.retried = 0
+        self.digests = 0
+
+    def send(self, chat_id, text, priority=PRIORITY_NORMAL, **kwargs):
+        """消息入队后立即返回，kwargs 原样传给 bot.send_message"""
+        with self._cond:
+            queue = self._chats.setdefault(chat_id, [])
+            if priority >= PRIORITY_LOW and len(queue) >= self.max_low_backlog:
+                # 聊天积压过多时丢弃低优先级消息
+                self.dropped += 1
+                return False
+            heapq.heappush(queue, (priority, next(self._seq), dict(kwargs, chat_id=chat_id, text=text)))
+            self._schedule(chat_id)
+            self._cond.notify()
+        return True
+
+    def reply(self, message, text, priority=PRIORITY_NORMAL, **kwargs):
+        """回复一条消息，原消息已删除时直接发送"""
+        return self.send(
+            message.chat_id, text, priority,
+            reply_to_message_id=message.message_id, allow_sending_without_reply=True, **kwargs
+        )
+
+    def add_join(self, chat_id, lottery_id, user_id, username, joined=True):
+        """记录一次抽奖参与（joined 为 False 表示已经参与过），汇总窗口结束后合并发送"""
+        with self._cond:
+            digest = self._digests.get((chat_id, lottery_id))
+            if digest is None:
+                digest = [time.monotonic() + self.digest_window, [], 0]
+                self._digests[(chat_id, lottery_id)] = digest
+                self._cond.notify()
+            if joined:
+                digest[1].append(f"@{username}" if username else str(user_id))
+            else:
+                digest[2] += 1
+
+    def flush_digest(self, chat_id, lottery_id, priority=PRIORITY_NORMAL):
+        """立即把抽奖的参与确认汇总按 priority 入队，不等汇总窗口结束
+
+        开奖通知入队前调用，参与确认先于同一优先级的开奖通知发送
+        """
+        with self._cond:
+            if (chat_id, lottery_id) in self._digests:
+                self._queue_digest((chat_id, lottery_id), priority)
+                self._cond.notify()
+
+    def _schedule(self, chat_id):
+        """为有待发送消息的聊天添加调度条目，旧条目在取出时作废"""
+        queue = self._chats.get(chat_id)
+        if not queue:
+            self._entries.pop(chat_id, None)
+            return
+        seq = next(self._seq)
+        self._entries[chat_id] = seq
+        ready_at = self._next_allowed.get(chat_id, 0)
+        if ready_at <= time.monotonic():
+            heapq.heappush(self._runnable, (queue[0][0], seq, chat_id))
+        else:
+            heapq.heappush(self._waiting, (ready_at, seq, chat_id))
+
+    def _flush_digests(self, force=False):
+        now = time.monotonic()
+        for key, (deadline, _, _) in list(self._digests.items()):
+            if force or deadline <= now:
+                self._queue_digest(key, PRIORITY_NORMAL)
+
+    def _queue_digest(self, key, priority):
+        _, names, repeated = self._digests.pop(key)
+        chat_id, lottery_id = key
+        lines = []
+        if names:
+            shown = '、'.join(names[:20])
+            more = f" 等 {len(names)} 人" if len(names) > 20 else ''
+            lines.append(f"✅ {shown}{more} 成功参与抽奖 #{lottery_id}！")
+        if repeated:
+            lines.append(f"另有 {repeated} 人已经参与过此抽奖")
+        self.digests += 1
+        queue = self._chats.setdefault(chat_id, [])
+        heapq.heappush(queue, (priority, next(self._seq), {'chat_id': chat_id, 'text': '\n'.join(lines)}))
+        self._schedule(chat_id)
+
+    def _next_message(self):
+        """等待并取出下一条可以发送的消息，停止且队列为空时返回 None"""
+        with self._cond:
+            while True:
+                self._flush_digests(force=self._stopped)
+                now = time.monotonic()
+
+                while self._waiting and self._waiting[0][0] <= now:
+                    _, seq, chat_id = heapq.heappop(self._waiting)
+                    if self._entries.get(chat_id) == seq:
+                        heapq.heappush(self._runnable, (self._chats[chat_id][0][0], seq, chat_id))
+
+                # 全局令牌桶
+                self._tokens = min(self.global_rate, self._tokens + (now - self._refilled) * self.global_rate)
+                self._refilled = now
+
+                while self._runnable and self._entries.get(self._runnable[0][2]) != self._runnable[0][1]:
+                    heapq.heappop(self._runnable)
+
+                if self._runnable and self._tokens >= 1:
+                    _, _, chat_id = heapq.heappop(self._runnable)
+                    self._tokens -= 1
+                    _, _, message = heapq.heappop(self._chats[chat_id])
+                    interval = self.group_interval if chat_id < 0 else self.private_interval
+                    self._next_allowed[chat_id] = now + interval
+                    if not self._chats[chat_id]:
+                        del self._chats[chat_id]
+                    self._schedule(chat_id)
+                    return message
+
+                if self._stopped and not self._chats and not self._digests:
+                    return None
+
+                # 睡到最近的一个事件：令牌恢复、聊天冷却结束或汇总到期
+                deadlines = [now + 1]
+                if self._runnable:
+                    deadlines.append(now + (1 - self._tokens) / self.global_rate)
+                if self._waiting:
+                    deadlines.append(self._waiting[0][0])
+                if self._digests:
+                    deadlines.append(min(digest[0] for digest in self._digests.values()))
+                self._cond.wait(max(min(deadlines) - now, 0.001))
+
+    def _work(self):
+        while True:
+            message = self._next_message()
+            if message is None:
+                return
+            try:
+                self.bot.send_message(**message)
+                self.sent += 1
+            except RetryAfter as e:
+                # 被限流时整个聊天暂停到指定时间后再重新发送
+                self.retried += 1
+                with self._cond:
+                    chat_id = message['chat_id']
+                    self._next_allowed[chat_id] = time.monotonic() + e.retry_after
+                    heapq.heappush(self._chats.setdefault(chat_id, []), (PRIORITY_HIGH, next(self._seq), message))
+                    self._schedule(chat_id)
+                    self._cond.notify()
+            except TelegramError as e:
+                self.failed += 1
+                logger.error(f"Failed to send message to {message['chat_id']}: {str(e)}")
+
+    def start(self):
+        self._stopped = False
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f'sender-{i}')
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=30):
+        """停止接收新的汇总，发送完队列中的消息后退出"""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(max(deadline - time.monotonic(), 0))
+        self._threads = []
+        logger.info(f"Message sender stopped: {self.stats()}")
+
+    def pending_count(self):
+        with self._cond:
+            return sum(len(queue) for queue in self._chats.values())
+
+    def stats(self):
+        return {
+            'pending': self.pending_count(),
+            'pending_digests': len(self._digests),
+            'sent': self.sent,
+            'failed': self.failed,
+            'dropped': self.dropped,
+            'retried': self.retried,
+            'digests': self.digests
+        }
\ No newline at end of file
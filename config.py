@@ -10,8 +10,27 @@ WEBDAV_CONFIG = {
     'webdav_password': os.getenv('WEBDAV_PASSWORD')
 }
 
+# 运行方式：polling 长轮询，webhook 由本地 HTTP 监听接收更新
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL')  # 自定义 Bot API 地址（如本地测试服务器），为空时使用官方地址
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '127.0.0.1')  # webhook 本地监听地址
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8443'))  # webhook 本地监听端口
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')  # Telegram 访问的公网地址，不含路径
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', 'webhook')  # webhook 路径，建议设置为不易猜测的值
+WEBHOOK_MAX_CONNECTIONS = 40  # Telegram 向 webhook 并发推送的最大连接数
+
+# 更新处理
+UPDATE_WORKERS = int(os.getenv('UPDATE_WORKERS', '8'))  # 处理命令的线程数
+UPDATE_QUEUE_SIZE = 1000  # 长轮询模式下待处理更新的队列上限，满时暂停拉取更新；webhook 模式不设上限
+POLL_INTERVAL = 0.0  # 两次长轮询之间的间隔（秒）
+POLL_TIMEOUT = 10  # 长轮询等待更新的时间（秒）
+POLL_READ_LATENCY = 2.0  # 长轮询请求在 POLL_TIMEOUT 之外额外等待响应的时间（秒）
+
+UPDATE_LOG = os.getenv('UPDATE_LOG')  # 记录收到的更新的日志文件（.gz 结尾时压缩），为空时不记录，可用 tools/replay.py 重放
+
 # 管理员配置
 SUPER_ADMIN = int(os.getenv('SUPER_ADMIN'))
+ADMIN_CACHE_TTL = 600  # 群组管理员列表的缓存时间（秒），期间由成员变动更新
 
 # 群组白名单
 ALLOWED_GROUPS = [int(x.strip()) for x in os.getenv('ALLOWED_GROUPS', '').split(',') if x.strip()]
@@ -23,12 +42,63 @@ DEFAULT_DAILY_POINTS = 5
 DEFAULT_INVITE_POINTS = 10
 MIN_WORDS_FOR_POINTS = 5
 
+# 群组积分排行
+LEADERBOARD_SIZE = 50  # 每个群组缓存的排行名次，也是 /top 最多显示的人数
+LEADERBOARD_DEFAULT = 10  # /top 不指定人数时显示的人数
+
 # 数据库设置
 DATABASE_FILE = 'bot_data.db'
+POINTS_FLUSH_INTERVAL = 5  # 积分缓冲写入间隔（秒）
+POINTS_FLUSH_SIZE = 500  # 缓冲中的用户数达到该值时立即写入
+LEDGER_COMPACT_INTERVAL = 60  # 积分账本合并到用户积分的间隔（秒）
+LEDGER_COMPACT_BATCH = 50000  # 每个事务最多合并的账本记录数
+LEDGER_ARCHIVE_DAYS = int(os.getenv('LEDGER_ARCHIVE_DAYS', '0'))  # 账本保留天数，更早且已合并的记录归档后删除，0 表示不归档
+LEDGER_ARCHIVE_DIR = os.getenv('LEDGER_ARCHIVE_DIR', 'ledger_archive')  # 账本归档文件目录
+
+# SQLite 调优
+SQLITE_PROFILE = {
+    'journal_mode': 'WAL',  # 读写并发，读不会被写阻塞
+    'synchronous': 'NORMAL',  # WAL 模式下只在检查点时同步
+    'cache_size': -16000,  # 页缓存大小，负数表示 KB
+    'mmap_size': 268435456,  # 内存映射读取的最大字节数
+    'busy_timeout': 5000  # 等待锁的最长时间（毫秒）
+}
 
 # 备份设置
-BACKUP_INTERVAL = 3600  # 每小时备份一次
+BACKUP_INTERVAL = 3600  # 有写入时最长间隔多久备份一次（秒），没有写入时不备份
+BACKUP_MIN_INTERVAL = 300  # 两次备份之间的最短间隔（秒）
+BACKUP_BURST_WRITES = 5000  # 写入行数达到该值时提前备份
+BACKUP_CHECK_INTERVAL = 30  # 检查是否需要备份的间隔（秒）
+BACKUP_FULL_EVERY = 24  # 每隔多少次备份重新读取全部表（其余备份只重新生成有变化的分块）
+BACKUP_KEEP = 10  # 保留最近几个备份清单，未被引用的分块会被清理
+BACKUP_CHUNK_ROWS = 5000  # 每个备份分块包含的行数，增量备份时超过两倍的分块会被拆分
+BACKUP_SPOOL_SIZE = 16 * 1024 * 1024  # 恢复旧格式备份时，下载的文件超过该大小后改用临时文件缓存
+BACKUP_SNAPSHOT_FILE = 'bot_data.snapshot.db'  # 备份时使用的本地快照文件
+BACKUP_SNAPSHOT_PAGES = 256  # 生成快照时每步复制的页数
+BACKUP_SNAPSHOT_SLEEP = 0.005  # 每步之间让出的时间（秒）
+BACKUP_LOCAL_DIR = os.getenv('BACKUP_LOCAL_DIR')  # 额外的本地备份目录，为空时只备份到 WebDAV
+BACKUP_RETRIES = 3  # 上传、下载失败时的最多尝试次数
+BACKUP_RETRY_DELAY = 2  # 首次重试前的等待时间（秒），之后每次翻倍
+RESTORE_IN_BACKGROUND = False  # 远端备份较新时是否在后台恢复（恢复期间机器人已开始处理消息）
+
+# 群消息批量处理：开启后一批消息的积分和口令参与在一个事务内写入
+INGEST_BATCH = os.getenv('INGEST_BATCH', '').lower() in ('1', 'true', 'yes')
+INGEST_BATCH_SIZE = 100  # 每批最多处理的消息数
+INGEST_BATCH_DELAY = 0.05  # 收到第一条消息后最多等待多久凑满一批（秒）
+
+# 消息发送设置
+SEND_GLOBAL_RATE = 25  # 全局每秒最多发送的消息数
+SEND_GROUP_INTERVAL = 3.0  # 同一群组两条消息之间的最短间隔（秒）
+SEND_PRIVATE_INTERVAL = 1.0  # 同一私聊两条消息之间的最短间隔（秒）
+SEND_DIGEST_WINDOW = 5.0  # 抽奖参与确认的汇总窗口（秒）
+SEND_WORKERS = 4  # 发送线程数
+
+# 监控指标：以 Prometheus 文本格式在本地提供 /metrics，端口为 0 时不启动
+METRICS_LISTEN = os.getenv('METRICS_LISTEN', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9108'))
+DB_SLOW_QUERY_MS = 100  # Database 方法耗时超过该值（毫秒）时记录警告
 
 # 抽奖设置
 MAX_LOTTERY_DURATION = 168  # 最长抽奖时间（小时）
-MAX_WINNERS = 50  # 单次抽奖最大获奖人数
\ No newline at end of file
+MAX_WINNERS = 50  # 单次抽奖最大获奖人数
+DRAW_RETRY_DELAY = 60  # 开奖失败后等待多久再重试（秒）
\ No newline at end of file
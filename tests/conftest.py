@@ -0,0 +1,6 @@
+import os
+import sys
+
+# config 在导入时读取必需的环境变量
+os.environ.setdefault('SUPER_ADMIN', '0')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
\ No newline at end of file
@@ -0,0 +1,125 @@
+import json
+import os
+from datetime import datetime
+
+import pytest
+
+from bot import backup as backup_module
+from bot.backup import BackupManager, CHUNK_DIR
+from bot.backup_targets import LocalTarget
+from bot.database import Database, BACKUP_TABLES
+
+GROUPS = [-1001234567891, -1009876543213, -107]
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    # 备份快照写在当前目录
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+def open_database(path):
+    db = Database(str(path))
+    db.points_buffer.stop()
+    return db
+
+def seed(db, users=300):
+    for group_id in GROUPS:
+        db.allow_group(group_id)
+        db.set_group_settings(group_id, {'min_words': 3, 'points_per_word': 0.5, 'daily_points': 7})
+    db.apply_points_batch([
+        (user_id, f'user{user_id}', user_id % 7 + 1, datetime.now(), GROUPS[user_id % len(GROUPS)])
+        for user_id in range(100000, 100000 + users * 9973, 9973)
+    ])
+    db.record_invite(100000, 109973, GROUPS[0], 10)
+    db.compact_ledger()
+
+def table_rows(db):
+    return {
+        table: sorted(tuple(sorted(row.items())) for row in db.iter_rows(table))
+        for table in BACKUP_TABLES
+    }
+
+def restore_into(path, target):
+    db = open_database(path)
+    assert BackupManager([target], db).restore_if_needed()
+    return db
+
+def test_round_trip_keeps_negative_rowids(workdir):
+    db = open_database(workdir / 'a.db')
+    seed(db)
+    target = LocalTarget(str(workdir / 'remote'))
+    manager = BackupManager([target], db)
+    assert manager.backup()
+
+    # 分块按行数划分：稀疏的用户ID不会让每个用户单独成为一个分块
+    chunks = [f for f in os.listdir(workdir / 'remote' / CHUNK_DIR) if f.endswith('.ndjson.gz')]
+    assert len(chunks) <= len(BACKUP_TABLES)
+
+    restored = restore_into(workdir / 'b.db', target)
+    assert table_rows(restored) == table_rows(db)
+    assert restored.get_group_settings(GROUPS[0]).points_per_word == 0.5
+    restored.close()
+    db.close()
+
+def test_incremental_backup_splits_and_round_trips(workdir, monkeypatch):
+    monkeypatch.setattr(backup_module, 'BACKUP_CHUNK_ROWS', 10)
+    db = open_database(workdir / 'a.db')
+    seed(db, users=50)
+    target = LocalTarget(str(workdir / 'remote'))
+    manager = BackupManager([target], db)
+    assert manager.backup(full=True)
+
+    # 在最小的负数 rowid 之前、分块之间和最后一个分块之后写入，最后一个分块超过两倍大小后拆分
+    db.set_group_settings(-2000000000003, {'points_per_word': 2})
+    db.set_group_settings(GROUPS[1], {'points_per_word': 0.3})
+    db.apply_points_batch([
+        (user_id, f'late{user_id}', 1, datetime.now(), GROUPS[0]) for user_id in range(1, 40)
+    ] + [
+        (user_id, f'new{user_id}', 1, datetime.now(), GROUPS[2]) for user_id in range(10 ** 9, 10 ** 9 + 40)
+    ])
+    db.update_points(100000, -1, group_id=GROUPS[0])
+    db.compact_ledger()
+    assert manager.backup()
+    users_chunks = [key for key in json.loads(db.get_meta('backup_chunk_ranges')) if key.startswith('users:')]
+    assert len(users_chunks) >= (50 + 79) // 20
+
+    restored = restore_into(workdir / 'b.db', target)
+    assert table_rows(restored) == table_rows(db)
+    assert restored.get_group_settings(-2000000000003).points_per_word == 2
+    assert restored.get_group_settings(GROUPS[1]).points_per_word == 0.3
+    restored.close()
+    db.close()
+
+def test_legacy_backup_is_restored_only_once(workdir):
+    target = LocalTarget(str(workdir / 'remote'))
+    target.ensure_dir('backups')
+    legacy = {'users': [{'user_id': 1, 'username': 'old', 'points': 5}], 'group_settings': [{'group_id': -107}]}
+    (workdir / 'remote' / 'backups' / 'backup_20240101_000000.json').write_text(json.dumps(legacy))
+
+    db = open_database(workdir / 'a.db')
+    manager = BackupManager([target], db)
+    assert manager.restore_if_needed()
+    assert db.get_user(1)[1] == 'old'
+
+    # 本地的修改不会在下次启动时被同一份旧备份覆盖
+    db.set_invite_code(1, 'LOCAL')
+    assert not manager.restore_if_needed()
+    assert db.get_user(1)[4] == 'LOCAL'
+
+    # 存储上出现更新的旧格式备份时仍会恢复
+    (workdir / 'remote' / 'backups' / 'backup_20240102_000000.json').write_text(json.dumps(legacy))
+    assert manager.restore_if_needed()
+    db.close()
+
+def test_restored_users_do_not_double_group_points(workdir):
+    db = open_database(workdir / 'a.db')
+    db.apply_points_batch([(1, 'u1', 5, datetime.now(), GROUPS[0]), (2, 'u2', 3, datetime.now(), GROUPS[0])])
+    db.compact_ledger()
+    assert db.get_group_rank(GROUPS[0], 1) == (1, 5.0)
+
+    # 旧备份中的用户记录没有 ledger_seq，本地的 group_points 行不在备份中
+    db.import_records([{'table': 'users', 'row': {'user_id': 1, 'username': 'u1', 'points': 5}}])
+    db.compact_ledger()
+    assert db.get_group_rank(GROUPS[0], 1) == (1, 5.0)
+    assert [row[2] for row in db.get_group_top(GROUPS[0], 10)] == [5.0, 3.0]
+    db.close()
\ No newline at end of file
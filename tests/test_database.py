@@ -0,0 +1,278 @@
+from datetime import datetime, timedelta
+import random
+import sqlite3
+
+import pytest
+
+from bot.database import (
+    Database, MIGRATIONS, JOIN_OK, JOIN_ALREADY_JOINED, JOIN_INSUFFICIENT_POINTS, JOIN_NOT_ACTIVE
+)
+
+GROUP = -1001234567891
+
+@pytest.fixture
+def db(tmp_path):
+    # 不启动后台刷新线程，测试中按需调用 flush
+    database = Database(str(tmp_path / 'test.db'))
+    database.points_buffer.stop()
+    yield database
+    database.close()
+
+def create_lottery(db, points_required=0, winners_count=1):
+    end_time = datetime.now() + timedelta(hours=1)
+    return db.create_lottery(GROUP, 1, points_required, '', end_time, 0, winners_count, 'prize')
+
+def count(db, sql, params=()):
+    return db._query_one(f'SELECT COUNT(*) {sql}', params)[0]
+
+def test_update_points_flushes_buffered_new_user(db):
+    # 只在缓冲中有消息积分的用户还没有用户记录
+    db.points_buffer.add(1, 'u1', 3, datetime.now(), GROUP)
+    assert db.update_points(1, 10, group_id=GROUP)
+    assert db.get_balance(1) == 13
+    assert not db.update_points(2, 10, group_id=GROUP)
+
+def test_settings_cache_ignores_rows_read_before_a_change(db, monkeypatch):
+    db.allow_group(GROUP)
+    db.set_group_settings(GROUP, {'points_per_word': 0.5})
+    db._settings_cache.pop(GROUP)
+
+    # 缓存未命中的读取在读到旧数据之后、写入缓存之前，设置被修改
+    query_one = db._query_one
+    def stale_read(sql, params=()):
+        row = query_one(sql, params)
+        db.set_group_settings(GROUP, {'points_per_word': 2})
+        return row
+    monkeypatch.setattr(db, '_query_one', stale_read)
+    assert db.get_group_settings(GROUP).points_per_word == 0.5
+    monkeypatch.undo()
+    assert db.get_group_settings(GROUP).points_per_word == 2
+
+def test_join_lottery_statuses(db):
+    db.apply_points_batch([(1, 'rich', 10, datetime.now(), GROUP), (2, 'poor', 3, datetime.now(), GROUP)])
+    lottery_id = create_lottery(db, points_required=4)
+
+    assert db.join_lottery(lottery_id, 1, 'rich', 4) == JOIN_OK
+    assert db.get_balance(1) == 6
+    assert db.join_lottery(lottery_id, 1, 'rich', 4) == JOIN_ALREADY_JOINED
+    assert db.get_balance(1) == 6
+
+    # 积分不足时参与记录随事务回滚，也不计入写入量
+    writes = db.write_count
+    assert db.join_lottery(lottery_id, 2, 'poor', 4) == JOIN_INSUFFICIENT_POINTS
+    assert db.write_count == writes
+    assert count(db, 'FROM lottery_participants WHERE user_id = 2') == 0
+    assert count(db, "FROM points_ledger WHERE user_id = 2 AND reason = 'lottery'") == 0
+    assert db.get_balance(2) == 3
+
+    assert db.draw_lottery(lottery_id, 1) == [(1, 'rich')]
+    assert db.join_lottery(lottery_id, 2, 'poor', 0) == JOIN_NOT_ACTIVE
+    assert db.join_lottery(lottery_id + 1, 2, 'poor', 0) == JOIN_NOT_ACTIVE
+    assert count(db, 'FROM lottery_participants') == 1
+
+def test_draw_lottery_picks_winners_once(db):
+    lottery_id = create_lottery(db, winners_count=5)
+    for user_id in range(1, 31):
+        assert db.join_lottery(lottery_id, user_id, f'u{user_id}') == JOIN_OK
+
+    winners = db.draw_lottery(lottery_id, 5)
+    assert len(set(winners)) == 5
+    assert {user_id for user_id, _ in winners} <= set(range(1, 31))
+    assert db.get_lottery(lottery_id)[7] == 'finished'
+    assert count(db, 'FROM lottery_participants WHERE is_winner') == 5
+
+    # 已开奖的抽奖不会再次开奖，也不会改变中奖记录
+    assert db.draw_lottery(lottery_id, 5) is None
+    assert sorted(
+        user_id for (user_id,) in db._query('SELECT user_id FROM lottery_participants WHERE is_winner')
+    ) == sorted(user_id for user_id, _ in winners)
+
+    # 参与人数少于中奖人数时全部中奖
+    small = create_lottery(db, winners_count=5)
+    db.join_lottery(small, 1, 'u1')
+    db.join_lottery(small, 2, 'u2')
+    assert sorted(db.draw_lottery(small, 5)) == [(1, 'u1'), (2, 'u2')]
+
+def test_compact_ledger_is_idempotent(db):
+    now = datetime.now()
+    db.apply_points_batch([(user_id, f'u{user_id}', user_id, now, GROUP) for user_id in range(1, 21)])
+    db.update_points(3, -2, group_id=GROUP)
+    db.checkin(4, 5, GROUP)
+    expected = {user_id: db.get_balance(user_id) for user_id in range(1, 21)}
+
+    def stored():
+        return dict(db._query('SELECT user_id, points FROM users'))
+
+    # 分批合并，每一步余额都等于已合并的积分加上账本中之后的变动
+    while db.compact_ledger(batch_size=7):
+        assert {user_id: db.get_balance(user_id) for user_id in expected} == expected
+    assert stored() == expected
+    assert db.compact_ledger() == 0
+    assert stored() == expected
+
+    # 重新从头检查账本也不会重复计算
+    db.set_meta('ledger_compacted_id', 0)
+    db.compact_ledger()
+    assert stored() == expected
+
+    db.apply_points_batch([(1, 'u1', 5, now, GROUP)])
+    assert db.get_balance(1) == expected[1] + 5
+    assert stored()[1] == expected[1]
+
+def test_failed_flush_is_merged_back_into_buffer(db, monkeypatch):
+    buffer = db.points_buffer
+    earlier, later = datetime(2024, 1, 1, 12), datetime(2024, 1, 1, 13)
+    buffer.add(1, 'u1', 3, earlier, GROUP)
+
+    # 写入期间又收到一条消息，然后写入失败
+    def fail(entries):
+        buffer.add(1, None, 2, later, GROUP)
+        buffer.add(2, 'u2', 1, later, None)
+        raise RuntimeError('database is locked')
+    monkeypatch.setattr(db, 'apply_points_batch', fail)
+    with pytest.raises(RuntimeError):
+        buffer.flush()
+    assert buffer.pending_points() == 6
+
+    monkeypatch.undo()
+    assert buffer.flush() == 2
+    assert db.get_balance(1) == 5
+    assert db.get_balance(2) == 1
+    assert db.get_user(1)[1] == 'u1'
+    assert db.get_group_rank(GROUP, 1) == (1, 5)
+
+def test_group_ranking_matches_brute_force(db):
+    rng = random.Random(0)
+    other = GROUP - 1
+    users = range(1, 61)
+
+    def add_activity():
+        db.apply_points_batch([
+            (user_id, f'u{user_id}', rng.randint(1, 5), datetime.now(), rng.choice([GROUP, GROUP, other]))
+            for user_id in rng.sample(users, 40)
+        ])
+        for user_id in rng.sample(users, 5):
+            db.update_points(user_id, -rng.randint(1, 10), group_id=GROUP)
+
+    def expected():
+        rows = db._query(
+            "SELECT user_id, SUM(delta) FROM points_ledger WHERE group_id = ? AND reason != 'lottery' GROUP BY user_id",
+            (GROUP,)
+        )
+        return sorted(rows, key=lambda row: (-row[1], row[0]))
+
+    def check():
+        ranking = expected()
+        for limit in (1, 10, len(ranking)):
+            assert [(row[0], row[2]) for row in db.get_group_top(GROUP, limit)] == ranking[:limit]
+            assert [(row[0], row[2]) for row in db.leaderboard.top(GROUP, limit)] == ranking[:limit]
+        # 余额相同时按用户ID排名
+        for position, (user_id, balance) in enumerate(ranking, 1):
+            assert db.get_group_rank(GROUP, user_id) == (position, balance)
+            assert db.leaderboard.rank(GROUP, user_id) == (position, balance)
+        assert db.get_group_rank(GROUP, 1000) is None
+
+    add_activity()
+    check()
+    # 部分合并后账本末尾仍有未合并的变动
+    db.compact_ledger(batch_size=30)
+    check()
+    add_activity()
+    lottery_id = create_lottery(db, points_required=3)
+    for user_id in rng.sample(users, 10):
+        db.join_lottery(lottery_id, user_id, f'u{user_id}', 3)
+    check()
+    while db.compact_ledger(batch_size=25):
+        check()
+
+# 迁移前的表结构
+BASELINE_SCHEMA = '''
+CREATE TABLE users (
+    user_id INTEGER PRIMARY KEY, username TEXT, points REAL DEFAULT 0, last_checkin DATE,
+    invite_code TEXT UNIQUE, invited_by INTEGER, joined_date DATETIME, last_message_time DATETIME
+);
+CREATE TABLE group_settings (
+    group_id INTEGER PRIMARY KEY, min_words INTEGER DEFAULT 5, points_per_word REAL DEFAULT 0.1,
+    points_per_media INTEGER DEFAULT 1, daily_points INTEGER DEFAULT 5, invite_points INTEGER DEFAULT 10,
+    is_allowed BOOLEAN DEFAULT 0
+);
+CREATE TABLE lotteries (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, group_id INTEGER, creator_id INTEGER, points_required INTEGER,
+    keyword TEXT, end_time DATETIME, max_participants INTEGER, status TEXT, winners_count INTEGER,
+    prize_description TEXT, prize_type TEXT, created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE lottery_participants (
+    lottery_id INTEGER, user_id INTEGER, username TEXT, join_time DATETIME DEFAULT CURRENT_TIMESTAMP,
+    is_winner BOOLEAN DEFAULT 0
+);
+CREATE TABLE invite_history (
+    inviter_id INTEGER, invited_id INTEGER, group_id INTEGER, invite_time DATETIME DEFAULT CURRENT_TIMESTAMP,
+    points_awarded INTEGER
+);
+'''
+
+def test_migrations_on_baseline_database_with_duplicates(tmp_path):
+    path = str(tmp_path / 'old.db')
+    conn = sqlite3.connect(path)
+    conn.executescript(BASELINE_SCHEMA)
+    conn.executemany('INSERT INTO users (user_id, username, points) VALUES (?, ?, ?)', [
+        (1, 'u1', 12), (2, 'u2', 30), (3, 'u3', 0)
+    ])
+    conn.execute(
+        "INSERT INTO lotteries (group_id, points_required, keyword, end_time, status, winners_count) "
+        "VALUES (?, 0, 'go', ?, 'active', 1)", (GROUP, datetime.now() + timedelta(hours=1))
+    )
+    conn.executemany('INSERT INTO lottery_participants (lottery_id, user_id, username) VALUES (?, ?, ?)', [
+        (1, 1, 'u1'), (1, 1, 'u1'), (1, 2, 'u2')
+    ])
+    # 同一用户被邀请了两次，保留最早的记录
+    conn.executemany(
+        'INSERT INTO invite_history (inviter_id, invited_id, group_id, points_awarded) VALUES (?, ?, ?, ?)',
+        [(2, 3, GROUP, 10), (1, 3, GROUP, 10)]
+    )
+    conn.commit()
+    conn.close()
+
+    db = Database(path)
+    db.points_buffer.stop()
+    try:
+        assert db.get_schema_version() == MIGRATIONS[-1][0]
+        assert count(db, 'FROM lottery_participants') == 2
+        assert db._query('SELECT inviter_id FROM invite_history') == [(2,)]
+        assert db.get_invite_stats(2) == (1, 10)
+        assert db.get_invite_stats(1) == (0, 0)
+        assert db.get_balance(1) == 12
+        assert db.find_keyword_lottery(GROUP, 'go') == 1
+
+        # 迁移后的唯一约束生效
+        assert db.join_lottery(1, 2, 'u2') == JOIN_ALREADY_JOINED
+        assert not db.record_invite(1, 3, GROUP, 10)
+
+        # 积分按账本记录，升级前的积分不计入任何群组
+        db.update_points(1, 5, group_id=GROUP)
+        db.compact_ledger()
+        assert db.get_balance(1) == 17
+        assert db.get_group_rank(GROUP, 1) == (1, 5)
+    finally:
+        db.close()
+
+def test_migration_removes_lottery_spending_from_group_points(tmp_path):
+    path = str(tmp_path / 'test.db')
+    db = Database(path)
+    db.points_buffer.stop()
+    db.apply_points_batch([(1, 'u1', 10, datetime.now(), GROUP)])
+    db.join_lottery(create_lottery(db, points_required=4), 1, 'u1', 4)
+    db.compact_ledger()
+    assert db.get_group_rank(GROUP, 1) == (1, 10)
+
+    # 此前的版本把抽奖消耗合并进了群组余额
+    with db.transaction() as cursor:
+        cursor.execute('UPDATE group_points SET points = points - 4')
+        cursor.execute('PRAGMA user_version = 7')
+    db.close()
+
+    db = Database(path)
+    db.points_buffer.stop()
+    assert db.get_group_rank(GROUP, 1) == (1, 10)
+    assert db.get_balance(1) == 6
+    db.close()
\ No newline at end of file
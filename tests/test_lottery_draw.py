@@ -0,0 +1,38 @@
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+from bot.lottery_draw import LotteryDrawScheduler
+
+class FailingDatabase:
+    """到期的抽奖开奖时总是失败"""
+
+    def __init__(self):
+        self.end_time = datetime.now() - timedelta(minutes=1)
+
+    def get_next_lottery_end(self):
+        return self.end_time
+
+    def get_due_lotteries(self):
+        return [(1, -100, None, 0, None, None, self.end_time, 'active', 1, 'prize')]
+
+    def draw_lottery(self, lottery_id, winners_count):
+        raise RuntimeError('database is locked')
+
+class RecordingJobQueue:
+    def __init__(self):
+        self.delays = []
+
+    def run_once(self, callback, delay, name=None):
+        self.delays.append(delay)
+        return SimpleNamespace(schedule_removal=lambda: None)
+
+def test_failed_draw_is_retried_after_delay():
+    job_queue = RecordingJobQueue()
+    scheduler = LotteryDrawScheduler(FailingDatabase(), job_queue, sender=None, retry_delay=60)
+    scheduler.schedule()
+    assert job_queue.delays == [0]
+
+    scheduler._run_draws(None)
+    assert job_queue.delays[-1] == pytest.approx(60, abs=1)
\ No newline at end of file
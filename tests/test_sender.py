@@ -0,0 +1,13 @@
+from bot.sender import MessageSender, PRIORITY_HIGH
+
+def test_join_digest_is_sent_before_draw_announcement():
+    sender = MessageSender(bot=None, group_interval=0, digest_window=60)
+    sender.add_join(-100, 7, 1, 'alice')
+    sender.flush_digest(-100, 7, PRIORITY_HIGH)
+    sender.send(-100, '开奖', PRIORITY_HIGH)
+
+    first = sender._next_message()
+    assert '@alice' in first['text'] and '#7' in first['text']
+    assert sender._next_message()['text'] == '开奖'
+    # 汇总已经发出，之后不会再发送
+    assert not sender._digests
\ No newline at end of file
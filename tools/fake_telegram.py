@@ -0,0 +1,219 @@
+"""本地模拟的 Telegram Bot API，用于在不连接 Telegram 的情况下测试机器人
+
+启动：
+    python tools/fake_telegram.py --port 8081 --admins 123456
+
+机器人使用 TELEGRAM_API_URL=http://127.0.0.1:8081/bot 连接。长轮询模式下更新由 getUpdates 取走，
+机器人调用 setWebhook 后改为向 webhook 地址推送。
+
+测试接口：
+    POST /_inject    注入更新，可以是完整的 Update，也可以是 {"chat_id", "user_id", "username", "text"}
+    GET  /_sent      机器人发出的消息
+    GET  /_stats     请求和更新计数
+"""
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from urllib.request import Request, urlopen
+import argparse
+import itertools
+import json
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'FakeBot', 'username': 'fake_bot'}
+
+class FakeTelegram:
+    """保存模拟服务器的状态：待取走的更新、webhook 地址、发出的消息和各方法的调用次数"""
+
+    def __init__(self, admins=()):
+        self.admins = set(admins)
+        self.webhook_url = None
+        self.sent = []
+        self.calls = {}
+        self.delivered = 0
+
+        self._cond = threading.Condition()
+        self._updates = []
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+
+    def make_update(self, chat_id, user_id, text, username=None):
+        """构造一条文字消息更新，chat_id 为负数时视为超级群组"""
+        now = int(time.time())
+        user = {'id': user_id, 'is_bot': False, 'first_name': str(user_id)}
+        if username:
+            user['username'] = username
+        chat = {'id': chat_id, 'type': 'supergroup' if chat_id < 0 else 'private'}
+        if chat_id < 0:
+            chat['title'] = str(chat_id)
+        message = {'message_id': next(self._message_ids), 'date': now, 'chat': chat, 'from': user, 'text': text}
+        if text.startswith('/'):
+            command = text.split()[0]
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(command)}]
+        return {'message': message}
+
+    def inject(self, update):
+        """加入一条更新：设置了 webhook 时立即推送，否则等待 getUpdates 取走"""
+        update = dict(update, update_id=next(self._update_ids))
+        if self.webhook_url:
+            self._push(update)
+            return update['update_id']
+        with self._cond:
+            self._updates.append(update)
+            self._cond.notify_all()
+        return update['update_id']
+
+    def _push(self, update):
+        request = Request(
+            self.webhook_url, json.dumps(update).encode('utf-8'), {'Content-Type': 'application/json'}
+        )
+        try:
+            urlopen(request, timeout=10).close()
+            self.delivered += 1
+        except Exception as e:
+            logger.error(f"Webhook delivery failed: {str(e)}")
+
+    def get_updates(self, offset=0, limit=100, timeout=0):
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            # 确认 offset 之前的更新
+            self._updates = [update for update in self._updates if update['update_id'] >= offset]
+            while not self._updates and time.monotonic() < deadline:
+                self._cond.wait(deadline - time.monotonic())
+            updates = self._updates[:limit]
+        self.delivered += len(updates)
+        return updates
+
+    def call(self, method, params):
+        """执行一个 Bot API 方法，返回 result 字段的内容"""
+        self.calls[method] = self.calls.get(method, 0) + 1
+        now = int(time.time())
+
+        if method == 'getMe':
+            return BOT_USER
+        if method == 'setWebhook':
+            self.webhook_url = params.get('url') or None
+            return True
+        if method == 'deleteWebhook':
+            self.webhook_url = None
+            return True
+        if method == 'getUpdates':
+            return self.get_updates(
+                int(params.get('offset', 0)), int(params.get('limit', 100)), float(params.get('timeout', 0))
+            )
+        if method in ('sendMessage', 'editMessageText'):
+            chat_id = int(params['chat_id']) if 'chat_id' in params else 0
+            self.sent.append({'method': method, 'chat_id': chat_id, 'text': params.get('text'), 'time': time.time()})
+            return {
+                'message_id': next(self._message_ids), 'date': now, 'from': BOT_USER,
+                'chat': {'id': chat_id, 'type': 'supergroup' if chat_id < 0 else 'private'},
+                'text': params.get('text', '')
+            }
+        if method == 'getChatAdministrators':
+            return [
+                {'user': {'id': user_id, 'is_bot': False, 'first_name': str(user_id)}, 'status': 'administrator'}
+                for user_id in sorted(self.admins)
+            ]
+        if method == 'getChatMember':
+            user_id = int(params['user_id'])
+            status = 'administrator' if user_id in self.admins else 'member'
+            return {'user': {'id': user_id, 'is_bot': False, 'first_name': str(user_id)}, 'status': status}
+        if method in ('answerCallbackQuery', 'deleteMessage'):
+            return True
+        raise KeyError(method)
+
+    def stats(self):
+        with self._cond:
+            pending = len(self._updates)
+        return {
+            'calls': dict(self.calls),
+            'sent': len(self.sent),
+            'delivered': self.delivered,
+            'pending': pending,
+            'webhook_url': self.webhook_url
+        }
+
+def make_handler(telegram):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            logger.debug(format % args)
+
+        def _reply(self, payload, status=200):
+            body = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _params(self):
+            url = urlparse(self.path)
+            params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+            length = int(self.headers.get('Content-Length') or 0)
+            if length:
+                body = self.rfile.read(length)
+                if self.headers.get('Content-Type', '').startswith('application/json'):
+                    params.update(json.loads(body))
+                else:
+                    params.update({key: values[-1] for key, values in parse_qs(body.decode('utf-8')).items()})
+            return url.path, params
+
+        def do_GET(self):
+            self.do_POST()
+
+        def do_POST(self):
+            path, params = self._params()
+            if path == '/_inject':
+                update = params if 'update_id' in params or 'message' in params else telegram.make_update(
+                    int(params['chat_id']), int(params['user_id']), params['text'], params.get('username')
+                )
+                return self._reply({'ok': True, 'update_id': telegram.inject(update)})
+            if path == '/_sent':
+                return self._reply(telegram.sent)
+            if path == '/_stats':
+                return self._reply(telegram.stats())
+
+            # /bot<token>/<method>
+            parts = path.strip('/').split('/')
+            if len(parts) != 2 or not parts[0].startswith('bot'):
+                return self._reply({'ok': False, 'error_code': 404, 'description': 'Not Found'}, 404)
+            try:
+                return self._reply({'ok': True, 'result': telegram.call(parts[1], params)})
+            except KeyError as e:
+                return self._reply({'ok': False, 'error_code': 400, 'description': f'Unsupported: {e}'}, 400)
+
+    return Handler
+
+def serve(port=8081, admins=(), host='127.0.0.1'):
+    """在后台线程启动模拟服务器，返回 (FakeTelegram, HTTPServer)"""
+    telegram = FakeTelegram(admins)
+    server = ThreadingHTTPServer((host, port), make_handler(telegram))
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name='fake-telegram')
+    thread.daemon = True
+    thread.start()
+    return telegram, server
+
+def main():
+    parser = argparse.ArgumentParser(description='本地模拟的 Telegram Bot API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--admins', default='', help='群组管理员的用户ID，逗号分隔')
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    admins = [int(x) for x in args.admins.split(',') if x.strip()]
+    telegram, server = serve(args.port, admins, args.host)
+    logger.info(f"Fake Telegram API listening on http://{args.host}:{args.port}/bot")
+    try:
+        while True:
+            time.sleep(60)
+            logger.info(f"Stats: {telegram.stats()}")
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == '__main__':
+    main()
\ No newline at end of file
@@ -0,0 +1,67 @@
+"""邀请数据维护
+
+    python tools/invites.py rebuild                  # 按邀请记录重新计算所有用户的邀请计数
+    python tools/invites.py tree 12345 --depth 3     # 输出用户的多级邀请树和每层的统计
+
+默认使用 DATABASE_FILE，可以用 --db 指定其他数据库文件
+"""
+import argparse
+import logging
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('SUPER_ADMIN', '0')
+
+from config import DATABASE_FILE
+from bot.database import Database
+
+def print_tree(user_id, rows):
+    """按邀请关系缩进输出，并汇总每层的人数和奖励积分"""
+    children = {}
+    levels = {}
+    for depth, inviter_id, invited_id, username, invite_time, points_awarded, invite_count in rows:
+        children.setdefault(inviter_id, []).append((invited_id, username, invite_time, points_awarded, invite_count))
+        level = levels.setdefault(depth, [0, 0])
+        level[0] += 1
+        level[1] += points_awarded or 0
+
+    def walk(inviter_id, indent):
+        for invited_id, username, invite_time, points_awarded, invite_count in children.get(inviter_id, []):
+            name = f'@{username}' if username else str(invited_id)
+            print(f'{"  " * indent}- {name} ({invited_id})  {invite_time}  +{points_awarded or 0}  下级 {invite_count} 人')
+            walk(invited_id, indent + 1)
+
+    print(f'{user_id}')
+    walk(user_id, 1)
+    print()
+    for depth in sorted(levels):
+        count, points = levels[depth]
+        print(f'第 {depth} 层：{count} 人，奖励积分 {points}')
+    print(f'合计：{len(rows)} 人')
+
+def main():
+    parser = argparse.ArgumentParser(description='邀请数据维护')
+    parser.add_argument('--db', default=DATABASE_FILE, help='数据库文件')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('rebuild', help='按邀请记录重新计算所有用户的邀请计数')
+    tree = commands.add_parser('tree', help='输出用户的多级邀请树')
+    tree.add_argument('user_id', type=int)
+    tree.add_argument('--depth', type=int, default=5, help='最多展开的层数')
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.WARNING)
+
+    if not os.path.exists(args.db):
+        parser.error(f"{args.db} does not exist")
+    db = Database(args.db)
+    try:
+        if args.command == 'rebuild':
+            print(f'修正了 {db.rebuild_invite_counters()} 个用户的邀请计数')
+        else:
+            print_tree(args.user_id, db.get_invite_tree(args.user_id, args.depth))
+    finally:
+        db.close()
+
+if __name__ == '__main__':
+    main()
\ No newline at end of file
@@ -0,0 +1,272 @@
+"""重放 UPDATE_LOG 记录的更新，在临时数据库和假的 bot 上复现真实的流量
+
+    python tools/replay.py updates.log.gz --speed 1       # 按记录时的节奏重放
+    python tools/replay.py updates.log.gz --speed 10      # 10 倍速
+    python tools/replay.py updates.log.gz --speed 0       # 尽快重放
+    python tools/replay.py updates.log.gz --base-db bot_data.db --compare-db after.db --report report.json
+
+报告处理延迟（每条更新从计划送达到分发完成的时间）和最终数据库状态；指定 --compare-db 时
+逐表比较与参考数据库的差异，时间类字段默认不参与比较。积分账本的分批方式和合并进度取决于时间，
+不逐行比较，改为比较每个用户的积分余额和各群组的积分余额
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('SUPER_ADMIN', '0')
+os.environ['UPDATE_LOG'] = ''  # 重放时不再记录
+
+from telegram import Update
+from telegram.ext import TypeHandler
+from bot.bot import PointsBot
+from bot.database import BACKUP_TABLES, BALANCE_SQL, GROUP_TAIL_SQL
+from bot.recorder import read_update_log
+from benchmarks.fakes import FakeBot
+
+logger = logging.getLogger('replay')
+
+VOLATILE_COLUMNS = (
+    'joined_date,last_message_time,last_checkin,join_time,created_at,invite_time,invite_code,'
+    'users.points,ledger_seq'
+)
+VOLATILE_TABLES = ('points_ledger', 'group_points')
+FLOAT_TOLERANCE = 1e-6
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+def copy_database(source, target):
+    """用在线备份 API 复制数据库，包含 WAL 中尚未合并的内容"""
+    src = sqlite3.connect(source)
+    dst = sqlite3.connect(target)
+    try:
+        src.backup(dst)
+    finally:
+        src.close()
+        dst.close()
+
+def summarize(db_file):
+    """数据库的简要状态：各表行数、积分总和"""
+    conn = sqlite3.connect(db_file)
+    try:
+        summary = {table: conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0] for table in BACKUP_TABLES}
+        summary['total_points'] = round(conn.execute(f'SELECT COALESCE(SUM({BALANCE_SQL}), 0) FROM users').fetchone()[0], 2)
+        return summary
+    finally:
+        conn.close()
+
+def diff_databases(db_file, reference, ignore, samples=10):
+    """按 rowid 逐表比较两个数据库，返回每张表新增、缺少和不同的行数及部分示例"""
+    conn = sqlite3.connect(db_file)
+    conn.execute('ATTACH DATABASE ? AS ref', (reference,))
+    try:
+        result = {}
+        for table in BACKUP_TABLES:
+            if table in VOLATILE_TABLES:
+                continue
+            columns = [
+                row[1] for row in conn.execute(f'PRAGMA table_info({table})')
+                if row[1] not in ignore and f'{table}.{row[1]}' not in ignore
+            ]
+            # 积分按不同批次累加时浮点误差不同，数值相差很小时视为相同
+            compared = ' OR '.join(
+                f"(a.{c} IS NOT b.{c} AND NOT (typeof(a.{c}) IN ('integer', 'real') "
+                f"AND typeof(b.{c}) IN ('integer', 'real') AND abs(a.{c} - b.{c}) < {FLOAT_TOLERANCE}))"
+                for c in columns
+            ) or '0'
+            extra = conn.execute(
+                f'SELECT COUNT(*) FROM main.{table} WHERE rowid NOT IN (SELECT rowid FROM ref.{table})'
+            ).fetchone()[0]
+            missing = conn.execute(
+                f'SELECT COUNT(*) FROM ref.{table} WHERE rowid NOT IN (SELECT rowid FROM main.{table})'
+            ).fetchone()[0]
+            changed = conn.execute(f'''
+                SELECT a.rowid, {', '.join(f'a.{c}' for c in columns)}, {', '.join(f'b.{c}' for c in columns)}
+                FROM main.{table} a JOIN ref.{table} b ON a.rowid = b.rowid WHERE {compared}
+            ''').fetchall()
+            result[table] = {
+                'extra': extra,
+                'missing': missing,
+                'changed': len(changed),
+                'samples': [
+                    {
+                        'rowid': row[0],
+                        'replay': dict(zip(columns, row[1:1 + len(columns)])),
+                        'reference': dict(zip(columns, row[1 + len(columns):]))
+                    }
+                    for row in changed[:samples]
+                ]
+            }
+        return result
+    finally:
+        conn.close()
+
+def load_balances(db_file):
+    conn = sqlite3.connect(db_file)
+    try:
+        return dict(conn.execute(f'SELECT user_id, {BALANCE_SQL} FROM users'))
+    finally:
+        conn.close()
+
+def load_group_balances(db_file):
+    """各群组中每个用户的积分余额，键为 群组ID:用户ID"""
+    conn = sqlite3.connect(db_file)
+    try:
+        groups = [row[0] for row in conn.execute(
+            'SELECT group_id FROM group_points UNION SELECT group_id FROM points_ledger WHERE group_id IS NOT NULL'
+        )]
+        balances = {}
+        for group_id in groups:
+            for user_id, balance in conn.execute(f'''
+                WITH {GROUP_TAIL_SQL}
+                SELECT user_id, SUM(points) FROM (
+                    SELECT user_id, points FROM group_points WHERE group_id = :group
+                    UNION ALL SELECT user_id, delta FROM tail
+                ) GROUP BY user_id
+            ''', {'group': group_id}):
+                balances[f'{group_id}:{user_id}'] = balance
+        return balances
+    finally:
+        conn.close()
+
+def diff_balances(db_file, reference, load=load_balances, samples=10):
+    """比较两个数据库中每个用户的积分余额"""
+    replayed, expected = load(db_file), load(reference)
+    changed = [
+        user_id for user_id in replayed.keys() & expected.keys()
+        if abs(replayed[user_id] - expected[user_id]) >= FLOAT_TOLERANCE
+    ]
+    return {
+        'extra': len(replayed.keys() - expected.keys()),
+        'missing': len(expected.keys() - replayed.keys()),
+        'changed': len(changed),
+        'samples': [
+            {'user_id': user_id, 'replay': replayed[user_id], 'reference': expected[user_id]}
+            for user_id in sorted(changed)[:samples]
+        ]
+    }
+
+def replay(records, bot, fake_bot, speed):
+    """把记录的更新按时间间隔（除以 speed）放入分发队列，返回每条更新的处理延迟（秒）"""
+    scheduled = {}
+    lags = []
+    done = threading.Event()
+    lock = threading.Lock()
+
+    def mark_done(update, context):
+        finished = time.perf_counter()
+        with lock:
+            lags.append(finished - scheduled.pop(id(update)))
+            if len(lags) == len(records):
+                done.set()
+
+    # 在所有处理器之后记录完成时间；异步处理器只计到分发完成
+    bot.dp.add_handler(TypeHandler(Update, mark_done), group=1000)
+
+    dispatcher = threading.Thread(target=bot.dp.start, name='dispatcher')
+    dispatcher.daemon = True
+    dispatcher.start()
+    bot.updater.job_queue.start()
+    bot.draw_scheduler.schedule()
+
+    updates = [Update.de_json(payload, fake_bot) for _, payload in records]
+    first = records[0][0] if records else 0
+    start = time.perf_counter()
+    for (timestamp, _), update in zip(records, updates):
+        target = start + (timestamp - first) / speed if speed else time.perf_counter()
+        delay = target - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        with lock:
+            scheduled[id(update)] = target
+        bot.dp.update_queue.put(update)
+
+    if records:
+        done.wait()
+    elapsed = time.perf_counter() - start
+    # 停止分发器时等待异步处理器执行完
+    bot.dp.stop()
+    bot.updater.job_queue.stop()
+    return lags, elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description='重放记录的更新')
+    parser.add_argument('log', help='UPDATE_LOG 记录的日志文件')
+    parser.add_argument('--speed', type=float, default=1.0, help='重放倍速，0 表示尽快重放')
+    parser.add_argument('--limit', type=int, help='最多重放的更新数')
+    parser.add_argument('--base-db', help='重放前的初始数据库，会复制一份使用，不会被修改')
+    parser.add_argument('--db', help='重放使用的数据库文件，默认在临时目录中创建')
+    parser.add_argument('--compare-db', help='与重放结果比较的参考数据库')
+    parser.add_argument('--ignore-columns', default=VOLATILE_COLUMNS, help='比较时忽略的字段，逗号分隔')
+    parser.add_argument('--admins', default='', help='视为群组管理员的用户ID，逗号分隔')
+    parser.add_argument('--report', help='把报告写入 JSON 文件')
+    parser.add_argument('--log-level', default='WARNING')
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=args.log_level)
+
+    records = list(read_update_log(args.log))
+    if args.limit:
+        records = records[:args.limit]
+
+    workdir = tempfile.mkdtemp(prefix='points-replay-')
+    db_file = args.db or os.path.join(workdir, 'replay.db')
+    if os.path.exists(db_file):
+        parser.error(f"{db_file} already exists")
+    if args.base_db:
+        copy_database(args.base_db, db_file)
+
+    fake_bot = FakeBot(int(x) for x in args.admins.split(',') if x.strip())
+    bot = PointsBot('replay', {}, db_file, bot=fake_bot, backup_targets=[])
+    # 假的 bot 不需要遵守发送频率限制
+    bot.sender.global_rate = 1e9
+    bot.sender.group_interval = bot.sender.private_interval = 0
+
+    try:
+        lags, elapsed = replay(records, bot, fake_bot, args.speed)
+    finally:
+        if bot.message_batcher:
+            bot.message_batcher.stop()
+        bot.sender.stop()
+        bot.db.close()
+
+    report = {
+        'log': args.log,
+        'updates': len(records),
+        'speed': args.speed,
+        'recorded_seconds': round(records[-1][0] - records[0][0], 3) if records else 0,
+        'replay_seconds': round(elapsed, 3),
+        'updates_per_sec': round(len(records) / elapsed, 1) if elapsed else 0.0,
+        'lag_p50_ms': round(percentile(lags, 0.50) * 1000, 3),
+        'lag_p99_ms': round(percentile(lags, 0.99) * 1000, 3),
+        'lag_max_ms': round(max(lags, default=0) * 1000, 3),
+        'messages_sent': fake_bot.sent,
+        'state': summarize(db_file),
+        'db': db_file if args.db else None
+    }
+    if args.compare_db:
+        ignore = {column.strip() for column in args.ignore_columns.split(',') if column.strip()}
+        report['diff'] = diff_databases(db_file, args.compare_db, ignore)
+        report['diff']['balances'] = diff_balances(db_file, args.compare_db)
+        report['diff']['group_balances'] = diff_balances(db_file, args.compare_db, load_group_balances)
+
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if not args.db:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
\ No newline at end of file